@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Benchmark event-loop lag under concurrent memory writes
+
+Runs a heartbeat task that should wake every few milliseconds while many
+concurrent "requests" write facts and notes to memory, once with the
+synchronous API (what the web routes and tools used to do) and once with
+the async API. The lag is how late the heartbeat woke up: every millisecond
+of lag is a millisecond every other request on the server was stalled.
+
+    uv run python bench_memory_loop_lag.py --writers 50 --writes 20
+"""
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+
+from chatkit.memory import ChatKitMemoryTool
+
+
+async def heartbeat(interval: float, lags: list, stop: asyncio.Event):
+    """Record how late the loop wakes a task that sleeps for interval"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - start - interval))
+
+
+async def sync_writer(memory: ChatKitMemoryTool, writer: int, writes: int):
+    for i in range(writes):
+        memory.add_user_fact(f"writer_{writer}_fact_{i}", "value")
+        memory.add_note(f"Writer {writer} note {i}", "benchmark content")
+        await asyncio.sleep(0)
+
+
+async def async_writer(memory: ChatKitMemoryTool, writer: int, writes: int):
+    for i in range(writes):
+        await memory.aadd_user_fact(f"writer_{writer}_fact_{i}", "value")
+        await memory.aadd_note(f"Writer {writer} note {i}", "benchmark content")
+
+
+async def run(mode: str, writers: int, writes: int, max_dirty_ops: int, interval: float):
+    with tempfile.TemporaryDirectory() as storage_dir:
+        memory = ChatKitMemoryTool(storage_dir, max_dirty_ops=max_dirty_ops)
+        writer = sync_writer if mode == "sync" else async_writer
+
+        lags: list = []
+        stop = asyncio.Event()
+        beat = asyncio.create_task(heartbeat(interval, lags, stop))
+        await asyncio.sleep(interval * 2)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(writer(memory, w, writes) for w in range(writers)))
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        await beat
+        memory.close()
+
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    return {
+        "mode": mode,
+        "ops_per_s": writers * writes * 2 / elapsed,
+        "p50_ms": statistics.median(lags_ms),
+        "p99_ms": lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))],
+        "max_ms": lags_ms[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=50, help="Concurrent writers")
+    parser.add_argument("--writes", type=int, default=20, help="Facts and notes per writer")
+    parser.add_argument(
+        "--max-dirty-ops",
+        type=int,
+        default=1,
+        help="Journal flush threshold (1 = fsync every write, the worst case)",
+    )
+    parser.add_argument("--interval", type=float, default=0.005, help="Heartbeat interval (s)")
+    args = parser.parse_args()
+
+    print(f"{'mode':<6} {'ops/s':>10} {'lag p50':>10} {'lag p99':>10} {'lag max':>10}")
+    for mode in ("sync", "async"):
+        result = asyncio.run(
+            run(mode, args.writers, args.writes, args.max_dirty_ops, args.interval)
+        )
+        print(
+            f"{result['mode']:<6} {result['ops_per_s']:>10.0f} "
+            f"{result['p50_ms']:>8.2f}ms {result['p99_ms']:>8.2f}ms {result['max_ms']:>8.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
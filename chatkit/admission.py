@@ -0,0 +1,252 @@
+"""Admission control for model runs
+
+Each provider has a concurrency limit, and optionally each of its models
+too. A run that finds no free slot waits in the provider's queue until a
+slot frees up or its deadline passes. The queue is fair across sessions:
+sessions take turns round-robin, so one session sending many requests at
+once cannot starve the others.
+"""
+
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+import asyncio
+import os
+import time
+
+from pydantic_ai.exceptions import AgentRunError
+
+
+class AdmissionRejected(AgentRunError):
+    """Raised when a run cannot get a slot in time or the queue is full"""
+
+    def __init__(self, provider: str, reason: str, retry_in: float):
+        self.provider = provider
+        self.reason = reason
+        self.retry_in = retry_in
+        super().__init__(f"Provider {provider} is at capacity ({reason}), retry later")
+
+
+class _Waiter:
+    __slots__ = ("session_id", "model", "future", "enqueued")
+
+    def __init__(self, session_id: str, model: str):
+        self.session_id = session_id
+        self.model = model
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+
+
+class ProviderGate:
+    """Concurrency slots of one provider and the fair queue waiting for them"""
+
+    def __init__(self, limit: int, model_limit: int = 0, wait_window: int = 1000):
+        self.limit = limit
+        self.model_limit = model_limit
+        self.in_flight = 0
+        self.models: Dict[str, int] = {}
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._waits: Deque[float] = deque(maxlen=wait_window)
+        self._stats = {"admitted": 0, "queued": 0, "timed_out": 0, "rejected": 0}
+
+    @property
+    def depth(self) -> int:
+        """Number of runs waiting for a slot"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _has_slot(self, model: str) -> bool:
+        if self.in_flight >= self.limit:
+            return False
+        return not self.model_limit or self.models.get(model, 0) < self.model_limit
+
+    def _take(self, model: str, waited: float):
+        self.in_flight += 1
+        self.models[model] = self.models.get(model, 0) + 1
+        self._stats["admitted"] += 1
+        self._waits.append(waited)
+
+    def count(self, event: str):
+        self._stats[event] += 1
+
+    def try_acquire(self, model: str) -> bool:
+        """Take a slot if one is free and nobody is waiting for it"""
+        if self._queues or not self._has_slot(model):
+            return False
+        self._take(model, 0.0)
+        return True
+
+    def enqueue(self, waiter: _Waiter):
+        self._queues.setdefault(waiter.session_id, deque()).append(waiter)
+        self.count("queued")
+        # Free slots may be held back only for models at their own limit
+        self._dispatch()
+
+    def remove(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.session_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            del self._queues[waiter.session_id]
+        # The waiter may have been what blocked the sessions behind it
+        self._dispatch()
+
+    def release(self, model: str):
+        self.in_flight -= 1
+        self.models[model] -= 1
+        if not self.models[model]:
+            del self.models[model]
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to waiting sessions in round-robin order"""
+        while self.in_flight < self.limit:
+            for session_id, queue in self._queues.items():
+                waiter = queue[0]
+                if self._has_slot(waiter.model):
+                    break
+            else:
+                return
+
+            queue.popleft()
+            if queue:
+                self._queues.move_to_end(session_id)
+            else:
+                del self._queues[session_id]
+            self._take(waiter.model, time.monotonic() - waiter.enqueued)
+            waiter.future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        return {
+            "limit": self.limit,
+            "model_limit": self.model_limit,
+            "in_flight": self.in_flight,
+            "models": dict(self.models),
+            "queue_depth": self.depth,
+            "sessions_waiting": len(self._queues),
+            **self._stats,
+            "wait": {
+                "avg": sum(waits) / len(waits) if waits else 0.0,
+                "p95": waits[round(0.95 * (len(waits) - 1))] if waits else 0.0,
+                "max": waits[-1] if waits else 0.0,
+            },
+        }
+
+
+class AdmissionController:
+    """Per-provider gates in front of every upstream model run
+
+    Gates are used from the event loop only and need no locking.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 32,
+        provider_limits: Optional[Dict[str, int]] = None,
+        model_limit: int = 0,
+        queue_timeout: float = 30.0,
+        max_queue: int = 1000,
+    ):
+        self.max_concurrency = max_concurrency
+        self.provider_limits = provider_limits or {}
+        self.model_limit = model_limit
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self._gates: Dict[str, ProviderGate] = {}
+
+    def gate(self, provider: str) -> ProviderGate:
+        """Return the gate of a provider, creating it on first use"""
+        gate = self._gates.get(provider)
+        if gate is None:
+            limit = self.provider_limits.get(provider, self.max_concurrency)
+            gate = self._gates[provider] = ProviderGate(limit, self.model_limit)
+        return gate
+
+    @asynccontextmanager
+    async def admit(
+        self, provider: str, model: str, session_id: str
+    ) -> AsyncIterator[None]:
+        """Hold a slot of a provider and model for the duration of the block
+
+        Waits in the fair queue when none is free. Raises AdmissionRejected
+        if the queue is full or the wait exceeds ``queue_timeout``.
+        """
+        gate = self.gate(provider)
+        if not gate.try_acquire(model):
+            await self._wait(gate, provider, model, session_id)
+        try:
+            yield
+        finally:
+            gate.release(model)
+
+    async def _wait(self, gate: ProviderGate, provider: str, model: str, session_id: str):
+        if gate.depth >= self.max_queue:
+            gate.count("rejected")
+            raise AdmissionRejected(provider, "queue full", self.queue_timeout)
+
+        waiter = _Waiter(session_id, model)
+        gate.enqueue(waiter)
+        try:
+            await asyncio.wait({waiter.future}, timeout=self.queue_timeout)
+        except BaseException:
+            if waiter.future.done():
+                gate.release(model)  # Admitted just as the wait was cancelled
+            else:
+                gate.remove(waiter)
+            raise
+        if not waiter.future.done():
+            gate.remove(waiter)
+            gate.count("timed_out")
+            raise AdmissionRejected(provider, "queue timeout", self.queue_timeout)
+
+    def try_acquire(self, provider: str, model: str) -> bool:
+        """Take a slot without queueing; release it with ``release``"""
+        return self.gate(provider).try_acquire(model)
+
+    def release(self, provider: str, model: str):
+        self.gate(provider).release(model)
+
+    @asynccontextmanager
+    async def holding(self, provider: str, model: str) -> AsyncIterator[None]:
+        """Release a slot taken with ``try_acquire`` at the end of the block"""
+        try:
+            yield
+        finally:
+            self.release(provider, model)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return limits, queue depth and wait times per provider"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "queue_timeout": self.queue_timeout,
+            "max_queue": self.max_queue,
+            "providers": {name: gate.stats() for name, gate in self._gates.items()},
+        }
+
+
+def _provider_limits() -> Dict[str, int]:
+    """Per-provider limits, e.g. ``openai=64,anthropic=16``"""
+    limits = {}
+    for item in os.getenv("CHATKIT_ADMISSION_PROVIDER_LIMITS", "").split(","):
+        key, _, value = item.partition("=")
+        if key.strip() and value.strip():
+            limits[key.strip()] = int(value)
+    return limits
+
+
+def _controller_from_env() -> AdmissionController:
+    return AdmissionController(
+        max_concurrency=int(os.getenv("CHATKIT_ADMISSION_MAX_CONCURRENCY", "32")),
+        provider_limits=_provider_limits(),
+        model_limit=int(os.getenv("CHATKIT_ADMISSION_MODEL_LIMIT", "0")),
+        queue_timeout=float(os.getenv("CHATKIT_ADMISSION_QUEUE_TIMEOUT", "30")),
+        max_queue=int(os.getenv("CHATKIT_ADMISSION_MAX_QUEUE", "1000")),
+    )
+
+
+# Admission controller shared by every agent in the process
+admission = _controller_from_env()
@@ -0,0 +1,174 @@
+"""Token budgets per request and per session
+
+Every run is bounded by pydantic-ai ``UsageLimits``: a request may make at
+most so many model requests and tool calls and use at most so many tokens,
+and a session may use at most so many tokens over all its turns. Before a
+request goes upstream its input is estimated; context that does not fit is
+trimmed, and a prompt that does not fit on its own is rejected.
+
+The tokens a session has used are saved with the session, in its metadata,
+so its budget holds across restarts and however many sessions are active.
+"""
+
+from typing import Any, Dict, Optional
+import os
+
+from pydantic_ai.exceptions import AgentRunError, UsageLimitExceeded
+from pydantic_ai.usage import RunUsage, UsageLimits
+
+from .sessions import SessionStore
+
+# Session metadata key of the tokens the session has used
+TOKENS_USED_KEY = "tokens_used"
+
+
+class BudgetExceeded(AgentRunError):
+    """Raised when a turn would exceed, or has exceeded, a budget
+
+    ``scope`` is ``input`` for a prompt rejected before it went upstream,
+    ``request`` for a run stopped by its per-request limits and ``session``
+    when the session's token budget is spent. ``usage`` is what a stopped
+    run spent before it was stopped.
+    """
+
+    def __init__(
+        self,
+        scope: str,
+        detail: str,
+        limit: Optional[int] = None,
+        used: Optional[int] = None,
+        usage: Optional[RunUsage] = None,
+    ):
+        self.scope = scope
+        self.detail = detail
+        self.limit = limit
+        self.used = used
+        self.usage = usage
+        super().__init__(f"{scope.capitalize()} budget exceeded: {detail}")
+
+    def event(self) -> Dict[str, Any]:
+        """Return the error as a structured stream event"""
+        return {
+            "type": "error",
+            "code": "budget_exceeded",
+            "scope": self.scope,
+            "detail": self.detail,
+            "limit": self.limit,
+            "used": self.used,
+        }
+
+
+class TokenBudget:
+    """Per-request and per-session limits; 0 disables a limit"""
+
+    def __init__(
+        self,
+        request_tokens: int = 0,
+        request_limit: int = 50,
+        tool_calls_limit: int = 0,
+        session_tokens: int = 0,
+        input_tokens: int = 0,
+    ):
+        self.request_tokens = request_tokens
+        self.request_limit = request_limit
+        self.tool_calls_limit = tool_calls_limit
+        self.session_tokens = session_tokens
+        self.input_tokens = input_tokens
+        self.stats = {"trimmed": 0, "rejected": 0, "exceeded": 0}
+
+    def session_remaining(self, used: int) -> Optional[int]:
+        """Tokens a session that has used ``used`` may still spend"""
+        if not self.session_tokens:
+            return None
+        return max(self.session_tokens - used, 0)
+
+    def context_room(self, prompt_tokens: int, used: int = 0) -> Optional[int]:
+        """Return how many tokens of context may go with a prompt (None: any)
+
+        Raises BudgetExceeded when the session's budget is spent or the
+        prompt alone is larger than a request may send.
+        """
+        remaining = self.session_remaining(used)
+        if remaining == 0:
+            self.stats["rejected"] += 1
+            raise BudgetExceeded(
+                "session", "no tokens left in this session", self.session_tokens, used
+            )
+
+        caps = [cap for cap in (self.input_tokens, self.request_tokens, remaining) if cap]
+        if not caps:
+            return None
+        limit = min(caps)
+        if prompt_tokens > limit:
+            self.stats["rejected"] += 1
+            raise BudgetExceeded(
+                "input",
+                f"message of ~{prompt_tokens} tokens exceeds the {limit} token input limit",
+                limit,
+                prompt_tokens,
+            )
+        return limit - prompt_tokens
+
+    def limits(self, used: int = 0) -> UsageLimits:
+        """Return the usage limits of one request in a session that used ``used``"""
+        caps = [cap for cap in (self.request_tokens, self.session_remaining(used)) if cap]
+        return UsageLimits(
+            request_limit=self.request_limit or None,
+            tool_calls_limit=self.tool_calls_limit or None,
+            total_tokens_limit=min(caps) if caps else None,
+        )
+
+    def exceeded(
+        self, error: UsageLimitExceeded, usage: RunUsage, used: int = 0
+    ) -> BudgetExceeded:
+        """Return the budget error of a run its usage limits stopped"""
+        self.stats["exceeded"] += 1
+        remaining = self.session_remaining(used)
+        if remaining is not None and usage.total_tokens >= remaining:
+            return BudgetExceeded(
+                "session", str(error), self.session_tokens, used + usage.total_tokens, usage
+            )
+        return BudgetExceeded(
+            "request", str(error), self.request_tokens or None, usage.total_tokens, usage
+        )
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "request_tokens": self.request_tokens,
+            "request_limit": self.request_limit,
+            "tool_calls_limit": self.tool_calls_limit,
+            "session_tokens": self.session_tokens,
+            "input_tokens": self.input_tokens,
+            **self.stats,
+        }
+
+
+def tokens_used(session: Any) -> int:
+    """Tokens a session has used so far (0 for no session)"""
+    return session.metadata.get(TOKENS_USED_KEY, 0) if session is not None else 0
+
+
+def charge(session: Any, usage: RunUsage):
+    """Add the tokens of a run to its session; the caller saves the session"""
+    session.metadata[TOKENS_USED_KEY] = tokens_used(session) + usage.total_tokens
+
+
+async def charge_session(sessions: SessionStore, session_id: str, usage: RunUsage):
+    """Add the tokens of a run to the session saved in a store"""
+    if not usage.total_tokens:
+        return
+    await sessions.aupdate(session_id, lambda session: charge(session, usage))
+
+
+def _budget_from_env() -> TokenBudget:
+    return TokenBudget(
+        request_tokens=int(os.getenv("CHATKIT_BUDGET_REQUEST_TOKENS", "0")),
+        request_limit=int(os.getenv("CHATKIT_BUDGET_REQUESTS", "50")),
+        tool_calls_limit=int(os.getenv("CHATKIT_BUDGET_TOOL_CALLS", "0")),
+        session_tokens=int(os.getenv("CHATKIT_BUDGET_SESSION_TOKENS", "0")),
+        input_tokens=int(os.getenv("CHATKIT_BUDGET_INPUT_TOKENS", "0")),
+    )
+
+
+# Budgets shared by every agent and workflow in the process
+budget = _budget_from_env()
@@ -1,22 +1,317 @@
 """Core chat interface with pydantic-ai"""
 
-from typing import AsyncIterator, Any, Dict, List, Optional
+from typing import (
+    AsyncContextManager,
+    AsyncIterator,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+from contextvars import ContextVar
 from pydantic import BaseModel, Field
-from pydantic_ai import Agent, WebSearchTool
-from pydantic_ai.exceptions import (
-    ModelRetry,
-    AgentRunError,
-    ModelHTTPError,
-    UnexpectedModelBehavior,
+from pydantic_ai import Agent, RunContext, WebSearchTool
+from pydantic_ai.messages import (
+    BuiltinToolCallPart,
+    BuiltinToolReturnPart,
+    FunctionToolCallEvent,
+    FunctionToolResultEvent,
+    ModelMessage,
+    ModelMessagesTypeAdapter,
+    ModelRequest,
+    ModelResponse,
+    PartDeltaEvent,
+    PartStartEvent,
+    SystemPromptPart,
+    TextPart,
+    TextPartDelta,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
 )
+from pydantic_ai.exceptions import AgentRunError, UsageLimitExceeded
+from pydantic_ai.toolsets import WrapperToolset
+from pydantic_ai.usage import RunUsage
+from collections import OrderedDict, deque
 import asyncio
+import hashlib
+import json
+import logging
 import os
+import re
+import threading
+import time
 import yaml
 from dotenv import load_dotenv
 
+from .memory import (
+    ChatKitMemoryTool,
+    aget_memory,
+    current_memory_namespace,
+    conversation_recorder,
+    run_in_memory_executor,
+)
+from .providers import shared_model
+from .admission import admission
+from .budgets import BudgetExceeded, budget, charge, charge_session, tokens_used
+from .resilience import provider_of, resilience
+from .sessions import SessionStore, create_session_store
+from .usage import extract_tool_calls, usage_ledger
+
+logger = logging.getLogger(__name__)
+
 # Load environment variables
 load_dotenv()
 
+# Tools the model calls to read memory; a prefetch makes them unnecessary
+MEMORY_READ_TOOLS = {"view_memory", "search_memory"}
+
+# Tools whose results depend only on the conversation and memory. A run that
+# calls any other tool (memory writes, the clock, web search) is not cached.
+CACHEABLE_TOOLS = MEMORY_READ_TOOLS
+
+# Prefetch statistics of the run in progress, filled by the instructions hook
+_prefetch_stats: ContextVar[Optional[Dict[str, int]]] = ContextVar(
+    "chatkit_prefetch_stats", default=None
+)
+
+# Claims the hedged race for the contender running in this context
+_hedge_claim: ContextVar[Optional[Callable[[], bool]]] = ContextVar(
+    "chatkit_hedge_claim", default=None
+)
+
+# Usage and usage limits of the turn in progress, shared by its attempts
+_turn_budget: ContextVar[Dict[str, Any]] = ContextVar("chatkit_turn_budget", default={})
+
+# Admits one attempt of the turn in progress, given the agent making it
+_turn_admission: ContextVar[Optional[Callable[[Agent], AsyncContextManager[None]]]] = (
+    ContextVar("chatkit_turn_admission", default=None)
+)
+
+
+def _attempt_admission(agent: Agent) -> Optional[Callable[[], AsyncContextManager[None]]]:
+    """Return what admits each attempt of an agent's run in the turn in progress"""
+    admit = _turn_admission.get()
+    return None if admit is None else lambda: admit(agent)
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly estimate the token count of text (~4 characters per token)"""
+    return (len(text) + 3) // 4
+
+
+def build_memory_context(
+    memory: ChatKitMemoryTool, query: str, token_budget: int
+) -> Tuple[str, Dict[str, int]]:
+    """Select user facts and the notes most relevant to query within a token budget"""
+    stats = {"facts": 0, "notes": 0, "tokens": 0}
+    fact_lines: List[str] = []
+    note_lines: List[str] = []
+
+    def fits(line: str) -> bool:
+        cost = estimate_tokens(line) + 1
+        if stats["tokens"] + cost > token_budget:
+            return False
+        stats["tokens"] += cost
+        return True
+
+    for key, value in memory.get_user_facts().items():
+        line = f"- {key}: {value}"
+        if not fits(line):
+            break
+        fact_lines.append(line)
+        stats["facts"] += 1
+
+    if query:
+        for result in memory.search(query, k=5):
+            if result["type"] != "note":
+                continue
+            note = result["note"]
+            if isinstance(note, dict):
+                line = f"- {note.get('title', '')}: {note.get('content', '')}"
+            else:
+                line = f"- {note}"
+            if not fits(line):
+                break
+            note_lines.append(line)
+            stats["notes"] += 1
+
+    if not fact_lines and not note_lines:
+        return "", stats
+
+    sections = [
+        "Relevant memory has already been loaded below. Answer from it directly; "
+        "only call view_memory or search_memory if it does not cover the question."
+    ]
+    if fact_lines:
+        sections.append("Known user facts:\n" + "\n".join(fact_lines))
+    if note_lines:
+        sections.append("Relevant notes:\n" + "\n".join(note_lines))
+    return "\n\n".join(sections), stats
+
+
+def usage_metadata(usage: RunUsage) -> Dict[str, int]:
+    """Return the token and request counts of a run for response metadata"""
+    return {
+        "requests": usage.requests,
+        "tool_calls": usage.tool_calls,
+        "input_tokens": usage.input_tokens,
+        "output_tokens": usage.output_tokens,
+        "total_tokens": usage.total_tokens,
+    }
+
+
+def _tool_args(part: Any) -> Any:
+    """Return tool call arguments as a dict, or as sent if not yet valid JSON"""
+    try:
+        return part.args_as_dict()
+    except ValueError:
+        return part.args
+
+
+def _model_stream_events(event: Any) -> List[Dict[str, Any]]:
+    """Translate a model response stream event into ``stream_events`` items"""
+    if isinstance(event, PartDeltaEvent):
+        if isinstance(event.delta, TextPartDelta) and event.delta.content_delta:
+            return [{"type": "delta", "text": event.delta.content_delta}]
+        return []
+    if not isinstance(event, PartStartEvent):
+        return []
+
+    part = event.part
+    if isinstance(part, TextPart):
+        return [{"type": "delta", "text": part.content}] if part.content else []
+    if isinstance(part, BuiltinToolCallPart):
+        return [{
+            "type": "tool_call_start",
+            "tool_name": part.tool_name,
+            "tool_call_id": part.tool_call_id,
+            "args": _tool_args(part),
+            "builtin": True,
+        }]
+    if isinstance(part, BuiltinToolReturnPart):
+        return [{
+            "type": "tool_call_end",
+            "tool_name": part.tool_name,
+            "tool_call_id": part.tool_call_id,
+            "result": part.model_response_str(),
+            "builtin": True,
+        }]
+    return []
+
+
+def estimate_message_tokens(message: ModelMessage) -> int:
+    """Roughly estimate the tokens a history message costs when resent
+
+    System prompt parts are not counted: the agent sends its system prompt on
+    every run, so it is not part of the cost a history window controls.
+    """
+    tokens = 0
+    for part in message.parts:
+        if isinstance(part, SystemPromptPart):
+            continue
+        if isinstance(part, ToolCallPart):
+            text = part.tool_name + part.args_as_json_str()
+        else:
+            content = getattr(part, "content", "")
+            text = content if isinstance(content, str) else str(content)
+        tokens += estimate_tokens(text) + 4  # Per-part framing
+    return tokens
+
+
+def _starts_turn(message: ModelMessage) -> bool:
+    return isinstance(message, ModelRequest) and any(
+        isinstance(part, UserPromptPart) for part in message.parts
+    )
+
+
+def window_start(messages: List[ModelMessage], token_budget: int) -> int:
+    """Return where the most recent whole turns fitting a token budget begin
+
+    A turn starts at a user prompt and runs up to the next one, so a tool call
+    is never separated from its result.
+    """
+    tokens = 0
+    end = len(messages)
+    for start in range(len(messages) - 1, -1, -1):
+        if start > 0 and not _starts_turn(messages[start]):
+            continue
+        turn = messages[start:end]
+        tokens += sum(estimate_message_tokens(message) for message in turn)
+        if tokens > token_budget:
+            break
+        end = start
+    return end
+
+
+def system_prompt_parts(messages: List[ModelMessage]) -> List[SystemPromptPart]:
+    """Return the system prompt the first request of a history was sent with"""
+    if not messages or not isinstance(messages[0], ModelRequest):
+        return []
+    return [part for part in messages[0].parts if isinstance(part, SystemPromptPart)]
+
+
+def history_window(
+    messages: List[ModelMessage],
+    token_budget: int,
+    summary: Optional[str] = None,
+    summarized: int = 0,
+) -> List[ModelMessage]:
+    """Return the most recent whole turns of a history that fit a token budget
+
+    The first ``summarized`` messages are covered by ``summary`` and never
+    resent. When older turns are left out, the system prompt of the first
+    request is kept in front of the window, because the agent only adds it to
+    runs without history, followed by the summary if there is one.
+    """
+    start = summarized + window_start(messages[summarized:], token_budget)
+    if start == 0:
+        return list(messages)
+
+    parts: List[Any] = system_prompt_parts(messages)
+    if summary:
+        parts.append(SystemPromptPart(f"{SUMMARY_PREFIX}\n{summary}"))
+    head = [ModelRequest(parts=parts)] if parts else []
+    return head + messages[start:]
+
+
+# Introduces the summary of compacted turns in the resent history
+SUMMARY_PREFIX = "Summary of the earlier conversation:"
+
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the conversation below for the assistant that continues it. "
+    "Keep the user's goals, decisions, facts about the user, open questions and "
+    "results of tool calls that later turns may rely on. If a previous summary is "
+    "given, merge it with the new turns. Reply with the summary only, in at most "
+    "300 words."
+)
+
+
+def render_transcript(messages: List[ModelMessage], max_part_chars: int = 2000) -> str:
+    """Render model messages as a plain-text transcript for summarization"""
+    lines = []
+    for message in messages:
+        for part in message.parts:
+            if isinstance(part, SystemPromptPart):
+                continue
+            if isinstance(part, UserPromptPart):
+                label, text = "User", part.content
+            elif isinstance(part, TextPart):
+                label, text = "Assistant", part.content
+            elif isinstance(part, ToolCallPart):
+                label, text = f"Tool call {part.tool_name}", part.args_as_json_str()
+            elif isinstance(part, ToolReturnPart):
+                label, text = f"Tool result {part.tool_name}", part.model_response_str()
+            else:
+                continue
+            text = text if isinstance(text, str) else str(text)
+            lines.append(f"{label}: {text[:max_part_chars]}")
+    return "\n".join(lines)
+
 
 def load_system_config():
     """Load system configuration from YAML file"""
@@ -49,6 +344,7 @@ CRITICAL INSTRUCTIONS - YOU MUST FOLLOW THESE EXACTLY:
    - When user says ANYTHING like "I'm X", "my name is X", "call me X" → IMMEDIATELY use store_personal_info tool
    - When user asks "what's my name", "do you remember X", "what do you know about me" → IMMEDIATELY use view_memory tool
    - When user shares preferences, facts, or important information → use add_fact tool
+   - When user shares SEVERAL facts or notes at once → use add_facts / add_notes ONCE with all of them
 
 2. TOOL EXECUTION ORDER:
    - First: Detect if user message contains personal information → use store_personal_info
@@ -58,8 +354,11 @@ CRITICAL INSTRUCTIONS - YOU MUST FOLLOW THESE EXACTLY:
 3. MEMORY TOOLS AVAILABLE:
    - store_personal_info: Automatically detect and store names from user messages
    - view_memory: Retrieve stored information and memory summary
+   - search_memory: Find the notes and facts most relevant to a topic (prefer this over dumping all memory)
    - add_fact: Store important user preferences and facts
+   - add_facts: Store several facts in one call (preferred whenever there is more than one)
    - add_note: Store general notes about conversations
+   - add_notes: Store several notes in one call (preferred whenever there is more than one)
 
 4. ALWAYS:
    - Use tools proactively - don't wait for user to ask
@@ -72,6 +371,7 @@ CRITICAL INSTRUCTIONS - YOU MUST FOLLOW THESE EXACTLY:
 EXAMPLES:
 User: "Hello, I'm user_name" → You: [use store_personal_info] → "Hello user_name! How can I help?"
 User: "What's my name?" → You: [use view_memory] → "Your name is user_name!"
+User: "I love jazz, live in Porto and I'm vegetarian" → You: [use add_facts once with all three] → "Got it!"
 """
 
 
@@ -90,6 +390,16 @@ class ChatSession(BaseModel):
     messages: List[ChatMessage] = Field(
         default_factory=list, description="Chat history"
     )
+    history: List[ModelMessage] = Field(
+        default_factory=list,
+        description="Model messages of every run, including tool calls and results",
+    )
+    summary: Optional[str] = Field(
+        default=None, description="Summary of the compacted part of the history"
+    )
+    summarized: int = Field(
+        default=0, description="Number of history messages covered by the summary"
+    )
     metadata: Dict[str, Any] = Field(
         default_factory=dict, description="Session metadata"
     )
@@ -108,10 +418,452 @@ class ChatResponse(BaseModel):
     )
 
 
+def _normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def normalize_history(messages: List[ModelMessage]) -> List[Any]:
+    """Reduce messages to what the model sees, without timestamps or call ids"""
+    normalized = []
+    for message in messages:
+        parts = []
+        for part in message.parts:
+            if isinstance(part, (ToolCallPart, BuiltinToolCallPart)):
+                text = part.tool_name + part.args_as_json_str()
+            elif isinstance(part, (ToolReturnPart, BuiltinToolReturnPart)):
+                text = part.tool_name + part.model_response_str()
+            else:
+                content = getattr(part, "content", "")
+                text = content if isinstance(content, str) else str(content)
+            parts.append([part.part_kind, _normalize_text(text)])
+        normalized.append([message.kind, parts])
+    return normalized
+
+
+def is_cacheable(new_messages: List[ModelMessage]) -> bool:
+    """Whether a run only called tools without side effects or volatile results"""
+    for message in new_messages:
+        if not isinstance(message, ModelResponse):
+            continue
+        for part in message.parts:
+            if isinstance(part, BuiltinToolCallPart):
+                return False
+            if isinstance(part, ToolCallPart) and part.tool_name not in CACHEABLE_TOOLS:
+                return False
+    return True
+
+
+def model_id(agent: Agent) -> str:
+    """Return the ``provider:model`` id an agent runs on"""
+    model = agent.model
+    if model is None or isinstance(model, str):
+        return str(model)
+    return f"{model.system}:{model.model_name}"
+
+
+class ResponseCache:
+    """Byte-bounded LRU of complete responses that expire after a TTL
+
+    Entries hold the response text and the serialized model messages of the
+    run, so a hit can be added to the session exactly like a fresh run.
+    """
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, ttl: float = 300.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, int, str, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "bypassed": 0,
+            "evictions": 0,
+            "expired": 0,
+        }
+
+    @staticmethod
+    def key(
+        model: str,
+        system_prompt: str,
+        history: List[ModelMessage],
+        message: str,
+        scope: Any = None,
+    ) -> str:
+        """Hash the model, system prompt, normalized history window and input
+
+        ``scope`` holds anything else the response depends on, such as the
+        memory namespace and the memory's last update.
+        """
+        history = normalize_history(history)
+        payload = json.dumps(
+            [model, system_prompt, history, _normalize_text(message), scope],
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _drop(self, key: str):
+        _, size, _, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key: str) -> Optional[Tuple[str, List[ModelMessage]]]:
+        """Return the cached output and messages, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                self._drop(key)
+                self._stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+        _, _, output, messages = entry
+        return output, ModelMessagesTypeAdapter.validate_json(messages)
+
+    def put(self, key: str, output: str, new_messages: List[ModelMessage]):
+        """Cache a response, or count it as bypassed if the run had side effects"""
+        if not is_cacheable(new_messages):
+            with self._lock:
+                self._stats["bypassed"] += 1
+            return
+
+        messages = ModelMessagesTypeAdapter.dump_json(new_messages)
+        size = len(output.encode("utf-8")) + len(messages)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, output, messages)
+            self._bytes += size
+            self._stats["stores"] += 1
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit, miss and eviction counters and the cache size"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                **self._stats,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+            }
+
+
+class AgentPool:
+    """Agents built once per (model, toolsets, builtin tools) and then reused
+
+    Building an agent resolves its model and provider; pooling makes picking
+    the agent for a session a dict lookup.
+    """
+
+    def __init__(
+        self, build: Callable[[str, Tuple[Any, ...], Tuple[Any, ...]], Agent]
+    ):
+        self._build = build
+        self._agents: Dict[Tuple[Any, ...], Agent] = {}
+        self._lock = threading.Lock()
+        self.stats = {"built": 0, "hits": 0}
+
+    @staticmethod
+    def key(
+        model: str, toolsets: Tuple[Any, ...], builtin_tools: Tuple[Any, ...]
+    ) -> Tuple[Any, ...]:
+        """Pool key: toolsets by identity, builtin tools by configuration"""
+        return (
+            model,
+            tuple(id(toolset) for toolset in toolsets),
+            tuple(repr(tool) for tool in builtin_tools),
+        )
+
+    def get(
+        self, model: str, toolsets: Tuple[Any, ...], builtin_tools: Tuple[Any, ...]
+    ) -> Agent:
+        """Return the pooled agent, building it on first use"""
+        key = self.key(model, toolsets, builtin_tools)
+        with self._lock:
+            agent = self._agents.get(key)
+            if agent is not None:
+                self.stats["hits"] += 1
+                return agent
+            agent = self._build(model, toolsets, builtin_tools)
+            self._agents[key] = agent
+            self.stats["built"] += 1
+            return agent
+
+    def __len__(self) -> int:
+        return len(self._agents)
+
+
+class RunOutcome(NamedTuple):
+    """What a finished model run leaves behind for the turns that shared it"""
+
+    output: str
+    new_messages: List[ModelMessage]
+    usage: RunUsage
+    prefetch: Dict[str, int]
+    model: str
+
+
+class Flight:
+    """One model run in its own task, fanned out to every subscriber
+
+    The run calls ``publish`` for each event it produces. Subscribers get
+    all events from the first one on, so a subscriber joining late replays
+    the deltas it missed before receiving live ones. The run is cancelled
+    once its last holder leaves before it finished.
+    """
+
+    def __init__(self, produce: Callable[[Callable[[Any], None]], Awaitable[RunOutcome]]):
+        self.events: List[Any] = []
+        self.result: Optional[RunOutcome] = None
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.abandoned = False
+        self.holders = 0
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(self._run(produce))
+
+    async def _run(self, produce: Callable[[Callable[[Any], None]], Awaitable[RunOutcome]]):
+        try:
+            self.result = await produce(self.publish)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, event: Any):
+        self.events.append(event)
+        self._wake()
+
+    def hold(self) -> Callable[[], None]:
+        """Count a holder of the run; return the function it leaves with
+
+        A holder whose task ends without leaving, say one cancelled before it
+        subscribed, leaves then.
+        """
+        self.holders += 1
+        task = asyncio.current_task()
+        left = False
+
+        def leave(_: Any = None):
+            nonlocal left
+            if left:
+                return
+            left = True
+            if task is not None:
+                task.remove_done_callback(leave)
+            self.holders -= 1
+            if not self.holders and not self.done:
+                self.abandoned = True
+                self.task.cancel()
+
+        if task is not None:
+            task.add_done_callback(leave)
+        return leave
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        """Yield every event of the run; raise the run's error if it failed
+
+        ``result`` holds the outcome once the iterator is exhausted.
+        """
+        index = 0
+        while True:
+            if index < len(self.events):
+                index += 1
+                yield self.events[index - 1]
+            elif self.done:
+                break
+            else:
+                await self._changed.wait()
+        if self.error is not None:
+            raise self.error
+
+
+class SharedRun:
+    """A turn's hold on a run it may share with identical turns
+
+    The turn holds the run from joining it until it has read the run's
+    events or its task ends. A turn that joined another session's run does
+    not inherit that session's budget error: it runs its turn itself
+    instead, unless the shared run already streamed it events.
+    """
+
+    def __init__(
+        self,
+        flights: "SingleFlight",
+        key: Optional[str],
+        produce: Callable[[Callable[[Any], None]], Awaitable[RunOutcome]],
+    ):
+        self.flights = flights
+        self.produce = produce
+        self.flight, self.leader = flights.join(key, produce)
+        self._leave = self.flight.hold()
+
+    @property
+    def result(self) -> Optional[RunOutcome]:
+        return self.flight.result
+
+    async def events(self) -> AsyncIterator[Any]:
+        """Yield every event of the run; raise the run's error if it failed"""
+        delivered = False
+        try:
+            async for event in self.flight.subscribe():
+                delivered = True
+                yield event
+            return
+        except BudgetExceeded:
+            if self.leader:
+                raise
+            if delivered:
+                raise AgentRunError(
+                    "The shared run was stopped by another session's budget"
+                ) from None
+        finally:
+            self._leave()
+
+        # The run failed on the budget of the session that started it
+        self.flight, self.leader = self.flights.join(None, self.produce)
+        self._leave = self.flight.hold()
+        try:
+            async for event in self.flight.subscribe():
+                yield event
+        finally:
+            self._leave()
+
+
+class SingleFlight:
+    """Identical requests in flight at the same time share one model run
+
+    The first request for a key starts the run; requests with the same key
+    arriving before it finishes subscribe to that run instead of starting
+    their own. A key of None is never shared.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self.stats = {"runs": 0, "coalesced": 0}
+
+    def join(
+        self,
+        key: Optional[str],
+        produce: Callable[[Callable[[Any], None]], Awaitable[RunOutcome]],
+    ) -> Tuple[Flight, bool]:
+        """Return the run for a key and whether this request started it"""
+        flight = self._flights.get(key) if key is not None else None
+        if flight is not None and not flight.abandoned:
+            self.stats["coalesced"] += 1
+            return flight, False
+
+        flight = Flight(produce)
+        self.stats["runs"] += 1
+        if key is not None:
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        return flight, True
+
+    def _forget(self, key: str, flight: Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def __len__(self) -> int:
+        """Number of shared runs in flight"""
+        return len(self._flights)
+
+
+class HedgePolicy:
+    """When to send a duplicate of a slow request, and how often it paid off
+
+    The hedge delay of a model is a percentile of its recent time-to-first-
+    token, so only the slowest requests are duplicated. Until enough samples
+    are in, ``default_delay`` is used.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        percentile: float = 95.0,
+        default_delay: float = 2.0,
+        min_delay: float = 0.2,
+        fallback_model: Optional[str] = None,
+        window: int = 200,
+        min_samples: int = 20,
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.fallback_model = fallback_model
+        self.window = window
+        self.min_samples = min_samples
+        self._latencies: Dict[str, deque] = {}
+        self.stats = {
+            "requests": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "failovers": 0,
+            "skipped": 0,
+        }
+
+    def delay(self, model: str) -> float:
+        """Seconds to wait for the first token before hedging a request"""
+        samples = self._latencies.get(model)
+        if not samples or len(samples) < self.min_samples:
+            return self.default_delay
+        ordered = sorted(samples)
+        index = round(self.percentile / 100 * (len(ordered) - 1))
+        return max(self.min_delay, ordered[index])
+
+    def record(self, model: str, seconds: float):
+        """Record a time-to-first-token sample of a model"""
+        samples = self._latencies.get(model)
+        if samples is None:
+            samples = self._latencies[model] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def summary(self) -> Dict[str, Any]:
+        """Return the counters and the current hedge delay per model"""
+        return {
+            "enabled": self.enabled,
+            "percentile": self.percentile,
+            "fallback_model": self.fallback_model,
+            **self.stats,
+            "delays": {model: self.delay(model) for model in self._latencies},
+        }
+
+
+class HedgeAwareToolset(WrapperToolset):
+    """Claims the hedged race before calling a tool, so tools run only once
+
+    A contender that lost the race is about to be cancelled and must not
+    repeat the winner's side effects.
+    """
+
+    async def call_tool(self, name: str, tool_args: Dict[str, Any], ctx: RunContext, tool: Any) -> Any:
+        claim = _hedge_claim.get()
+        if claim is not None and not claim():
+            raise asyncio.CancelledError()
+        return await super().call_tool(name, tool_args, ctx, tool)
+
+
 class ChatKitAgent:
     """Main chat agent with pydantic-ai"""
 
-    def __init__(self, model: str = None):
+    def __init__(self, model: str = None, session_store: Optional[SessionStore] = None):
         # Use environment variable or default model with web search enabled
         self.model = model or os.getenv("OPENAI_MODEL", "openai-responses:gpt-5")
 
@@ -128,39 +880,170 @@ class ChatKitAgent:
 
         # Load system configuration from XML
         self.system_prompt = load_system_config()
-        self.memory_toolset = memory_toolset
+        self.memory_toolset = HedgeAwareToolset(memory_toolset)
+
+        # Memory inlined into the prompt before each run (0 disables)
+        self.memory_prefetch_tokens = int(
+            os.getenv("CHATKIT_MEMORY_PREFETCH_TOKENS", "500")
+        )
+        self.prefetch_stats = {"runs": 0, "prefetched": 0, "turns_saved": 0}
+
+        # Prior turns resent with each message, newest first, within this budget
+        self.history_tokens = int(os.getenv("CHATKIT_HISTORY_TOKENS", "4000"))
+
+        # Older turns are summarized in the background by a cheap model once
+        # the unsummarized history exceeds this many tokens (0 disables)
+        self.compaction_tokens = int(os.getenv("CHATKIT_COMPACTION_TOKENS", "8000"))
+        self.summary_model = os.getenv("CHATKIT_SUMMARY_MODEL", "openai:gpt-5-mini")
+        self._summarizer: Optional[Agent] = None
+        self.compaction_stats = {"runs": 0, "failures": 0, "summarized_messages": 0}
+        self._compactions: Dict[str, asyncio.Task] = {}
+
+        # Streamed text is grouped into deltas at most this often (0 sends
+        # every model chunk as it arrives)
+        self.stream_debounce = float(os.getenv("CHATKIT_STREAM_DEBOUNCE", "0.1"))
+
+        # Opt-in cache of complete responses to repeated prompts (0 disables)
+        cache_bytes = int(os.getenv("CHATKIT_RESPONSE_CACHE_BYTES", "0"))
+        cache_ttl = float(os.getenv("CHATKIT_RESPONSE_CACHE_TTL", "300"))
+        self.response_cache: Optional[ResponseCache] = (
+            ResponseCache(cache_bytes, cache_ttl) if cache_bytes > 0 else None
+        )
 
-        # Create initial agent
-        self.agent = self._create_agent(self.model)
+        # Opt-in: identical requests in flight at the same time share one run
+        self.coalesce = os.getenv("CHATKIT_COALESCE", "0") != "0"
+        self.flights = SingleFlight()
 
-        self.sessions: Dict[str, ChatSession] = {}
+        # Upstream runs are capped per provider and model; excess turns queue
+        self.admission = admission
+        self.usage = usage_ledger
 
-    def _create_agent(self, model: str):
-        """Create a new agent with the specified model"""
-        # Check if this is an OpenAI Responses model that supports web search
+        # Per-request and per-session token budgets, see chatkit.budgets
+        self.budget = budget
+
+        # Opt-in: duplicate a request whose first token is slower than usual,
+        # to the same model or to CHATKIT_HEDGE_MODEL, and keep the faster one
+        self.hedging = HedgePolicy(
+            enabled=os.getenv("CHATKIT_HEDGE", "0") != "0",
+            percentile=float(os.getenv("CHATKIT_HEDGE_PERCENTILE", "95")),
+            default_delay=float(os.getenv("CHATKIT_HEDGE_DELAY", "2")),
+            min_delay=float(os.getenv("CHATKIT_HEDGE_MIN_DELAY", "0.2")),
+            fallback_model=os.getenv("CHATKIT_HEDGE_MODEL") or None,
+        )
+
+        # Completed turns are captured into memory history in the background
+        self.capture_history = os.getenv("CHATKIT_CAPTURE_HISTORY", "1") != "0"
+
+        # Agents are shared by every session using the same configuration
+        self.agents = AgentPool(self._create_agent)
+        self.agent = self.agent_for_model(self.model)
+
+        # Sessions persist on disk; only the recently used ones stay in memory
+        self.sessions: SessionStore[ChatSession] = (
+            session_store
+            if session_store is not None
+            else create_session_store(ChatSession)
+        )
+
+    def _agent_spec(self, model: str) -> Tuple[str, Tuple[Any, ...], Tuple[Any, ...]]:
+        """Return the model, toolsets and builtin tools an agent for model uses"""
+        # OpenAI Responses models get OpenAI's native web search
         if model.startswith("openai-responses:") or model == "openai:gpt-5":
-            # Use OpenAI Responses model with web search
-            actual_model = model if model.startswith("openai-responses:") else "openai-responses:gpt-5"
-
-            return Agent(
-                model=actual_model,
-                system_prompt=self.system_prompt,
-                toolsets=[self.memory_toolset],
-                builtin_tools=[WebSearchTool()],  # Enable OpenAI native web search
+            if not model.startswith("openai-responses:"):
+                model = "openai-responses:gpt-5"
+            return model, (self.memory_toolset,), (WebSearchTool(),)
+        return model, (self.memory_toolset,), ()
+
+    def _create_agent(
+        self, model: str, toolsets: Tuple[Any, ...], builtin_tools: Tuple[Any, ...]
+    ) -> Agent:
+        """Create a new agent for a model, toolsets and builtin tools"""
+        agent = Agent(
+            model=shared_model(model),
+            system_prompt=self.system_prompt,
+            toolsets=list(toolsets),
+            builtin_tools=list(builtin_tools),
+        )
+
+        # Instructions are re-evaluated on every run and never stored in the
+        # message history, so the prefetched memory is always current
+        agent.instructions(self._memory_instructions)
+        return agent
+
+    @property
+    def summarizer(self) -> Agent:
+        """The agent compaction summarizes with, built on first use"""
+        if self._summarizer is None:
+            self._summarizer = Agent(
+                shared_model(self.summary_model), instructions=SUMMARY_INSTRUCTIONS
             )
+        return self._summarizer
+
+    def agent_for_model(self, model: str) -> Agent:
+        """Return the shared agent for a model id, building it on first use"""
+        return self.agents.get(*self._agent_spec(model))
+
+    def agent_for_session(self, session: Optional[ChatSession]) -> Agent:
+        """Return the agent for a session's own model, or the default agent"""
+        model = session.metadata.get("model") if session else None
+        if not model or model == self.model:
+            return self.agent
+        return self.agent_for_model(model)
+
+    async def _memory_instructions(self, ctx: RunContext[None]) -> str:
+        """Inline the user's facts and most relevant notes before each run"""
+        if self.memory_prefetch_tokens <= 0:
+            return ""
+
+        if isinstance(ctx.prompt, str):
+            query = ctx.prompt
         else:
-            # For non-OpenAI Responses models, use standard Agent without web search
-            return Agent(
-                model=model,
-                system_prompt=self.system_prompt,
-                toolsets=[self.memory_toolset],
-            )
+            query = " ".join(part for part in ctx.prompt or [] if isinstance(part, str))
+
+        context, stats = await run_in_memory_executor(
+            build_memory_context, await aget_memory(), query, self.memory_prefetch_tokens
+        )
+        holder = _prefetch_stats.get()
+        if holder is not None:
+            holder.update(stats)
+        return context
+
+    def _record_prefetch(
+        self, stats: Dict[str, int], new_messages: List[ModelMessage]
+    ) -> Dict[str, int]:
+        """Count the model round-trip saved when prefetched memory was enough"""
+        memory_reads = sum(
+            1
+            for message in new_messages
+            if isinstance(message, ModelResponse)
+            for part in message.parts
+            if isinstance(part, ToolCallPart) and part.tool_name in MEMORY_READ_TOOLS
+        )
+        prefetched = bool(stats.get("facts") or stats.get("notes"))
+        turns_saved = 1 if prefetched and not memory_reads else 0
 
-    def switch_model(self, model: str):
-        """Switch to a different model"""
-        self.model = model
-        self.agent = self._create_agent(model)
-        return {"message": f"Switched to model: {model}"}
+        self.prefetch_stats["runs"] += 1
+        self.prefetch_stats["prefetched"] += int(prefetched)
+        self.prefetch_stats["turns_saved"] += turns_saved
+        return {**stats, "memory_reads": memory_reads, "turns_saved": turns_saved}
+
+    def switch_model(self, model: str, session_id: Optional[str] = None):
+        """Switch the model of one session, or the default for all others
+
+        Agents come from the pool, so a switch only builds an agent the first
+        time a model is used. Runs in flight keep the agent they started with.
+        """
+        agent = self.agent_for_model(model)
+        if session_id is None:
+            self.model = model
+            self.agent = agent
+            return {"message": f"Switched to model: {model}"}
+
+        def use_model(session: ChatSession):
+            session.metadata["model"] = model
+
+        self.sessions.update(session_id, use_model)
+        return {"message": f"Switched session {session_id} to model: {model}"}
 
     def create_session(self, session_id: Optional[str] = None) -> ChatSession:
         """Create a new chat session"""
@@ -170,140 +1053,780 @@ class ChatKitAgent:
             session_id = str(uuid.uuid4())
 
         session = ChatSession(session_id=session_id)
-        self.sessions[session_id] = session
+        self.sessions.save(session)
         return session
 
     def get_session(self, session_id: str) -> Optional[ChatSession]:
-        """Get an existing chat session"""
+        """Get an existing chat session, rehydrating it if it was evicted"""
         return self.sessions.get(session_id)
 
+    async def aget_session(self, session_id: str) -> Optional[ChatSession]:
+        """Get an existing chat session without blocking the event loop"""
+        return await self.sessions.aget(session_id)
+
+    def _schedule_compaction(self, session: ChatSession):
+        """Summarize older turns in the background once the history is too long"""
+        session_id = session.session_id
+        if self.compaction_tokens <= 0 or session_id in self._compactions:
+            return
+        pending = sum(
+            estimate_message_tokens(message)
+            for message in session.history[session.summarized :]
+        )
+        if pending <= self.compaction_tokens:
+            return
+
+        task = asyncio.create_task(self.compact_session(session_id))
+        self._compactions[session_id] = task
+        task.add_done_callback(lambda _: self._compactions.pop(session_id, None))
+
+    async def compact_session(self, session_id: str) -> bool:
+        """Fold the turns older than the history window into the session summary
+
+        Returns whether the summary was updated. The summary covers a prefix
+        of the history; the messages themselves are kept. The summary is
+        admitted, retried and limited by the session's budget like a turn.
+        """
+        session = await self.aget_session(session_id)
+        used = tokens_used(session)
+        if session is None or self.budget.session_remaining(used) == 0:
+            return False
+        summarized = session.summarized
+        cut = summarized + window_start(
+            session.history[summarized:], self.history_tokens
+        )
+        if cut <= summarized:
+            return False
+
+        prompt = render_transcript(session.history[summarized:cut])
+        if session.summary:
+            prompt = f"Previous summary:\n{session.summary}\n\nNew turns:\n{prompt}"
+        summarizer = self.summarizer
+        provider = provider_of(summarizer.model)
+        usage = RunUsage()
+        started = time.monotonic()
+        try:
+            result = await resilience.run(
+                provider,
+                lambda: summarizer.run(
+                    prompt, usage=usage, usage_limits=self.budget.limits(used)
+                ),
+                admit=lambda: self.admission.admit(
+                    provider, model_id(summarizer), session_id
+                ),
+            )
+        except Exception as e:
+            self.compaction_stats["failures"] += 1
+            logger.warning("Failed to compact session %s: %s", session_id, e)
+            if usage.total_tokens:
+                # A summary stopped by the budget was still paid for
+                self.usage.record(
+                    model_id(summarizer),
+                    usage,
+                    [],
+                    time.monotonic() - started,
+                    session_id=session_id,
+                    node="compaction",
+                )
+                await charge_session(self.sessions, session_id, usage)
+            return False
+        self.usage.record(
+            model_id(summarizer),
+            usage,
+            result.new_messages(),
+            time.monotonic() - started,
+            session_id=session_id,
+            node="compaction",
+        )
+
+        # The session may have been compacted meanwhile. The summary's tokens
+        # count against the session's budget either way.
+        compacted = False
+
+        def fold(session: ChatSession):
+            nonlocal compacted
+            charge(session, usage)
+            compacted = session.summarized == summarized
+            if compacted:
+                session.summary = result.output
+                session.summarized = cut
+
+        await self.sessions.aupdate(session_id, fold)
+        if not compacted:
+            return False
+
+        self.compaction_stats["runs"] += 1
+        self.compaction_stats["summarized_messages"] += cut - summarized
+        return True
+
+    async def _begin_turn(
+        self, session_id: str, message: str
+    ) -> Tuple[Agent, List[ModelMessage]]:
+        """Return the agent and the history of a turn
+
+        Nothing is saved yet: the turn is added to its session, with one
+        save, once it completes (``_complete_turn``) or fails (``_fail_turn``).
+        """
+        session = await self.aget_session(session_id)
+        if not session:
+            session = ChatSession(session_id=session_id)
+
+        # Resend only the most recent turns that fit the history budget
+        history = history_window(
+            session.history, self.history_tokens, session.summary, session.summarized
+        )
+
+        # Pre-flight: reject the request, unsaved, if even the message alone
+        # would exceed its input budget. Otherwise the turns resent get what
+        # is left after the system prompt, the summary and prefetched memory.
+        room = self.budget.context_room(estimate_tokens(message), tokens_used(session))
+        if room is not None:
+            context = estimate_tokens(self.system_prompt) + max(self.memory_prefetch_tokens, 0)
+            if session.summary:
+                context += estimate_tokens(session.summary)
+            room = max(room - context, 0)
+            if room < self.history_tokens:
+                trimmed = history_window(
+                    session.history, room, session.summary, session.summarized
+                )
+                if len(trimmed) < len(history):
+                    self.budget.stats["trimmed"] += 1
+                history = trimmed
+
+        return self.agent_for_session(session), history
+
+    async def session_tokens(self, session_id: str) -> int:
+        """Tokens a session has used so far, as saved with the session"""
+        return tokens_used(await self.aget_session(session_id))
+
+    async def _turn_key(
+        self, agent: Agent, message: str, message_history: List[ModelMessage]
+    ) -> Optional[str]:
+        """Return the key identical turns share for caching and coalescing
+
+        None when neither the response cache nor coalescing is enabled.
+        """
+        if self.response_cache is None and not self.coalesce:
+            return None
+
+        # Replies also depend on the memory the model sees, keyed by the
+        # version of each section, which every mutation (in any process)
+        # changes. The conversation history section is left out: it changes
+        # after every turn.
+        versions = await (await aget_memory()).asection_versions()
+        memory = {
+            name: version
+            for name, version in sorted(versions.items())
+            if name != "conversation_history"
+        }
+        scope = [current_memory_namespace.get(), memory, self.memory_prefetch_tokens]
+        return ResponseCache.key(
+            model_id(agent), self.system_prompt, message_history, message, scope
+        )
+
+    async def _cached_response(
+        self,
+        agent: Agent,
+        session_id: str,
+        message: str,
+        turn_key: Optional[str],
+        started: float,
+    ) -> Optional[str]:
+        """Complete a turn from the response cache; return the output on a hit"""
+        if not turn_key or self.response_cache is None:
+            return None
+        cached = self.response_cache.get(turn_key)
+        if cached is None:
+            return None
+        output, new_messages = cached
+        await self._complete_turn(session_id, message, output, new_messages)
+        self.usage.record(
+            model_id(agent),
+            RunUsage(),
+            [],
+            time.monotonic() - started,
+            session_id=session_id,
+            cached=True,
+        )
+        return output
+
+    def _join_flight(
+        self,
+        kind: str,
+        turn_key: Optional[str],
+        produce: Callable[[Callable[[Any], None]], Awaitable[RunOutcome]],
+    ) -> SharedRun:
+        """Start or join the shared run of a turn
+
+        Runs are only shared between turns consuming them the same way, since
+        plain, streamed and event runs publish different events.
+        """
+        key = f"{kind}:{turn_key}" if self.coalesce and turn_key else None
+        return SharedRun(self.flights, key, produce)
+
+    async def _finish_shared_turn(
+        self,
+        session_id: str,
+        current_input: str,
+        shared: SharedRun,
+        turn_key: Optional[str],
+        started: Optional[float],
+    ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Add a shared run to this turn's session and the usage ledger
+
+        Returns the response metadata and the run's tool calls. Only the turn
+        that started the run caches it and reports its usage; the turns that
+        joined it report none, like cache hits.
+        """
+        outcome = shared.result
+        leader = shared.leader
+        await self._complete_turn(
+            session_id,
+            current_input,
+            outcome.output,
+            outcome.new_messages,
+            turn_key if leader else None,
+            outcome.usage if leader else None,
+        )
+        wall_time = time.monotonic() - started if started is not None else 0.0
+        if not leader:
+            self.usage.record(
+                outcome.model,
+                RunUsage(),
+                [],
+                wall_time,
+                session_id=session_id,
+                coalesced=True,
+            )
+            metadata = {
+                "cached": False,
+                "coalesced": True,
+                "usage": usage_metadata(RunUsage()),
+            }
+            return metadata, extract_tool_calls(outcome.new_messages)
+
+        tool_calls = self.usage.record(
+            outcome.model,
+            outcome.usage,
+            outcome.new_messages,
+            wall_time,
+            session_id=session_id,
+        )
+        metadata = {
+            "cached": False,
+            "coalesced": False,
+            "usage": usage_metadata(outcome.usage),
+            "memory_prefetch": self._record_prefetch(
+                outcome.prefetch, outcome.new_messages
+            ),
+        }
+        return metadata, tool_calls
+
     async def send_message(
         self, session_id: str, message: str, stream: bool = False
     ) -> AsyncIterator[ChatResponse]:
         """Send a message to the agent and get response"""
-        session = self.get_session(session_id)
-        if not session:
-            session = self.create_session(session_id)
-
-        # Add user message to history
-        user_msg = ChatMessage(role="user", content=message)
-        session.messages.append(user_msg)
-
-        # Prepare context for the agent
-        # Use the last message as input, previous messages as history
-        message_history = []
-        if len(session.messages) > 1:
-            message_history = [
-                msg.content
-                for msg in session.messages[:-1]
-                if msg.role in ["user", "assistant"]
-            ]
-
-        current_input = (
-            message if not session.messages else session.messages[-1].content
-        )
+        started = time.monotonic()
+        agent, message_history = await self._begin_turn(session_id, message)
+        turn_key = await self._turn_key(agent, message, message_history)
 
-        if stream:
+        output = await self._cached_response(
+            agent, session_id, message, turn_key, started
+        )
+        if output is not None:
+            if stream:
+                yield ChatResponse(
+                    message=output,
+                    session_id=session_id,
+                    metadata={"streaming": True, "complete": False, "delta": True},
+                )
+            yield ChatResponse(
+                message=output,
+                session_id=session_id,
+                metadata={
+                    "streaming": False,
+                    "complete": True,
+                    "cached": True,
+                    "usage": usage_metadata(RunUsage()),
+                },
+            )
+        elif stream:
             async for chunk in self._stream_response(
-                session_id, current_input, message_history
+                agent, session_id, message, message_history, turn_key, started
             ):
                 yield chunk
         else:
             response = await self._get_response(
-                session_id, current_input, message_history
+                agent, session_id, message, message_history, turn_key, started
             )
             yield response
 
+    async def _complete_turn(
+        self,
+        session_id: str,
+        current_input: str,
+        output: str,
+        new_messages: List[ModelMessage],
+        cache_key: Optional[str] = None,
+        usage: Optional[RunUsage] = None,
+    ):
+        """Append a finished turn to its session and queue it for memory history
+
+        The tokens of ``usage`` are added to those the session has used.
+        """
+        if cache_key and self.response_cache is not None:
+            self.response_cache.put(cache_key, output, new_messages)
+
+        def add_turn(session: ChatSession):
+            session.messages.append(ChatMessage(role="user", content=current_input))
+            session.messages.append(ChatMessage(role="assistant", content=output))
+            session.history.extend(new_messages)
+            if usage is not None:
+                charge(session, usage)
+
+        self._schedule_compaction(await self.sessions.aupdate(session_id, add_turn))
+
+        if self.capture_history:
+            # Queued only; written by the background history writer
+            conversation_recorder.record(current_input, output)
+
+    async def _fail_turn(self, session_id: str, current_input: str, error: BaseException):
+        """Add the message of a turn whose run failed or was abandoned to its session
+
+        A run stopped by its budget still charges the session what it spent.
+        """
+
+        def add_message(session: ChatSession):
+            session.messages.append(ChatMessage(role="user", content=current_input))
+            if isinstance(error, BudgetExceeded) and error.usage is not None:
+                charge(session, error.usage)
+
+        await self.sessions.aupdate(session_id, add_message)
+
+    async def _subscribe(
+        self, shared: SharedRun, session_id: str, current_input: str
+    ) -> AsyncIterator[Any]:
+        """Yield the events of a turn's run; a turn that does not finish keeps its message"""
+        try:
+            async for event in shared.events():
+                yield event
+        except BaseException as error:
+            # Shielded: a turn cancelled by its caller is recorded all the same
+            await asyncio.shield(self._fail_turn(session_id, current_input, error))
+            raise
+
     async def _stream_response(
-        self, session_id: str, current_input: str, message_history: List[str]
+        self,
+        agent: Agent,
+        session_id: str,
+        current_input: str,
+        message_history: List[ModelMessage],
+        turn_key: Optional[str] = None,
+        started: Optional[float] = None,
     ) -> AsyncIterator[ChatResponse]:
-        """Stream response from the agent"""
-        response_content = ""
-        max_retries = 3
-
-        for attempt in range(max_retries):
-            try:
-                async for result in self.agent.run_stream(
-                    current_input, message_history=message_history
-                ):
-                    if hasattr(result, "output") and result.output:
-                        response_content += result.output
-                        yield ChatResponse(
-                            message=response_content,
-                            session_id=session_id,
-                            metadata={"streaming": True, "complete": False},
-                        )
-
-                # Final complete response
-                yield ChatResponse(
-                    message=response_content,
-                    session_id=session_id,
-                    metadata={"streaming": False, "complete": True},
-                )
-                break
+        """Stream the response as text deltas, then one complete message with usage"""
+        shared = self._join_flight(
+            "stream",
+            turn_key,
+            lambda publish: self._upstream(
+                agent,
+                session_id,
+                lambda racer, out: self._run_streamed(
+                    racer, current_input, message_history, out
+                ),
+                publish,
+            ),
+        )
+        async for delta in self._subscribe(shared, session_id, current_input):
+            yield ChatResponse(
+                message=delta,
+                session_id=session_id,
+                metadata={"streaming": True, "complete": False, "delta": True},
+            )
+
+        metadata, tool_calls = await self._finish_shared_turn(
+            session_id, current_input, shared, turn_key, started
+        )
+
+        # Final complete response
+        yield ChatResponse(
+            message=shared.result.output,
+            session_id=session_id,
+            tool_calls=tool_calls,
+            metadata={"streaming": False, "complete": True, **metadata},
+        )
+
+    async def _upstream(
+        self,
+        agent: Agent,
+        session_id: str,
+        run: Callable[[Agent, Callable[[Any], None]], Awaitable[RunOutcome]],
+        publish: Callable[[Any], None],
+    ) -> RunOutcome:
+        """Run a turn upstream once admitted for its provider and model
+
+        Each attempt waits in the provider's fair queue while the provider or
+        the model is at its concurrency limit; no slot is held between
+        attempts. The attempts share one usage and
+        the usage limits of its session's budget; a run stopped by them
+        raises BudgetExceeded carrying the tokens it spent, which still count.
+        """
+        used = await self.session_tokens(session_id)
+        usage = RunUsage()
+        _turn_budget.set({"usage": usage, "usage_limits": self.budget.limits(used)})
+        _turn_admission.set(
+            lambda racer: self.admission.admit(
+                provider_of(racer.model), model_id(racer), session_id
+            )
+        )
+        started = time.monotonic()
+        try:
+            return await self._hedged(agent, run, publish)
+        except UsageLimitExceeded as error:
+            self.usage.record(
+                model_id(agent), usage, [], time.monotonic() - started, session_id=session_id
+            )
+            raise self.budget.exceeded(error, usage, used) from error
 
-            except ModelRetry as e:
-                if attempt < max_retries - 1:
-                    print(
-                        f"Model requested retry (attempt {attempt + 1}/{max_retries}): {e.message}"
+    async def _hedged(
+        self,
+        agent: Agent,
+        run: Callable[[Agent, Callable[[Any], None]], Awaitable[RunOutcome]],
+        publish: Callable[[Any], None],
+    ) -> RunOutcome:
+        """Run a turn, racing a duplicate against it when the first token is late
+
+        The contender that first publishes an event, calls a tool or finishes
+        wins; only its events reach ``publish`` and the other is cancelled.
+        Every contender's time to that point is recorded, and a cancelled
+        primary's elapsed time as a lower bound of it.
+        A primary that fails before winning is replaced by the hedge at once.
+        The hedge needs a free admission slot; it is skipped when turns are
+        queueing.
+        """
+        policy = self.hedging
+        if not policy.enabled:
+            return await run(agent, publish)
+
+        policy.stats["requests"] += 1
+        started = time.monotonic()
+        winner: Optional[str] = None
+        won = asyncio.Event()
+
+        def contender(name: str, racer: Agent, admitted: bool = False) -> asyncio.Task:
+            begun = time.monotonic()
+            observed = False
+
+            def observe():
+                """Record this contender's time to its first event, once"""
+                nonlocal observed
+                if not observed:
+                    observed = True
+                    policy.record(model_id(racer), time.monotonic() - begun)
+
+            def claim() -> bool:
+                nonlocal winner
+                observe()
+                if winner is None:
+                    winner = name
+                    won.set()
+                return winner == name
+
+            def forward(event: Any):
+                if claim():
+                    publish(event)
+
+            async def race() -> RunOutcome:
+                _hedge_claim.set(claim)
+                slots = []
+                if admitted:
+                    # The slot taken for the hedge admits its first attempt;
+                    # a retry queues like any other
+                    slots.append(
+                        self.admission.holding(provider_of(racer.model), model_id(racer))
                     )
-                    await asyncio.sleep(1)  # Brief delay before retry
+                    admit = _turn_admission.get()
+                    _turn_admission.set(lambda agent: slots.pop() if slots else admit(agent))
+                try:
+                    outcome = await run(racer, forward)
+                except asyncio.CancelledError:
+                    # A primary that lost took at least this long; leaving it
+                    # out would bias its latencies, and the delay, low
+                    if name == "primary":
+                        observe()
+                    raise
+                finally:
+                    if slots:
+                        self.admission.release(provider_of(racer.model), model_id(racer))
+                if not claim():
+                    raise asyncio.CancelledError()
+                return outcome
+
+            return asyncio.create_task(race())
+
+        racers = {"primary": contender("primary", agent)}
+        hedge_decided = False
+        waiter = asyncio.create_task(won.wait())
+        try:
+            while winner is None:
+                live = [task for task in racers.values() if not task.done()]
+                if hedge_decided and not live:
+                    break
+                timeout = None
+                if not hedge_decided:
+                    elapsed = time.monotonic() - started
+                    timeout = max(policy.delay(model_id(agent)) - elapsed, 0) if live else 0
+                await asyncio.wait(
+                    live + [waiter], timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if winner is not None or hedge_decided:
                     continue
-                else:
-                    raise AgentRunError(f"Max retries exceeded: {e.message}")
-            except (ModelHTTPError, UnexpectedModelBehavior) as e:
-                if attempt < max_retries - 1:
-                    print(
-                        f"Model error, retrying (attempt {attempt + 1}/{max_retries}): {e}"
-                    )
-                    await asyncio.sleep(2)  # Longer delay for HTTP errors
+                primary = racers["primary"]
+                if primary.done() and isinstance(primary.exception(), UsageLimitExceeded):
+                    # A duplicate would only spend more of the same budget
+                    return await primary
+
+                hedge_decided = True
+                fallback = policy.fallback_model
+                racer = self.agent_for_model(fallback) if fallback else agent
+                # The duplicate only runs on capacity nobody is waiting for
+                if not self.admission.try_acquire(provider_of(racer.model), model_id(racer)):
+                    policy.stats["skipped"] += 1
                     continue
-                else:
-                    raise
+                if racers["primary"].done():
+                    policy.stats["failovers"] += 1
+                policy.stats["hedged"] += 1
+                racers["hedge"] = contender("hedge", racer, admitted=True)
+
+            if winner is None:
+                # Every contender failed; report the primary's error
+                return await racers["primary"]
+
+            for name, task in racers.items():
+                if name != winner:
+                    task.cancel()
+            if winner == "hedge":
+                policy.stats["hedge_wins"] += 1
+            return await racers[winner]
+        finally:
+            waiter.cancel()
+            for task in racers.values():
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()  # Retrieved so a lost race is not logged
+
+    async def _run_streamed(
+        self,
+        agent: Agent,
+        current_input: str,
+        message_history: List[ModelMessage],
+        publish: Callable[[Any], None],
+    ) -> RunOutcome:
+        """Run the agent streaming, publishing each text delta"""
+        chunks: List[str] = []
+
+        async def attempt() -> RunOutcome:
+            prefetch: Dict[str, int] = {}
+            _prefetch_stats.set(prefetch)
+            async with agent.run_stream(
+                current_input, message_history=message_history, **_turn_budget.get()
+            ) as result:
+                async for delta in result.stream_text(
+                    delta=True, debounce_by=self.stream_debounce or None
+                ):
+                    if not delta:
+                        continue
+                    chunks.append(delta)
+                    publish(delta)
+
+            return RunOutcome(
+                "".join(chunks),
+                result.new_messages(),
+                result.usage(),
+                prefetch,
+                model_id(agent),
+            )
+
+        # Deltas already sent cannot be taken back, so only retry before the
+        # first one
+        return await resilience.run(
+            provider_of(agent.model),
+            attempt,
+            can_retry=lambda: not chunks,
+            admit=_attempt_admission(agent),
+        )
+
+    async def stream_events(
+        self, session_id: str, message: str
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Run one turn and yield its text deltas, tool calls and final usage
+
+        Events are dicts with a ``type`` of ``delta``, ``tool_call_start``,
+        ``tool_call_end`` or ``done``. Closing the iterator early (or
+        cancelling the task consuming it) cancels the model run unless an
+        identical turn still shares it, and the unfinished turn is not added
+        to the session.
+        """
+        started = time.monotonic()
+        agent, message_history = await self._begin_turn(session_id, message)
+        turn_key = await self._turn_key(agent, message, message_history)
+
+        output = await self._cached_response(
+            agent, session_id, message, turn_key, started
+        )
+        if output is not None:
+            yield {"type": "delta", "text": output}
+            yield {
+                "type": "done",
+                "session_id": session_id,
+                "message": output,
+                "cached": True,
+                "usage": usage_metadata(RunUsage()),
+            }
+            return
+
+        shared = self._join_flight(
+            "events",
+            turn_key,
+            lambda publish: self._upstream(
+                agent,
+                session_id,
+                lambda racer, out: self._run_events(racer, message, message_history, out),
+                publish,
+            ),
+        )
+        async for event in self._subscribe(shared, session_id, message):
+            yield event
+
+        metadata, tool_calls = await self._finish_shared_turn(
+            session_id, message, shared, turn_key, started
+        )
+        yield {
+            "type": "done",
+            "session_id": session_id,
+            "message": shared.result.output,
+            "tool_calls": tool_calls,
+            **metadata,
+        }
+
+    async def _run_events(
+        self,
+        agent: Agent,
+        current_input: str,
+        message_history: List[ModelMessage],
+        publish: Callable[[Any], None],
+    ) -> RunOutcome:
+        """Run the agent node by node, publishing deltas and tool calls"""
+        published = False
+
+        def publish_event(event: Dict[str, Any]):
+            nonlocal published
+            published = True
+            publish(event)
+
+        async def attempt() -> RunOutcome:
+            prefetch: Dict[str, int] = {}
+            _prefetch_stats.set(prefetch)
+
+            async with agent.iter(
+                current_input, message_history=message_history, **_turn_budget.get()
+            ) as run:
+                async for node in run:
+                    if Agent.is_model_request_node(node):
+                        async with node.stream(run.ctx) as request_stream:
+                            async for event in request_stream:
+                                for item in _model_stream_events(event):
+                                    publish_event(item)
+                    elif Agent.is_call_tools_node(node):
+                        async with node.stream(run.ctx) as tools_stream:
+                            async for event in tools_stream:
+                                if isinstance(event, FunctionToolCallEvent):
+                                    publish_event({
+                                        "type": "tool_call_start",
+                                        "tool_name": event.part.tool_name,
+                                        "tool_call_id": event.part.tool_call_id,
+                                        "args": _tool_args(event.part),
+                                    })
+                                elif isinstance(event, FunctionToolResultEvent):
+                                    publish_event({
+                                        "type": "tool_call_end",
+                                        "tool_name": event.result.tool_name,
+                                        "tool_call_id": event.result.tool_call_id,
+                                        "result": event.result.model_response_str(),
+                                    })
+                result = run.result
+
+            return RunOutcome(
+                result.output,
+                result.new_messages(),
+                result.usage(),
+                prefetch,
+                model_id(agent),
+            )
+
+        return await resilience.run(
+            provider_of(agent.model),
+            attempt,
+            can_retry=lambda: not published,
+            admit=_attempt_admission(agent),
+        )
 
     async def _get_response(
-        self, session_id: str, current_input: str, message_history: List[str]
+        self,
+        agent: Agent,
+        session_id: str,
+        current_input: str,
+        message_history: List[ModelMessage],
+        turn_key: Optional[str] = None,
+        started: Optional[float] = None,
     ) -> ChatResponse:
         """Get complete response from the agent"""
-        max_retries = 3
+        shared = self._join_flight(
+            "run",
+            turn_key,
+            lambda publish: self._upstream(
+                agent,
+                session_id,
+                lambda racer, out: self._run(racer, current_input, message_history),
+                publish,
+            ),
+        )
+        async for _ in self._subscribe(shared, session_id, current_input):
+            pass
 
-        for attempt in range(max_retries):
-            try:
-                result = await self.agent.run(
-                    current_input, message_history=message_history
-                )
+        metadata, tool_calls = await self._finish_shared_turn(
+            session_id, current_input, shared, turn_key, started
+        )
+        return ChatResponse(
+            message=shared.result.output,
+            session_id=session_id,
+            tool_calls=tool_calls,
+            metadata={"streaming": False, "complete": True, **metadata},
+        )
 
-                # Add assistant response to session
-                session = self.get_session(session_id)
-                if session:
-                    assistant_msg = ChatMessage(role="assistant", content=result.output)
-                    session.messages.append(assistant_msg)
+    async def _run(
+        self, agent: Agent, current_input: str, message_history: List[ModelMessage]
+    ) -> RunOutcome:
+        """Run the agent to completion"""
 
-                return ChatResponse(
-                    message=result.output,
-                    session_id=session_id,
-                    tool_calls=[],  # TODO: Extract tool calls from result
-                    metadata={"streaming": False, "complete": True},
-                )
+        async def attempt() -> RunOutcome:
+            prefetch: Dict[str, int] = {}
+            _prefetch_stats.set(prefetch)
+            result = await agent.run(
+                current_input, message_history=message_history, **_turn_budget.get()
+            )
+            return RunOutcome(
+                result.output,
+                result.new_messages(),
+                result.usage(),
+                prefetch,
+                model_id(agent),
+            )
 
-            except ModelRetry as e:
-                if attempt < max_retries - 1:
-                    print(
-                        f"Model requested retry (attempt {attempt + 1}/{max_retries}): {e.message}"
-                    )
-                    await asyncio.sleep(1)  # Brief delay before retry
-                    continue
-                else:
-                    raise AgentRunError(f"Max retries exceeded: {e.message}")
-            except (ModelHTTPError, UnexpectedModelBehavior) as e:
-                if attempt < max_retries - 1:
-                    print(
-                        f"Model error, retrying (attempt {attempt + 1}/{max_retries}): {e}"
-                    )
-                    await asyncio.sleep(2)  # Longer delay for HTTP errors
-                    continue
-                else:
-                    raise
+        return await resilience.run(
+            provider_of(agent.model), attempt, admit=_attempt_admission(agent)
+        )
 
 
 # Example usage
@@ -315,8 +1838,7 @@ async def main():
     print(f"Created session: {session.session_id}")
 
     # Send a message
-    response = await agent.send_message(session.session_id, "Hello!")
-    async for chunk in response:
+    async for chunk in agent.send_message(session.session_id, "Hello!"):
         print(f"Response: {chunk.message}")
 
 
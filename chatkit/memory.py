@@ -1,9 +1,22 @@
 """Memory Tool implementation for ChatKit"""
 
-from typing import Any, Dict
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
 from pathlib import Path
-import json
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime
+import asyncio
+import atexit
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import weakref
 
 from anthropic.lib.tools import BetaAbstractMemoryTool
 from anthropic.types.beta import (
@@ -15,63 +28,209 @@ from anthropic.types.beta import (
     BetaMemoryTool20250818ViewCommand,
 )
 
+from .search import BM25Index, build_memory_index, fact_text, note_text
+from .storage import MemoryBackend, JSONFileBackend, create_backend, split_path
+
+logger = logging.getLogger(__name__)
+
+
+T = TypeVar("T")
+
+# Sections covered by the search index
+INDEXED_SECTIONS = ("user_facts", "notes")
+
+# Instances with write-behind state, flushed at interpreter exit
+_open_memories: "weakref.WeakSet[ChatKitMemoryTool]" = weakref.WeakSet()
+
+# Dedicated pool for memory disk I/O, separate from the event loop's default
+# executor so memory work never queues behind (or starves) other blocking calls
+_memory_executor: Optional[ThreadPoolExecutor] = None
+_memory_executor_lock = threading.Lock()
 
-class ChatKitMemoryTool(BetaAbstractMemoryTool):
-    """Memory tool implementation for ChatKit using local file storage"""
 
-    def __init__(self, storage_dir: str = "memory"):
+def memory_executor() -> ThreadPoolExecutor:
+    """Return the thread pool that runs memory I/O for the async API"""
+    global _memory_executor
+    with _memory_executor_lock:
+        if _memory_executor is None:
+            _memory_executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("CHATKIT_MEMORY_IO_WORKERS", "4")),
+                thread_name_prefix="chatkit-memory",
+            )
+        return _memory_executor
+
+
+async def run_in_memory_executor(func: Callable[..., T], *args: Any) -> T:
+    """Run a blocking memory call on the memory executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(memory_executor(), functools.partial(func, *args))
+
+
+@atexit.register
+def _close_open_memories():
+    """Flush every live memory instance on shutdown"""
+    for memory in list(_open_memories):
+        memory.close()
+
+
+class ChatKitMemoryTool(BetaAbstractMemoryTool):
+    """Memory tool implementation for ChatKit
+
+    Storage is delegated to a MemoryBackend. By default memory lives in
+    ``chat_memory.json`` plus an append-only journal behind a write-behind
+    cache; pass a SQLiteBackend (or set ``CHATKIT_MEMORY_BACKEND=sqlite``)
+    for indexed, per-row storage.
+    """
+
+    def __init__(
+        self,
+        storage_dir: str = "memory",
+        flush_interval: float = 2.0,
+        max_dirty_ops: int = 20,
+        backend: Optional[MemoryBackend] = None,
+        history_capacity: int = 100,
+    ):
+        super().__init__()
+        self.history_capacity = history_capacity
         self.storage_dir = Path(storage_dir)
-        self.storage_dir.mkdir(exist_ok=True)
+        self.storage_dir.mkdir(parents=True, exist_ok=True)
         self.memory_file = self.storage_dir / "chat_memory.json"
-        self._ensure_memory_file()
-
-    def _ensure_memory_file(self):
-        """Ensure memory file exists with basic structure"""
-        if not self.memory_file.exists():
-            initial_memory = {
-                "user_preferences": {},
-                "conversation_history": [],
-                "user_facts": {},
-                "notes": [],
-                "created_at": datetime.now().isoformat(),
-                "updated_at": datetime.now().isoformat()
-            }
-            self._save_memory(initial_memory)
+        self.backend = backend or JSONFileBackend(
+            self.memory_file,
+            flush_interval=flush_interval,
+            max_dirty_ops=max_dirty_ops,
+        )
+
+        # Search index over facts and notes, built on first search and
+        # rebuilt when another writer changes either section
+        self._index: Optional[BM25Index] = None
+        self._index_versions: Dict[str, Any] = {}
+        self._next_note_id = 0
+        self._index_lock = threading.Lock()
+
+        # Async writers are serialized per event loop
+        self._async_write_locks: "weakref.WeakKeyDictionary[Any, asyncio.Lock]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+        _open_memories.add(self)
 
     def _load_memory(self) -> Dict[str, Any]:
-        """Load memory from storage"""
+        """Load the whole memory document"""
+        return self.backend.document()
+
+    def flush(self):
+        """Write pending changes to storage"""
+        self.backend.flush()
+
+    def close(self):
+        """Flush pending changes and release storage resources"""
+        self.backend.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator["ChatKitMemoryTool"]:
+        """Batch several mutations into one atomic, persisted write
+
+        ``with memory.transaction() as m:`` applies every change made through
+        ``m`` together; with the JSON backend they are appended to the journal
+        in a single write under the inter-process lock, with SQLite they share
+        one ``BEGIN IMMEDIATE`` transaction. If the block raises, nothing is
+        persisted.
+        """
         try:
-            with open(self.memory_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            # Reset memory if corrupted - return default structure instead of recursing
-            self._ensure_memory_file()
-            return {
-                "user_facts": {},
-                "notes": [],
-                "created_at": datetime.now().isoformat(),
-                "updated_at": datetime.now().isoformat()
-            }
-
-    def _save_memory(self, memory: Dict[str, Any]):
-        """Save memory to storage"""
-        memory["updated_at"] = datetime.now().isoformat()
-        with open(self.memory_file, 'w', encoding='utf-8') as f:
-            json.dump(memory, f, indent=2, ensure_ascii=False)
+            with self.backend.transaction():
+                yield self
+        except BaseException:
+            # The index may hold entries of the rolled back changes
+            with self._index_lock:
+                self._index = None
+            raise
+
+    def _indexed_versions(self) -> Dict[str, Any]:
+        versions = self.backend.section_versions()
+        return {section: versions.get(section) for section in INDEXED_SECTIONS}
+
+    def _memory_index(self) -> BM25Index:
+        """Return the search index, (re)building it if facts or notes changed
+
+        The versions come from the backend, so writes by other instances or
+        processes sharing the storage are picked up too.
+        """
+        versions = self._indexed_versions()
+        if self._index is None or versions != self._index_versions:
+            try:
+                notes = self.backend.read(["notes"])
+            except KeyError:
+                notes = []
+            self._index = build_memory_index(self.get_user_facts(), notes)
+            self._index_versions = versions
+            self._next_note_id = len(notes)
+        return self._index
+
+    def _index_own_write(self, section: str, before: Dict[str, Any]) -> bool:
+        """After this instance wrote to a section, keep the index if still current
+
+        The index stays valid only if it matched the versions before the
+        write and the write was the section's only change since. Call with
+        ``_index_lock`` held; returns whether entries may be added to it.
+        """
+        after = self._indexed_versions()
+        current = (
+            self._index is not None
+            and self._index_versions == before
+            and isinstance(before[section] or 0, int)
+            and after[section] == (before[section] or 0) + 1
+            and all(after[name] == before[name] for name in after if name != section)
+        )
+        if current:
+            self._index_versions = after
+        else:
+            self._index = None
+        return current
+
+    def _invalidate_index(self, *paths: List[str]):
+        """Drop the search index if a path command touched facts or notes"""
+        if any(parts and parts[0] in INDEXED_SECTIONS for parts in paths):
+            with self._index_lock:
+                self._index = None
+
+    def summary(self) -> Dict[str, Any]:
+        """Return entry counts, byte sizes and timestamps without loading memory"""
+        return self.backend.stats()
+
+    def section_versions(self) -> Dict[str, Any]:
+        """Return per-section versions that change whenever a section does"""
+        return self.backend.section_versions()
+
+    def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Return the k facts and notes most relevant to a query"""
+        with self._index_lock:
+            results = self._memory_index().search(query, k)
+        return [{"score": round(score, 4), **payload} for _, score, payload in results]
+
+    def _async_write_lock(self) -> asyncio.Lock:
+        """Return the writer lock of the running event loop"""
+        loop = asyncio.get_running_loop()
+        lock = self._async_write_locks.get(loop)
+        if lock is None:
+            lock = self._async_write_locks[loop] = asyncio.Lock()
+        return lock
+
+    async def _aread(self, func: Callable[..., T], *args: Any) -> T:
+        return await run_in_memory_executor(func, *args)
+
+    async def _awrite(self, func: Callable[..., T], *args: Any) -> T:
+        async with self._async_write_lock():
+            return await run_in_memory_executor(func, *args)
 
     def view(self, command: BetaMemoryTool20250818ViewCommand = None) -> str:
         """View memory content"""
-        memory = self._load_memory()
-
         # If specific path is provided, navigate to that part of memory
         if command and command.path:
-            parts = command.path.strip('/').split('/')
-            current = memory
-            for part in parts:
-                if part and part in current:
-                    current = current[part]
-                else:
-                    return f"Path '{command.path}' not found in memory"
+            try:
+                current = self.backend.read(split_path(command.path))
+            except KeyError:
+                return f"Path '{command.path}' not found in memory"
 
             if isinstance(current, dict):
                 return json.dumps(current, indent=2, ensure_ascii=False)
@@ -80,16 +239,18 @@ class ChatKitMemoryTool(BetaAbstractMemoryTool):
             else:
                 return str(current)
 
+        sections = self.summary()["sections"]
+
         # Return summary of memory
         summary = []
-        if memory.get("user_preferences"):
-            summary.append(f"User preferences: {len(memory['user_preferences'])} items")
-        if memory.get("user_facts"):
-            summary.append(f"User facts: {len(memory['user_facts'])} items")
-        if memory.get("notes"):
-            summary.append(f"Notes: {len(memory['notes'])} items")
-        if memory.get("conversation_history"):
-            summary.append(f"Conversation history: {len(memory['conversation_history'])} entries")
+        if sections["user_preferences"]["count"]:
+            summary.append(f"User preferences: {sections['user_preferences']['count']} items")
+        if sections["user_facts"]["count"]:
+            summary.append(f"User facts: {sections['user_facts']['count']} items")
+        if sections["notes"]["count"]:
+            summary.append(f"Notes: {sections['notes']['count']} items")
+        if sections["conversation_history"]["count"]:
+            summary.append(f"Conversation history: {sections['conversation_history']['count']} entries")
 
         if not summary:
             return "Memory is currently empty"
@@ -98,189 +259,543 @@ class ChatKitMemoryTool(BetaAbstractMemoryTool):
 
     def create(self, command: BetaMemoryTool20250818CreateCommand) -> str:
         """Create new memory entry"""
-        memory = self._load_memory()
-
-        if command.path:
-            parts = command.path.strip('/').split('/')
-            current = memory
-
-            # Navigate to parent directory
-            for part in parts[:-1]:
-                if part and part not in current:
-                    current[part] = {}
-                current = current[part]
-
-            # Create the new entry
-            final_part = parts[-1]
-            if final_part:
-                current[final_part] = {}
-                self._save_memory(memory)
+        parts = split_path(command.path)
+
+        if parts:
+            try:
+                self.backend.create(parts)
+                self._invalidate_index(parts)
                 return f"Created memory entry at {command.path}"
+            except TypeError:
+                pass
 
         return f"Failed to create memory entry at {command.path}"
 
     def str_replace(self, command: BetaMemoryTool20250818StrReplaceCommand) -> str:
         """Replace string in memory"""
-        memory = self._load_memory()
-
-        if command.path:
-            parts = command.path.strip('/').split('/')
-            current = memory
-
-            # Navigate to the target
-            for part in parts:
-                if part and part in current:
-                    current = current[part]
-                else:
-                    return f"Path '{command.path}' not found"
-
-            # Replace content
-            if isinstance(current, str):
-                old_content = current
-                current = command.new_content
-                self._save_memory(memory)
-                return f"Replaced content at {command.path}: '{old_content}' -> '{command.new_content}'"
-            else:
+        parts = split_path(command.path)
+
+        if parts:
+            try:
+                self.backend.str_replace(parts, command.old_str, command.new_str)
+                self._invalidate_index(parts)
+            except KeyError:
+                return f"Path '{command.path}' not found"
+            except TypeError:
                 return f"Cannot replace content at {command.path} - not a string"
+            except ValueError:
+                return f"'{command.old_str}' not found at {command.path}"
+            return f"Replaced content at {command.path}: '{command.old_str}' -> '{command.new_str}'"
 
         return "No path specified for string replacement"
 
     def insert(self, command: BetaMemoryTool20250818InsertCommand) -> str:
         """Insert content into memory"""
-        memory = self._load_memory()
-
-        if command.path:
-            parts = command.path.strip('/').split('/')
-            current = memory
-
-            # Navigate to parent
-            for part in parts[:-1]:
-                if part and part not in current:
-                    current[part] = {}
-                current = current[part]
-
-            # Insert content
-            final_part = parts[-1]
-            if final_part:
-                if final_part not in current:
-                    current[final_part] = []
-
-                if isinstance(current[final_part], list):
-                    insert_line = command.insert_line or len(current[final_part])
-                    current[final_part].insert(insert_line, command.content)
-                    self._save_memory(memory)
-                    return f"Inserted content at line {insert_line} in {command.path}"
-                else:
-                    return f"Cannot insert into {command.path} - not a list"
+        parts = split_path(command.path)
+
+        if parts:
+            try:
+                insert_line = self.backend.insert(
+                    parts, command.insert_line or None, command.insert_text
+                )
+            except TypeError:
+                return f"Cannot insert into {command.path} - not a list"
+            self._invalidate_index(parts)
+            return f"Inserted content at line {insert_line} in {command.path}"
 
         return f"Failed to insert content at {command.path}"
 
     def delete(self, command: BetaMemoryTool20250818DeleteCommand) -> str:
         """Delete memory entry"""
-        memory = self._load_memory()
-
-        if command.path:
-            parts = command.path.strip('/').split('/')
-            current = memory
-
-            # Navigate to parent
-            for part in parts[:-1]:
-                if part and part in current:
-                    current = current[part]
-                else:
-                    return f"Path '{command.path}' not found"
-
-            # Delete the entry
-            final_part = parts[-1]
-            if final_part and final_part in current:
-                del current[final_part]
-                self._save_memory(memory)
+        parts = split_path(command.path)
+
+        if parts:
+            try:
+                self.backend.remove(parts)
+                self._invalidate_index(parts)
                 return f"Deleted memory entry: {command.path}"
+            except KeyError:
+                pass
 
         return f"Failed to delete {command.path}"
 
     def rename(self, command: BetaMemoryTool20250818RenameCommand) -> str:
         """Rename memory entry"""
-        memory = self._load_memory()
-
-        if command.old_path and command.new_path:
-            old_parts = command.old_path.strip('/').split('/')
-            new_parts = command.new_path.strip('/').split('/')
-
-            # Navigate to parent of old path
-            current = memory
-            for part in old_parts[:-1]:
-                if part and part in current:
-                    current = current[part]
-                else:
-                    return f"Old path '{command.old_path}' not found"
-
-            # Move the entry
-            final_old = old_parts[-1]
-            final_new = new_parts[-1]
-
-            if final_old in current:
-                # Navigate to parent of new path
-                new_current = memory
-                for part in new_parts[:-1]:
-                    if part and part not in new_current:
-                        new_current[part] = {}
-                    new_current = new_current[part]
-
-                # Perform the rename/move
-                new_current[final_new] = current[final_old]
-                del current[final_old]
-                self._save_memory(memory)
+        old_parts = split_path(command.old_path)
+        new_parts = split_path(command.new_path)
+
+        if old_parts and new_parts:
+            try:
+                self.backend.rename(old_parts, new_parts)
+                self._invalidate_index(old_parts, new_parts)
                 return f"Renamed {command.old_path} to {command.new_path}"
+            except KeyError:
+                return f"Old path '{command.old_path}' not found"
+            except TypeError:
+                pass
 
         return f"Failed to rename {command.old_path} to {command.new_path}"
 
     def clear_all_memory(self) -> str:
         """Clear all memory"""
-        initial_memory = {
-            "user_preferences": {},
-            "conversation_history": [],
-            "user_facts": {},
-            "notes": [],
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat()
-        }
-        self._save_memory(initial_memory)
+        self.backend.clear()
+        with self._index_lock:
+            self._index = None
         return "All memory cleared"
 
+    def get_user_facts(self) -> Dict[str, Any]:
+        """Return all stored user facts"""
+        try:
+            return self.backend.read(["user_facts"])
+        except KeyError:
+            return {}
+
     def add_user_fact(self, fact_key: str, fact_value: str) -> str:
         """Add a user fact to memory"""
-        memory = self._load_memory()
-        memory["user_facts"][fact_key] = fact_value
-        self._save_memory(memory)
+        before = self._indexed_versions()
+        self.backend.set_fact(fact_key, fact_value)
+        with self._index_lock:
+            if self._index_own_write("user_facts", before):
+                self._index.add(
+                    f"fact:{fact_key}",
+                    fact_text(fact_key, fact_value),
+                    {"type": "fact", "key": fact_key, "value": fact_value},
+                )
         return f"Added user fact: {fact_key} = {fact_value}"
 
+    def add_user_facts(self, facts: Dict[str, str]) -> str:
+        """Add several user facts with a single persisted write"""
+        with self.transaction():
+            for fact_key, fact_value in facts.items():
+                self.add_user_fact(fact_key, fact_value)
+        return f"Added {len(facts)} user facts: {', '.join(facts)}"
+
     def add_conversation_entry(self, user_message: str, assistant_response: str) -> str:
         """Add conversation to history"""
-        memory = self._load_memory()
         entry = {
             "timestamp": datetime.now().isoformat(),
             "user": user_message,
             "assistant": assistant_response
         }
-        memory["conversation_history"].append(entry)
-        # Keep only last 100 conversations
-        memory["conversation_history"] = memory["conversation_history"][-100:]
-        self._save_memory(memory)
+        # Keep only the last history_capacity conversations
+        self.backend.append_conversation(entry, self.history_capacity)
         return "Conversation added to history"
 
+    def add_conversation_entries(self, entries: List[Dict[str, Any]]) -> str:
+        """Add several history entries (with timestamp, user and assistant) at once"""
+        self.backend.append_conversations(entries, self.history_capacity)
+        return f"{len(entries)} conversations added to history"
+
     def add_note(self, title: str, content: str) -> str:
         """Add a note to memory"""
-        memory = self._load_memory()
         note = {
             "title": title,
             "content": content,
             "created_at": datetime.now().isoformat()
         }
-        memory["notes"].append(note)
-        self._save_memory(memory)
+        before = self._indexed_versions()
+        self.backend.append_note(note)
+        with self._index_lock:
+            if self._index_own_write("notes", before):
+                self._index.add(
+                    f"note:{self._next_note_id}", note_text(note), {"type": "note", "note": note}
+                )
+                self._next_note_id += 1
         return f"Note '{title}' added to memory"
 
+    def add_notes(self, notes: List[Dict[str, str]]) -> str:
+        """Add several notes with a single persisted write"""
+        with self.transaction():
+            for note in notes:
+                self.add_note(note["title"], note["content"])
+        titles = ", ".join(f"'{note['title']}'" for note in notes)
+        return f"Added {len(notes)} notes to memory: {titles}"
+
+    # Async API: the same operations with disk work moved off the event loop
+
+    async def aload_memory(self) -> Dict[str, Any]:
+        return await self._aread(self._load_memory)
+
+    async def aflush(self):
+        await self._awrite(self.flush)
+
+    async def arun_transaction(self, func: Callable[["ChatKitMemoryTool"], T]) -> T:
+        """Run func(memory) inside a transaction on the memory executor"""
+
+        def run() -> T:
+            with self.transaction() as memory:
+                return func(memory)
+
+        return await self._awrite(run)
+
+    async def asummary(self) -> Dict[str, Any]:
+        return await self._aread(self.summary)
+
+    async def asection_versions(self) -> Dict[str, Any]:
+        return await self._aread(self.section_versions)
+
+    async def asearch(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        return await self._aread(self.search, query, k)
+
+    async def aview(self, command: BetaMemoryTool20250818ViewCommand = None) -> str:
+        return await self._aread(self.view, command)
+
+    async def acreate(self, command: BetaMemoryTool20250818CreateCommand) -> str:
+        return await self._awrite(self.create, command)
+
+    async def astr_replace(self, command: BetaMemoryTool20250818StrReplaceCommand) -> str:
+        return await self._awrite(self.str_replace, command)
+
+    async def ainsert(self, command: BetaMemoryTool20250818InsertCommand) -> str:
+        return await self._awrite(self.insert, command)
+
+    async def adelete(self, command: BetaMemoryTool20250818DeleteCommand) -> str:
+        return await self._awrite(self.delete, command)
+
+    async def arename(self, command: BetaMemoryTool20250818RenameCommand) -> str:
+        return await self._awrite(self.rename, command)
+
+    async def aclear_all_memory(self) -> str:
+        return await self._awrite(self.clear_all_memory)
+
+    async def aget_user_facts(self) -> Dict[str, Any]:
+        return await self._aread(self.get_user_facts)
+
+    async def aadd_user_fact(self, fact_key: str, fact_value: str) -> str:
+        return await self._awrite(self.add_user_fact, fact_key, fact_value)
+
+    async def aadd_user_facts(self, facts: Dict[str, str]) -> str:
+        return await self._awrite(self.add_user_facts, facts)
+
+    async def aadd_conversation_entries(self, entries: List[Dict[str, Any]]) -> str:
+        return await self._awrite(self.add_conversation_entries, entries)
+
+    async def aadd_notes(self, notes: List[Dict[str, str]]) -> str:
+        return await self._awrite(self.add_notes, notes)
+
+    async def aadd_conversation_entry(self, user_message: str, assistant_response: str) -> str:
+        return await self._awrite(self.add_conversation_entry, user_message, assistant_response)
+
+    async def aadd_note(self, title: str, content: str) -> str:
+        return await self._awrite(self.add_note, title, content)
+
+
+def _backend_options() -> Dict[str, Any]:
+    """Backend settings shared by the global memory and its shards"""
+    return {
+        "flush_interval": float(os.getenv("CHATKIT_MEMORY_FLUSH_INTERVAL", "2.0")),
+        "max_dirty_ops": int(os.getenv("CHATKIT_MEMORY_MAX_DIRTY_OPS", "20")),
+        "compact_threshold": int(os.getenv("CHATKIT_MEMORY_COMPACT_BYTES", str(256 * 1024))),
+    }
+
+
+def _history_capacities() -> Dict[str, int]:
+    """Per-namespace history capacities
+
+    ``CHATKIT_MEMORY_HISTORY_CAPACITY`` sets the default and
+    ``CHATKIT_MEMORY_HISTORY_CAPACITIES`` overrides it for a namespace or a
+    namespace kind, e.g. ``session=20,user:alice=500``.
+    """
+    capacities = {"default": int(os.getenv("CHATKIT_MEMORY_HISTORY_CAPACITY", "100"))}
+    for item in os.getenv("CHATKIT_MEMORY_HISTORY_CAPACITIES", "").split(","):
+        key, _, value = item.partition("=")
+        if key.strip() and value.strip():
+            capacities[key.strip()] = int(value)
+    return capacities
+
 
 # Global memory instance
-chatkit_memory = ChatKitMemoryTool()
\ No newline at end of file
+chatkit_memory = ChatKitMemoryTool(
+    backend=create_backend(
+        os.getenv("CHATKIT_MEMORY_BACKEND", "json"),
+        Path("memory"),
+        **_backend_options(),
+    ),
+    history_capacity=_history_capacities()["default"],
+)
+
+
+class MemoryShards:
+    """Per-namespace memory shards with a bounded LRU of open shards
+
+    Each namespace (a user or session id) gets its own storage directory
+    under ``<storage_dir>/shards``. At most ``max_open`` shards are kept
+    loaded; the least recently used one is flushed when the limit is reached,
+    closed when nothing holds it any more, and transparently reopened on its
+    next access. The default
+    namespace is the shared global memory and is never evicted.
+
+    ``history_capacities`` bounds the conversation history per namespace: a
+    key may be a full namespace (``user:alice``), a namespace kind
+    (``session``) or ``default``.
+    """
+
+    def __init__(
+        self,
+        default: ChatKitMemoryTool,
+        storage_dir: str = "memory",
+        max_open: int = 64,
+        backend_kind: str = "json",
+        history_capacities: Optional[Dict[str, int]] = None,
+        **backend_options: Any,
+    ):
+        self.default = default
+        self.history_capacities = dict(history_capacities or {})
+        if "default" in self.history_capacities:
+            default.history_capacity = self.history_capacities["default"]
+        self.shards_dir = Path(storage_dir) / "shards"
+        self.max_open = max_open
+        self.backend_kind = backend_kind
+        self.backend_options = backend_options
+        self._open: "OrderedDict[str, ChatKitMemoryTool]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def shard_name(namespace: str) -> str:
+        """Return a filesystem-safe, collision-free directory name"""
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", namespace)[:48]
+        digest = hashlib.sha1(namespace.encode("utf-8")).hexdigest()[:10]
+        return f"{safe}-{digest}"
+
+    def get(self, namespace: Optional[str] = None) -> ChatKitMemoryTool:
+        """Return the memory shard for a namespace, opening it if needed"""
+        if not namespace:
+            return self.default
+
+        evicted = None
+        with self._lock:
+            memory = self._open.get(namespace)
+            if memory is not None:
+                self._open.move_to_end(namespace)
+                return memory
+
+            storage_dir = self.shards_dir / self.shard_name(namespace)
+            memory = ChatKitMemoryTool(
+                str(storage_dir),
+                backend=create_backend(
+                    self.backend_kind, storage_dir, **self.backend_options
+                ),
+                history_capacity=self.history_capacity(namespace),
+            )
+            self._open[namespace] = memory
+            if len(self._open) > self.max_open:
+                _, evicted = self._open.popitem(last=False)
+
+        if evicted is not None:
+            # A request, a tool call or the history writer may still hold the
+            # evicted shard: flush it now, close it once the last holder lets go
+            evicted.flush()
+            weakref.finalize(evicted, evicted.backend.close)
+        return memory
+
+    def history_capacity(self, namespace: Optional[str] = None) -> int:
+        """Return the conversation history capacity of a namespace"""
+        if not namespace:
+            return self.history_capacities.get("default", self.default.history_capacity)
+        kind = namespace.partition(":")[0]
+        for key in (namespace, kind, "default"):
+            if key in self.history_capacities:
+                return self.history_capacities[key]
+        return self.default.history_capacity
+
+    def set_history_capacity(self, namespace: Optional[str], capacity: int):
+        """Change the history capacity of a namespace (or kind, or ``default``)"""
+        self.history_capacities[namespace or "default"] = capacity
+        with self._lock:
+            shards = [(None, self.default), *self._open.items()]
+        for name, memory in shards:
+            memory.history_capacity = self.history_capacity(name)
+
+    async def aget(self, namespace: Optional[str] = None) -> ChatKitMemoryTool:
+        """Return the memory shard for a namespace, loading it off the event loop"""
+        if not namespace:
+            return self.default
+
+        with self._lock:
+            memory = self._open.get(namespace)
+            if memory is not None:
+                self._open.move_to_end(namespace)
+                return memory
+
+        return await run_in_memory_executor(self.get, namespace)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the currently open shards"""
+        with self._lock:
+            return {"open_shards": len(self._open), "max_open": self.max_open}
+
+    def close(self):
+        """Flush and close every open shard and the default memory"""
+        with self._lock:
+            shards = list(self._open.values())
+            self._open.clear()
+        for memory in shards:
+            memory.close()
+        self.default.close()
+
+
+memory_shards = MemoryShards(
+    chatkit_memory,
+    max_open=int(os.getenv("CHATKIT_MEMORY_MAX_OPEN_SHARDS", "64")),
+    backend_kind=os.getenv("CHATKIT_MEMORY_BACKEND", "json"),
+    history_capacities=_history_capacities(),
+    **_backend_options(),
+)
+
+# Namespace of the request being served, set by the web layer
+current_memory_namespace: ContextVar[Optional[str]] = ContextVar(
+    "chatkit_memory_namespace", default=None
+)
+
+
+def resolve_memory_namespace(
+    user_id: Optional[str] = None, session_id: Optional[str] = None
+) -> Optional[str]:
+    """Pick the memory namespace for a request
+
+    A user id always wins. With ``CHATKIT_MEMORY_SCOPE=session`` anonymous
+    requests get a per-session namespace; otherwise they share the default
+    memory.
+    """
+    if user_id:
+        return f"user:{user_id}"
+    if session_id and os.getenv("CHATKIT_MEMORY_SCOPE", "user") == "session":
+        return f"session:{session_id}"
+    return None
+
+
+@contextmanager
+def memory_namespace(namespace: Optional[str]) -> Iterator[None]:
+    """Route memory access in this context to a namespace"""
+    token = current_memory_namespace.set(namespace)
+    try:
+        yield
+    finally:
+        current_memory_namespace.reset(token)
+
+
+def get_memory() -> ChatKitMemoryTool:
+    """Return the memory shard for the current request context"""
+    return memory_shards.get(current_memory_namespace.get())
+
+
+async def aget_memory() -> ChatKitMemoryTool:
+    """Return the memory shard for the current request context without blocking"""
+    return await memory_shards.aget(current_memory_namespace.get())
+
+
+class ConversationRecorder:
+    """Fire-and-forget, batched capture of conversation turns
+
+    ``record()`` only appends the turn to an in-memory ring buffer (a deque
+    per namespace bounded by that namespace's history capacity) and returns.
+    A background thread drains the rings every ``interval`` seconds, or as
+    soon as ``batch_size`` turns are waiting, and persists each namespace's
+    batch with a single append. If the writer falls behind, the oldest
+    unwritten turns are overwritten, exactly as the stored history would
+    drop them.
+    """
+
+    def __init__(self, interval: float = 1.0, batch_size: int = 32):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._rings: Dict[Optional[str], deque] = {}
+        self._waiting = 0
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        # Updated by record() and the writer thread, always under _condition
+        self.stats = {"recorded": 0, "written": 0, "overwritten": 0, "batches": 0, "errors": 0}
+
+    def record(
+        self,
+        user_message: str,
+        assistant_response: str,
+        namespace: Optional[str] = None,
+    ):
+        """Queue a turn for the current (or given) memory namespace"""
+        if namespace is None:
+            namespace = current_memory_namespace.get()
+        entry = {
+            "timestamp": datetime.now().isoformat(),
+            "user": user_message,
+            "assistant": assistant_response,
+        }
+
+        with self._condition:
+            ring = self._rings.get(namespace)
+            if ring is None:
+                capacity = max(1, memory_shards.history_capacity(namespace))
+                ring = self._rings[namespace] = deque(maxlen=capacity)
+            if len(ring) == ring.maxlen:
+                self.stats["overwritten"] += 1
+            else:
+                self._waiting += 1
+            ring.append(entry)
+            self.stats["recorded"] += 1
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="chatkit-history-writer", daemon=True
+                )
+                self._thread.start()
+            if self._waiting >= self.batch_size:
+                self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._closed and self._waiting < self.batch_size:
+                    self._condition.wait(self.interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def flush(self):
+        """Write every queued turn now"""
+        with self._write_lock:
+            with self._condition:
+                rings, self._rings = self._rings, {}
+                self._waiting = 0
+
+            for namespace, ring in rings.items():
+                if not ring:
+                    continue
+                try:
+                    memory_shards.get(namespace).add_conversation_entries(list(ring))
+                except Exception as e:
+                    with self._condition:
+                        self.stats["errors"] += 1
+                    logger.error(
+                        "Failed to record conversation history for %s: %s",
+                        namespace or "default",
+                        e,
+                    )
+                    continue
+                # Stats are shared with record() on the event loop
+                with self._condition:
+                    self.stats["written"] += len(ring)
+                    self.stats["batches"] += 1
+
+    def close(self):
+        """Stop the background writer and write what is queued"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        with self._condition:
+            self._thread = None
+            self._closed = False
+        self.flush()
+
+
+conversation_recorder = ConversationRecorder(
+    interval=float(os.getenv("CHATKIT_HISTORY_FLUSH_INTERVAL", "1.0")),
+    batch_size=int(os.getenv("CHATKIT_HISTORY_BATCH_SIZE", "32")),
+)
+
+# Registered after _close_open_memories, so it runs first at exit
+atexit.register(conversation_recorder.close)
@@ -0,0 +1,238 @@
+"""Shared model providers and pooled HTTP clients for ChatKit agents
+
+Every agent built from a model string gets its own provider and, with it,
+its own connection pool. The registry instead keeps one provider per
+provider name, backed by one tuned ``httpx.AsyncClient``, and hands out
+models bound to it, so all agents talking to the same API share
+connections, TLS sessions and keep-alive.
+"""
+
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Union
+import os
+import threading
+
+import httpx
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+except ImportError:  # httpx falls back to HTTP/1.1
+    h2 = None
+
+
+class _MeteredStream(httpx.AsyncByteStream):
+    """Response body that reports when the connection is handed back"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close = on_close
+        self._closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._on_close()
+
+
+class MeteredTransport(httpx.AsyncHTTPTransport):
+    """Connection-pooling transport that tracks how busy its pool is
+
+    A request is in flight from when it is sent until its response body is
+    closed, which is as long as it holds a pooled connection. Requests sent
+    while ``max_connections`` are already in flight have to wait for one to
+    be released and are counted as ``waited``.
+    """
+
+    def __init__(self, limits: httpx.Limits, **kwargs: Any):
+        super().__init__(limits=limits, **kwargs)
+        self.max_connections = limits.max_connections
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.waited = 0
+        self.errors = 0
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            self.requests += 1
+            if self.max_connections and self.in_flight >= self.max_connections:
+                self.waited += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            with self._lock:
+                self.errors += 1
+            self._release()
+            raise
+        response.stream = _MeteredStream(response.stream, self._release)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        """Return request counters and the current pool occupancy"""
+        connections = list(self._pool.connections)
+        idle = sum(1 for connection in connections if connection.is_idle())
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "waited": self.waited,
+                "errors": self.errors,
+                "max_connections": self.max_connections,
+                "saturation": (
+                    self.in_flight / self.max_connections if self.max_connections else 0.0
+                ),
+                "connections": len(connections),
+                "idle_connections": idle,
+            }
+
+
+class ProviderRegistry:
+    """One provider and one pooled HTTP client per provider name
+
+    ``model()`` turns a model string like ``openai:gpt-4o`` into a model
+    bound to the shared provider. Model strings of providers the registry
+    does not know (and ``test``) are returned unchanged for pydantic-ai to
+    resolve on its own.
+    """
+
+    # Model kinds (the part before the colon) and the provider they use
+    MODEL_PROVIDERS = {
+        "openai": "openai",
+        "openai-chat": "openai",
+        "openai-responses": "openai",
+        "anthropic": "anthropic",
+    }
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = True,
+        timeout: float = 600.0,
+        connect_timeout: float = 5.0,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.http2 = http2 and h2 is not None
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._transports: Dict[str, MeteredTransport] = {}
+        self._providers: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def http_client(self, provider: str) -> httpx.AsyncClient:
+        """Return the shared HTTP client of a provider, creating it on first use"""
+        with self._lock:
+            client = self._clients.get(provider)
+            if client is None or client.is_closed:
+                transport = MeteredTransport(self.limits, http2=self.http2)
+                client = httpx.AsyncClient(transport=transport, timeout=self.timeout)
+                self._clients[provider] = client
+                self._transports[provider] = transport
+                self._providers.pop(provider, None)
+            return client
+
+    def provider(self, name: str) -> Any:
+        """Return the shared provider for a provider name"""
+        client = self.http_client(name)
+        with self._lock:
+            provider = self._providers.get(name)
+            if provider is None:
+                # The SDK clients would retry failed calls on their own;
+                # the resilience policy is the only retry layer
+                if name == "openai":
+                    from openai import AsyncOpenAI
+                    from pydantic_ai.providers.openai import OpenAIProvider
+
+                    provider = OpenAIProvider(
+                        openai_client=AsyncOpenAI(http_client=client, max_retries=0)
+                    )
+                elif name == "anthropic":
+                    from anthropic import AsyncAnthropic
+                    from pydantic_ai.providers.anthropic import AnthropicProvider
+
+                    provider = AnthropicProvider(
+                        anthropic_client=AsyncAnthropic(http_client=client, max_retries=0)
+                    )
+                else:
+                    raise ValueError(f"Unknown provider: {name}")
+                self._providers[name] = provider
+            return provider
+
+    def model(self, model: str) -> Union[str, Any]:
+        """Return a model bound to the shared provider, or the string as is"""
+        kind, _, model_name = model.partition(":")
+        provider_name = self.MODEL_PROVIDERS.get(kind)
+        if not model_name or provider_name is None:
+            return model
+
+        provider = self.provider(provider_name)
+        if kind == "openai-responses":
+            from pydantic_ai.models.openai import OpenAIResponsesModel
+
+            return OpenAIResponsesModel(model_name, provider=provider)
+        if provider_name == "openai":
+            from pydantic_ai.models.openai import OpenAIChatModel
+
+            return OpenAIChatModel(model_name, provider=provider)
+        from pydantic_ai.models.anthropic import AnthropicModel
+
+        return AnthropicModel(model_name, provider=provider)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return pool settings and per-provider saturation metrics"""
+        with self._lock:
+            transports = dict(self._transports)
+        return {
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "providers": {name: transport.stats() for name, transport in transports.items()},
+        }
+
+    async def aclose(self):
+        """Close every shared HTTP client"""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._transports.clear()
+            self._providers.clear()
+        for client in clients:
+            await client.aclose()
+
+
+def _registry_from_env() -> ProviderRegistry:
+    return ProviderRegistry(
+        max_connections=int(os.getenv("CHATKIT_HTTP_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("CHATKIT_HTTP_MAX_KEEPALIVE", "20")),
+        keepalive_expiry=float(os.getenv("CHATKIT_HTTP_KEEPALIVE_EXPIRY", "30")),
+        http2=os.getenv("CHATKIT_HTTP2", "1") != "0",
+    )
+
+
+# Registry shared by every agent in the process
+provider_registry = _registry_from_env()
+
+
+def shared_model(model: Optional[str]) -> Union[str, Any, None]:
+    """Resolve a model string through the shared provider registry"""
+    return provider_registry.model(model) if model else model
@@ -0,0 +1,299 @@
+"""Retries with backoff and per-provider circuit breakers for model calls
+
+Every agent run in ChatKit goes through ``resilience.run``. Failed runs are
+retried with exponential backoff and full jitter, waiting as long as a
+provider's ``Retry-After`` header asks on 429 and 503 responses. Each
+provider has a circuit breaker: after enough consecutive provider failures
+it opens and runs fail fast with ``CircuitOpenError`` instead of adding load
+to an upstream that is already failing. Once the reset timeout has passed a
+single probe run is let through; its outcome closes the breaker or opens it
+again.
+"""
+
+from email.utils import parsedate_to_datetime
+from contextlib import nullcontext
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, Optional, TypeVar
+import asyncio
+import datetime
+import os
+import random
+import threading
+import time
+
+import httpx
+from pydantic_ai.exceptions import (
+    AgentRunError,
+    ModelHTTPError,
+    ModelRetry,
+    UnexpectedModelBehavior,
+)
+
+T = TypeVar("T")
+
+# Status codes worth retrying; other 4xx responses fail the same way again
+RETRYABLE_STATUS = {408, 409, 429}
+
+# Provider SDK errors raised when no response was received at all
+TRANSPORT_ERRORS = {"APIConnectionError", "APITimeoutError"}
+
+
+class CircuitOpenError(AgentRunError):
+    """Raised instead of calling a provider whose circuit breaker is open"""
+
+    def __init__(self, provider: str, retry_in: float):
+        self.provider = provider
+        self.retry_in = retry_in
+        super().__init__(
+            f"Provider {provider} is unavailable, retry in {retry_in:.0f}s"
+        )
+
+
+def provider_of(model: Any) -> str:
+    """Return the provider name of a model or model string"""
+    if model is None:
+        return "unknown"
+    if isinstance(model, str):
+        from .providers import ProviderRegistry
+
+        kind = model.partition(":")[0]
+        return ProviderRegistry.MODEL_PROVIDERS.get(kind, kind)
+    return getattr(model, "system", None) or type(model).__name__
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Return the seconds a provider asked to wait before retrying, if any"""
+    response = getattr(error.__cause__, "response", None) or getattr(
+        error, "response", None
+    )
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(float(value) / 1000, 0.0)
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((when - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+
+def is_provider_failure(error: BaseException) -> bool:
+    """Whether an error says the provider is unhealthy (trips the breaker)"""
+    if isinstance(error, ModelHTTPError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, httpx.TransportError) or (
+        type(error).__name__ in TRANSPORT_ERRORS
+    )
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether running again can give a different outcome"""
+    if isinstance(error, ModelHTTPError):
+        return error.status_code in RETRYABLE_STATUS or error.status_code >= 500
+    return isinstance(error, (ModelRetry, UnexpectedModelBehavior)) or is_provider_failure(
+        error
+    )
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker of one provider
+
+    ``closed`` lets every call through. ``failure_threshold`` provider
+    failures in a row open it; while ``open`` calls are rejected until
+    ``reset_timeout`` has passed. Then it is ``half_open`` and lets one probe
+    call through: success closes it, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._stats = {"successes": 0, "failures": 0, "opened": 0, "rejected": 0}
+
+    def before_call(self, provider: str):
+        """Raise CircuitOpenError unless a call may go to the provider now"""
+        with self._lock:
+            if self.state == "open":
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self._stats["rejected"] += 1
+                    raise CircuitOpenError(provider, remaining)
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._probing:
+                    self._stats["rejected"] += 1
+                    raise CircuitOpenError(provider, self.reset_timeout)
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._stats["successes"] += 1
+            self.consecutive_failures = 0
+            self.state = "closed"
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._stats["failures"] += 1
+            self.consecutive_failures += 1
+            if self.state == "half_open" or (
+                self.state == "closed"
+                and self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._stats["opened"] += 1
+            self._probing = False
+
+    def release(self):
+        """End a call that said nothing about the provider's health"""
+        with self._lock:
+            self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = 0.0
+            if self.state == "open":
+                retry_in = max(self.opened_at + self.reset_timeout - time.monotonic(), 0.0)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "retry_in": retry_in,
+                **self._stats,
+            }
+
+
+class Resilience:
+    """Retry policy plus one circuit breaker per provider"""
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+        max_retry_after: float = 60.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "retries": 0, "retry_after": 0, "exhausted": 0}
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        """Return the circuit breaker of a provider, creating it on first use"""
+        with self._lock:
+            breaker = self._breakers.get(provider)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self._breakers[provider] = breaker
+            return breaker
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential delay before retry number ``attempt``"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    async def run(
+        self,
+        provider: str,
+        call: Callable[[], Awaitable[T]],
+        can_retry: Callable[[], bool] = lambda: True,
+        admit: Optional[Callable[[], AsyncContextManager[Any]]] = None,
+    ) -> T:
+        """Run ``call`` with retries, guarded by the provider's circuit breaker
+
+        ``can_retry`` is asked before each retry; a streamed run that already
+        sent output to the client cannot be taken back and returns False.
+        ``admit`` is entered around each attempt, so a concurrency slot is
+        not held while waiting to retry.
+        """
+        breaker = self.breaker(provider)
+        self._stats["runs"] += 1
+
+        for attempt in range(1, self.max_attempts + 1):
+            async with admit() if admit is not None else nullcontext():
+                breaker.before_call(provider)
+                try:
+                    result = await call()
+                except BaseException as e:
+                    if is_provider_failure(e):
+                        breaker.record_failure()
+                    else:
+                        breaker.release()
+                    if not isinstance(e, Exception) or not is_retryable(e):
+                        raise
+
+                    delay = retry_after(e)
+                    if delay is not None and delay > self.max_retry_after:
+                        print(f"{provider} asked to retry in {delay:.0f}s, giving up: {e}")
+                        raise
+                    if attempt == self.max_attempts or not can_retry():
+                        self._stats["exhausted"] += 1
+                        if isinstance(e, ModelRetry):
+                            raise AgentRunError(f"Max retries exceeded: {e.message}")
+                        raise
+
+                    if delay is not None:
+                        self._stats["retry_after"] += 1
+                    else:
+                        delay = self.backoff(attempt)
+                    self._stats["retries"] += 1
+                    print(
+                        f"Model error, retrying in {delay:.1f}s "
+                        f"(attempt {attempt + 1}/{self.max_attempts}): {e}"
+                    )
+                else:
+                    breaker.record_success()
+                    return result
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return retry counters and the breaker state of every provider"""
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {
+            "max_attempts": self.max_attempts,
+            "base_delay": self.base_delay,
+            "max_delay": self.max_delay,
+            "failure_threshold": self.failure_threshold,
+            "reset_timeout": self.reset_timeout,
+            **self._stats,
+            "providers": {name: breaker.stats() for name, breaker in breakers.items()},
+        }
+
+
+def _resilience_from_env() -> Resilience:
+    return Resilience(
+        max_attempts=int(os.getenv("CHATKIT_RETRY_ATTEMPTS", "3")),
+        base_delay=float(os.getenv("CHATKIT_RETRY_BASE_DELAY", "0.5")),
+        max_delay=float(os.getenv("CHATKIT_RETRY_MAX_DELAY", "20")),
+        max_retry_after=float(os.getenv("CHATKIT_RETRY_MAX_RETRY_AFTER", "60")),
+        failure_threshold=int(os.getenv("CHATKIT_BREAKER_THRESHOLD", "5")),
+        reset_timeout=float(os.getenv("CHATKIT_BREAKER_RESET", "30")),
+    )
+
+
+# Retry policy and circuit breakers shared by every agent in the process
+resilience = _resilience_from_env()
@@ -0,0 +1,147 @@
+"""Relevance-ranked search over memory notes and facts"""
+
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+import math
+import re
+
+
+STOPWORDS = frozenset(
+    """
+    a an and are as at be but by for from has have i if in into is it its
+    me my of on or so that the their then there these this to was we were
+    what when where which who will with you your
+    """.split()
+)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase terms, dropping stopwords"""
+    return [
+        token
+        for token in _TOKEN_RE.findall(text.lower())
+        if token not in STOPWORDS
+    ]
+
+
+class BM25Index:
+    """Incrementally maintained inverted index with BM25 scoring
+
+    Documents can be added, replaced and removed one at a time; postings and
+    length statistics are updated in place, so keeping the index current
+    costs O(document) per change rather than a full rebuild.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, Counter] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._payloads: Dict[str, Any] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_lengths)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._doc_lengths
+
+    def add(self, doc_id: str, text: str, payload: Any = None):
+        """Index a document, replacing any previous version"""
+        if doc_id in self._doc_lengths:
+            self.remove(doc_id)
+
+        terms = Counter(tokenize(text))
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[doc_id] = frequency
+
+        length = sum(terms.values())
+        self._doc_terms[doc_id] = terms
+        self._doc_lengths[doc_id] = length
+        self._payloads[doc_id] = payload
+        self._total_length += length
+
+    def remove(self, doc_id: str):
+        """Drop a document from the index"""
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+        self._total_length -= self._doc_lengths.pop(doc_id)
+        self._payloads.pop(doc_id, None)
+
+    def clear(self):
+        """Drop every document"""
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._doc_lengths.clear()
+        self._payloads.clear()
+        self._total_length = 0
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[str, float, Any]]:
+        """Return the top-k documents as (doc_id, score, payload) tuples"""
+        doc_count = len(self._doc_lengths)
+        if not doc_count or k <= 0:
+            return []
+
+        average_length = self._total_length / doc_count or 1.0
+        scores: Dict[str, float] = {}
+
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+
+            # BM25 idf, floored at zero for terms present in most documents
+            df = len(postings)
+            idf = max(0.0, math.log((doc_count - df + 0.5) / (df + 0.5) + 1))
+
+            for doc_id, frequency in postings.items():
+                norm = self.k1 * (
+                    1 - self.b + self.b * self._doc_lengths[doc_id] / average_length
+                )
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * (
+                    frequency * (self.k1 + 1) / (frequency + norm)
+                )
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [
+            (doc_id, score, self._payloads.get(doc_id))
+            for doc_id, score in ranked
+            if score > 0
+        ]
+
+
+def fact_text(key: str, value: Any) -> str:
+    """Return the searchable text of a user fact"""
+    return f"{key.replace('_', ' ')} {value}"
+
+
+def note_text(note: Any) -> str:
+    """Return the searchable text of a note"""
+    if isinstance(note, dict):
+        return f"{note.get('title', '')} {note.get('content', '')}"
+    return str(note)
+
+
+def build_memory_index(
+    facts: Dict[str, Any], notes: List[Any], index: Optional[BM25Index] = None
+) -> BM25Index:
+    """Index user facts and notes of a memory document"""
+    index = index or BM25Index()
+    index.clear()
+    for key, value in facts.items():
+        index.add(f"fact:{key}", fact_text(key, value), {"type": "fact", "key": key, "value": value})
+    for position, note in enumerate(notes):
+        index.add(f"note:{position}", note_text(note), {"type": "note", "note": note})
+    return index
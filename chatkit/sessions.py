@@ -0,0 +1,299 @@
+"""Chat session storage for ChatKit
+
+Sessions live on disk and the most recently used ones are kept in memory.
+The resident set is bounded both by the number of sessions and by their
+serialized size; the least recently used session is dropped when either
+limit is exceeded and rehydrated from disk on its next access.
+"""
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Generic, Optional, Tuple, Type, TypeVar
+import hashlib
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+
+from pydantic import BaseModel
+
+from .memory import run_in_memory_executor
+
+
+S = TypeVar("S", bound=BaseModel)
+
+
+class SessionBackend(ABC):
+    """Durable storage of serialized sessions, compressed at rest"""
+
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[bytes]:
+        """Return the serialized session, or None if it was never saved"""
+
+    @abstractmethod
+    def save(self, session_id: str, data: bytes):
+        """Store the serialized session, replacing any previous version"""
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Remove the session if it exists"""
+
+    def close(self):
+        """Release any resources held by the backend"""
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """All sessions in one SQLite table, one zlib-compressed row per session"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id TEXT PRIMARY KEY,
+            data BLOB NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, db_file: Path):
+        self.db_file = Path(db_file)
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.db_file, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def load(self, session_id: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return zlib.decompress(row[0]) if row else None
+
+    def save(self, session_id: str, data: bytes):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (session_id) DO UPDATE SET "
+                "data = excluded.data, updated_at = excluded.updated_at",
+                (session_id, zlib.compress(data), time.time()),
+            )
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM sessions WHERE session_id = ?", (session_id,)
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class FileSessionBackend(SessionBackend):
+    """One zlib-compressed file per session, replaced atomically on save"""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, session_id: str) -> Path:
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", session_id)[:48]
+        digest = hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:10]
+        return self.directory / f"{safe}-{digest}.json.z"
+
+    def load(self, session_id: str) -> Optional[bytes]:
+        try:
+            return zlib.decompress(self._path(session_id).read_bytes())
+        except FileNotFoundError:
+            return None
+
+    def save(self, session_id: str, data: bytes):
+        path = self._path(session_id)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".session-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(zlib.compress(data))
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def delete(self, session_id: str):
+        self._path(session_id).unlink(missing_ok=True)
+
+
+def create_session_backend(kind: str, storage_dir: Path) -> SessionBackend:
+    """Create a session backend by name (``sqlite`` or ``files``)"""
+    storage_dir = Path(storage_dir)
+    if kind == "sqlite":
+        return SQLiteSessionBackend(storage_dir / "sessions.db")
+    if kind == "files":
+        return FileSessionBackend(storage_dir / "sessions")
+    raise ValueError(f"Unknown session backend: {kind}")
+
+
+class SessionStore(Generic[S]):
+    """Bounded in-memory LRU of sessions in front of a session backend
+
+    ``save`` writes the session through to the backend, so an
+    evicted session never loses state: dropping it from memory is free and
+    ``get`` rehydrates it on the next access. A session modified in place
+    must be passed to ``save`` for the change to be persisted; ``update``
+    applies a change to the latest saved state instead, so concurrent
+    writers of one session do not overwrite each other.
+    """
+
+    def __init__(
+        self,
+        backend: SessionBackend,
+        session_type: Type[S],
+        max_sessions: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.backend = backend
+        self.session_type = session_type
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._resident: "OrderedDict[str, Tuple[S, int]]" = OrderedDict()
+        self._resident_bytes = 0
+        self._lock = threading.Lock()
+        # Updates of one session are serialized; sessions share a few locks
+        self._update_locks = [threading.Lock() for _ in range(64)]
+        self._stats = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0}
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def __len__(self) -> int:
+        """Number of resident sessions"""
+        with self._lock:
+            return len(self._resident)
+
+    def _admit(self, session_id: str, session: S, size: int):
+        """Make a session the most recently used and evict over the limits"""
+        with self._lock:
+            previous = self._resident.pop(session_id, None)
+            if previous is not None:
+                self._resident_bytes -= previous[1]
+            self._resident[session_id] = (session, size)
+            self._resident_bytes += size
+
+            # The session just admitted stays even if it alone is over budget
+            while len(self._resident) > 1 and (
+                len(self._resident) > self.max_sessions
+                or self._resident_bytes > self.max_bytes
+            ):
+                _, (_, evicted_size) = self._resident.popitem(last=False)
+                self._resident_bytes -= evicted_size
+                self._stats["evictions"] += 1
+
+    def get(self, session_id: str) -> Optional[S]:
+        """Return a session, rehydrating it from the backend if it was evicted"""
+        with self._lock:
+            entry = self._resident.get(session_id)
+            if entry is not None:
+                self._resident.move_to_end(session_id)
+                self._stats["hits"] += 1
+                return entry[0]
+            self._stats["misses"] += 1
+
+        data = self.backend.load(session_id)
+        if data is None:
+            return None
+
+        with self._lock:
+            # Another thread may have rehydrated it meanwhile
+            entry = self._resident.get(session_id)
+            if entry is not None:
+                return entry[0]
+            self._stats["loads"] += 1
+        session = self.session_type.model_validate_json(data)
+        self._admit(session_id, session, len(data))
+        return session
+
+    def save(self, session: S):
+        """Persist a session and make it resident"""
+        data = session.model_dump_json().encode("utf-8")
+        self.backend.save(session.session_id, data)
+        self._admit(session.session_id, session, len(data))
+
+    def update(self, session_id: str, change: Callable[[S], Any]) -> S:
+        """Apply a change to a session and persist it; return the session
+
+        The change is made to the session as last saved (a new one if there
+        is none), while no other update of the session runs, so a writer
+        holding a copy loaded before an eviction cannot undo it.
+        """
+        stripe = zlib.crc32(session_id.encode("utf-8")) % len(self._update_locks)
+        with self._update_locks[stripe]:
+            session = self.get(session_id)
+            if session is None:
+                session = self.session_type(session_id=session_id)
+            change(session)
+            self.save(session)
+            return session
+
+    def delete(self, session_id: str):
+        """Remove a session from memory and from the backend"""
+        with self._lock:
+            entry = self._resident.pop(session_id, None)
+            if entry is not None:
+                self._resident_bytes -= entry[1]
+        self.backend.delete(session_id)
+
+    async def aget(self, session_id: str) -> Optional[S]:
+        """Return a session, loading it off the event loop on a miss"""
+        with self._lock:
+            entry = self._resident.get(session_id)
+            if entry is not None:
+                self._resident.move_to_end(session_id)
+                self._stats["hits"] += 1
+                return entry[0]
+        return await run_in_memory_executor(self.get, session_id)
+
+    async def asave(self, session: S):
+        """Persist a session off the event loop"""
+        await run_in_memory_executor(self.save, session)
+
+    async def aupdate(self, session_id: str, change: Callable[[S], Any]) -> S:
+        """Apply a change to a session off the event loop"""
+        return await run_in_memory_executor(self.update, session_id, change)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the resident set and cache hit statistics"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "resident": len(self._resident),
+                "resident_bytes": self._resident_bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes,
+                **self._stats,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        """Drop the resident set and close the backend"""
+        with self._lock:
+            self._resident.clear()
+            self._resident_bytes = 0
+        self.backend.close()
+
+
+def create_session_store(session_type: Type[S]) -> SessionStore[S]:
+    """Create the session store configured by the environment"""
+    return SessionStore(
+        create_session_backend(
+            os.getenv("CHATKIT_SESSION_BACKEND", "sqlite"),
+            Path(os.getenv("CHATKIT_SESSION_DIR", "memory")),
+        ),
+        session_type,
+        max_sessions=int(os.getenv("CHATKIT_SESSION_MAX_RESIDENT", "1000")),
+        max_bytes=int(os.getenv("CHATKIT_SESSION_MAX_BYTES", str(64 * 1024 * 1024))),
+    )
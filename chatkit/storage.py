@@ -0,0 +1,1416 @@
+"""Storage backends for ChatKit memory"""
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import argparse
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no inter-process locking
+    fcntl = None
+
+
+def split_path(path: Optional[str]) -> List[str]:
+    """Split a memory path like ``/user_facts/name`` into its parts"""
+    if not path:
+        return []
+    return [part for part in path.strip('/').split('/') if part]
+
+
+# Marker for an entry that does not exist
+_MISSING = object()
+
+
+def new_memory_document() -> Dict[str, Any]:
+    """Return an empty memory document"""
+    now = datetime.now().isoformat()
+    return {
+        "user_preferences": {},
+        "conversation_history": [],
+        "user_facts": {},
+        "notes": [],
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+# Top-level keys holding document metadata rather than memory sections
+META_KEYS = ("created_at", "updated_at")
+
+# Sections reported in every summary, even when empty
+SUMMARY_SECTIONS = ("user_preferences", "user_facts", "notes", "conversation_history")
+
+
+def value_size(value: Any) -> int:
+    """Return the size in bytes of a value serialized as stored"""
+    return len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+def section_stats(value: Any) -> Dict[str, int]:
+    """Return the entry count and byte size of a memory section"""
+    if isinstance(value, dict):
+        entries = list(value.values())
+    elif isinstance(value, list):
+        entries = value
+    else:
+        entries = [value]
+    return {"count": len(entries), "bytes": sum(value_size(entry) for entry in entries)}
+
+
+def document_stats(document: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+    """Compute section statistics of a whole document"""
+    return {
+        key: section_stats(value)
+        for key, value in document.items()
+        if key not in META_KEYS and not key.startswith("_")
+    }
+
+
+def format_stats(
+    sections: Dict[str, Dict[str, int]], created_at: Any, updated_at: Any
+) -> Dict[str, Any]:
+    """Shape section statistics into a memory summary"""
+    summary = {name: {"count": 0, "bytes": 0} for name in SUMMARY_SECTIONS}
+    for name, stats in sections.items():
+        if name in summary or stats["count"] or stats["bytes"]:
+            summary[name] = dict(stats)
+    return {
+        "sections": summary,
+        "bytes": sum(stats["bytes"] for stats in summary.values()),
+        "created_at": created_at,
+        "updated_at": updated_at,
+    }
+
+
+class MemoryBackend(ABC):
+    """Storage backend behind ChatKitMemoryTool
+
+    Memory is addressed by path parts such as ``["user_facts", "name"]``.
+    Backends implement the ``read``/``write``/``remove`` primitives; the path
+    commands used by the memory tool are built on top of them. Backends may
+    override the domain operations (facts, notes, history) with cheaper
+    versions.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    @abstractmethod
+    def document(self) -> Dict[str, Any]:
+        """Return the whole memory document"""
+
+    @abstractmethod
+    def read(self, parts: List[str]) -> Any:
+        """Return the value at a path, raising KeyError if it does not exist"""
+
+    @abstractmethod
+    def write(self, parts: List[str], value: Any):
+        """Store a value at a path, creating missing parents"""
+
+    @abstractmethod
+    def remove(self, parts: List[str]):
+        """Remove a path, raising KeyError if it does not exist"""
+
+    @abstractmethod
+    def clear(self):
+        """Reset memory to an empty document"""
+
+    def stats(self) -> Dict[str, Any]:
+        """Return entry counts, byte sizes and timestamps of the memory
+
+        Backends keep these as counters updated on every mutation; this
+        fallback computes them from the whole document.
+        """
+        document = self.document()
+        return format_stats(
+            document_stats(document), document.get("created_at"), document.get("updated_at")
+        )
+
+    def section_versions(self) -> Dict[str, Any]:
+        """Return a version per memory section that changes with the section
+
+        Versions are shared by every process using the same storage, so they
+        tell when another writer changed a section. Backends keep counters
+        bumped on every mutation; this fallback hashes each section.
+        """
+        return {
+            key: hashlib.sha256(
+                json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+            ).hexdigest()
+            for key, value in self.document().items()
+            if key not in META_KEYS
+        }
+
+    @contextmanager
+    def atomic(self) -> Iterator[None]:
+        """Group several primitives into a single atomic change"""
+        with self._lock:
+            yield
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """Apply several mutations atomically and persist them in one write
+
+        Changes are discarded if the block raises.
+        """
+        with self.atomic():
+            yield
+        self.flush()
+
+    def flush(self):
+        """Persist pending changes"""
+
+    def close(self):
+        """Persist pending changes and release resources"""
+        self.flush()
+
+    # Path commands
+
+    def create(self, parts: List[str]):
+        """Create an empty entry at a path"""
+        self.write(parts, {})
+
+    def insert(self, parts: List[str], index: Optional[int], item: Any) -> int:
+        """Insert an item into the list at a path, creating it if missing"""
+        with self.atomic():
+            try:
+                current = self.read(parts)
+            except KeyError:
+                current = []
+            if not isinstance(current, list):
+                raise TypeError(f"{'/'.join(parts)} is not a list")
+            position = len(current) if index is None else index
+            current.insert(position, item)
+            self.write(parts, current)
+            return position
+
+    def str_replace(self, parts: List[str], old: str, new: str):
+        """Replace the first occurrence of old in the string at a path"""
+        with self.atomic():
+            current = self.read(parts)
+            if not isinstance(current, str):
+                raise TypeError(f"{'/'.join(parts)} is not a string")
+            if old not in current:
+                raise ValueError(f"'{old}' not found in {'/'.join(parts)}")
+            self.write(parts, current.replace(old, new, 1))
+
+    def rename(self, old_parts: List[str], new_parts: List[str]):
+        """Move the entry at old_parts to new_parts"""
+        with self.atomic():
+            value = self.read(old_parts)
+            self.remove(old_parts)
+            self.write(new_parts, value)
+
+    # Domain operations
+
+    def set_fact(self, key: str, value: Any):
+        """Store a user fact"""
+        self.write(["user_facts", key], value)
+
+    def append_note(self, note: Dict[str, Any]):
+        """Append a note"""
+        self.insert(["notes"], None, note)
+
+    def append_conversation(self, entry: Dict[str, Any], capacity: int):
+        """Append a conversation entry, keeping at most capacity entries"""
+        self.append_conversations([entry], capacity)
+
+    def append_conversations(self, entries: List[Dict[str, Any]], capacity: int):
+        """Append conversation entries, dropping the oldest beyond capacity"""
+        with self.atomic():
+            try:
+                history = list(self.read(["conversation_history"]))
+            except KeyError:
+                history = []
+            history.extend(entries)
+            self.write(["conversation_history"], history[-capacity:] if capacity else [])
+
+
+class JSONFileBackend(MemoryBackend):
+    """Memory stored as a JSON snapshot plus an append-only journal
+
+    The document is parsed once and then served from an in-process cache.
+    Each mutation is recorded as a compact journal record. Records are
+    written back in batches: after ``flush_interval`` seconds, as soon as
+    ``max_dirty_ops`` mutations are pending, or on close. Once the journal
+    grows past ``compact_threshold`` bytes, a background compaction folds it
+    into the snapshot, which is written to a temp file and atomically renamed
+    over the memory file. On startup the snapshot is loaded and the journal
+    tail replayed on top of it.
+
+    Cached documents are copy-on-write: a mutation copies the containers on
+    its path and swaps in a new version, so readers get an immutable snapshot
+    without taking a lock. Journal appends and compactions hold an exclusive
+    ``flock`` on ``chat_memory.lock`` and first replay records appended by
+    other processes, so several server workers can share one memory file.
+    """
+
+    # Snapshot key recording the last journal record folded into it
+    SNAPSHOT_SEQ_KEY = "_journal_seq"
+    # Document key holding the section statistics of that version
+    STATS_KEY = "_stats"
+    # Document key holding the mutation counter of each section
+    VERSIONS_KEY = "_versions"
+    HIDDEN_KEYS = (STATS_KEY, VERSIONS_KEY)
+
+    def __init__(
+        self,
+        memory_file: Path,
+        flush_interval: float = 2.0,
+        max_dirty_ops: int = 20,
+        compact_threshold: int = 256 * 1024,
+        refresh_interval: float = 1.0,
+    ):
+        super().__init__()
+        self.memory_file = Path(memory_file)
+        self.memory_file.parent.mkdir(parents=True, exist_ok=True)
+        self.journal_file = self.memory_file.with_suffix(".journal")
+        self.lock_file = self.memory_file.with_suffix(".lock")
+        self.flush_interval = flush_interval
+        self.max_dirty_ops = max_dirty_ops
+        self.compact_threshold = compact_threshold
+        self.refresh_interval = refresh_interval
+
+        # Durable document (all journal records up to _seq) and the cached
+        # document, which is _base with the _pending records applied
+        self._base: Optional[Dict[str, Any]] = None
+        self._memory: Optional[Dict[str, Any]] = None
+        self._seq = 0
+        self._pending: List[Dict[str, Any]] = []
+
+        self._journal_id: Optional[tuple] = None
+        self._journal_bytes = 0
+        self._torn_tail = False
+        self._refreshed_at = 0.0
+
+        self._lock_fd: Optional[int] = None
+        self._flock_depth = 0
+        self._txn_depth = 0
+        self._flush_timer: Optional[threading.Timer] = None
+        self._compactor: Optional[threading.Thread] = None
+        self._closed = False
+
+        with self._lock, self._file_lock():
+            if not self.memory_file.exists() and not self.journal_file.exists():
+                self._write_snapshot(new_memory_document(), 0)
+
+    # Inter-process locking
+
+    @contextmanager
+    def _file_lock(self, blocking: bool = True) -> Iterator[bool]:
+        """Hold the inter-process lock; callers must already hold ``_lock``"""
+        if fcntl is None:
+            yield True
+            return
+
+        if self._flock_depth == 0:
+            if self._lock_fd is None:
+                self._lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(
+                    self._lock_fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB)
+                )
+            except BlockingIOError:
+                yield False
+                return
+        self._flock_depth += 1
+        try:
+            yield True
+        finally:
+            self._flock_depth -= 1
+            if self._flock_depth == 0:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    # Loading and replay
+
+    def _load(self) -> Dict[str, Any]:
+        """Return the cached document, reading from disk only on first access"""
+        with self._lock:
+            if self._memory is None:
+                with self._file_lock():
+                    self._refresh()
+            return self._memory
+
+    def _snapshot(self) -> Dict[str, Any]:
+        """Return the current document version without blocking on writers"""
+        memory = self._memory
+        if memory is None:
+            return self._load()
+        if time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            self._try_refresh()
+        return self._memory
+
+    def _try_refresh(self):
+        """Pick up other processes' writes unless a writer holds the locks"""
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            with self._file_lock(blocking=False) as locked:
+                if locked:
+                    self._refresh()
+        finally:
+            self._lock.release()
+
+    def _read_snapshot(self) -> Tuple[Dict[str, Any], int]:
+        try:
+            with open(self.memory_file, 'r', encoding='utf-8') as f:
+                memory = json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError):
+            # Reset memory if corrupted
+            memory = new_memory_document()
+        seq = memory.pop(self.SNAPSHOT_SEQ_KEY, 0)
+        if not isinstance(memory.get(self.STATS_KEY), dict):
+            # Snapshots written before statistics were tracked
+            memory[self.STATS_KEY] = document_stats(memory)
+        memory.setdefault(self.VERSIONS_KEY, {})
+        return memory, seq
+
+    def _journal_stat(self) -> Tuple[Optional[tuple], int]:
+        try:
+            stat = os.stat(self.journal_file)
+        except FileNotFoundError:
+            return None, 0
+        return (stat.st_dev, stat.st_ino), stat.st_size
+
+    def _read_journal_tail(self) -> List[Dict[str, Any]]:
+        """Return journal records after the last consumed byte, in seq order"""
+        try:
+            with open(self.journal_file, 'rb') as f:
+                f.seek(self._journal_bytes)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+
+        self._journal_bytes += len(data)
+        lines = data.split(b"\n")
+        # A crash mid-append leaves at most a torn last line
+        self._torn_tail = lines[-1] != b""
+
+        records = []
+        for line in lines:
+            try:
+                records.append(json.loads(line))
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+        return sorted(records, key=lambda record: record["seq"])
+
+    def _refresh(self):
+        """Catch up with the journal, rebasing pending records on top
+
+        Callers hold ``_lock`` and the file lock.
+        """
+        base = self._base
+        journal_id, size = self._journal_stat()
+        if base is None or journal_id != self._journal_id or size < self._journal_bytes:
+            # First load, or another process compacted the journal
+            snapshot, seq = self._read_snapshot()
+            if base is None or seq > self._seq:
+                base, self._seq = snapshot, seq
+            self._journal_id, self._journal_bytes = journal_id, 0
+
+        for record in self._read_journal_tail():
+            if record["seq"] <= self._seq:
+                continue
+            try:
+                base = self._apply(base, record)
+            except (KeyError, TypeError, IndexError):
+                pass
+            self._seq = record["seq"]
+
+        if base is not self._base:
+            self._base = base
+            self._memory = self._replay(base, self._pending)
+        self._refreshed_at = time.monotonic()
+
+    def _replay(self, memory: Dict[str, Any], records: List[Dict[str, Any]]) -> Dict[str, Any]:
+        for record in records:
+            try:
+                memory = self._apply(memory, record)
+            except (KeyError, TypeError, IndexError):
+                pass
+        return memory
+
+    # Records
+
+    @staticmethod
+    def _copy_path(
+        memory: Dict[str, Any], parts: List[str], create: bool
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Copy the containers along a path, returning the new root and parent"""
+        root = dict(memory)
+        current = root
+        for part in parts[:-1]:
+            if part not in current:
+                if not create:
+                    raise KeyError('/'.join(parts))
+                child = {}
+            else:
+                child = current[part]
+                if not isinstance(child, dict):
+                    raise TypeError(f"{part} is not a directory")
+                child = dict(child)
+            current[part] = child
+            current = child
+        return root, current
+
+    def _apply(self, memory: Dict[str, Any], record: Dict[str, Any]) -> Dict[str, Any]:
+        """Return a new document version with a journal record applied"""
+        op = record["op"]
+        parts = record.get("path", [])
+        before = memory
+        touched = parts[:1] + record.get("new_path", [])[:1]
+        for key in self.HIDDEN_KEYS:
+            if key in touched:
+                raise KeyError(key)
+
+        if op == "set":
+            memory, parent = self._copy_path(memory, parts, create=True)
+            parent[parts[-1]] = record["value"]
+        elif op == "del":
+            memory, parent = self._copy_path(memory, parts, create=False)
+            del parent[parts[-1]]
+        elif op == "insert":
+            memory, parent = self._copy_path(memory, parts, create=True)
+            before_items = parent.get(parts[-1], [])
+            if not isinstance(before_items, list):
+                raise TypeError(f"{'/'.join(parts)} is not a list")
+            values = record["values"] if "values" in record else [record["value"]]
+            index = record.get("index")
+            capacity = record.get("capacity")
+            if index is None:
+                # Bounded appends drop the oldest entries in the same copy
+                drop = len(before_items) + len(values)
+                drop -= drop if capacity is None else min(drop, capacity)
+                if drop <= len(before_items):
+                    items = before_items[drop:] + values
+                else:
+                    items = values[drop - len(before_items):]
+            else:
+                items = list(before_items)
+                items[index:index] = values
+                if capacity is not None and len(items) > capacity:
+                    del items[:len(items) - capacity]
+            parent[parts[-1]] = items
+        elif op == "rename":
+            new_parts = record["new_path"]
+            value = self._copy_path(memory, parts, create=False)[1][parts[-1]]
+            memory, parent = self._copy_path(memory, new_parts, create=True)
+            parent[new_parts[-1]] = value
+            memory, parent = self._copy_path(memory, parts, create=False)
+            del parent[parts[-1]]
+        elif op == "clear":
+            before = memory
+            memory = dict(record["value"])
+            memory[self.STATS_KEY] = document_stats(memory)
+        else:
+            raise TypeError(f"Unknown journal op: {op}")
+
+        if op != "clear":
+            stats = dict(before[self.STATS_KEY])
+            if op == "insert" and len(parts) == 1:
+                # Appends to a list section: O(item), not O(section)
+                trimmed = len(before_items) + len(values) - len(items)
+                delta = sum(value_size(value) for value in values) - sum(
+                    value_size(item) for item in (before_items + values)[:trimmed]
+                )
+                previous = stats.get(parts[0], {"count": 0, "bytes": 0})
+                stats[parts[0]] = {"count": len(items), "bytes": previous["bytes"] + delta}
+            else:
+                self._restat(stats, before, memory, parts)
+                if op == "rename":
+                    self._restat(stats, before, memory, record["new_path"])
+            memory[self.STATS_KEY] = stats
+
+        versions = dict(before.get(self.VERSIONS_KEY, {}))
+        if op == "clear":
+            touched = set(versions) | set(before[self.STATS_KEY]) | set(SUMMARY_SECTIONS)
+        for section in touched:
+            if section not in META_KEYS:
+                versions[section] = versions.get(section, 0) + 1
+        memory[self.VERSIONS_KEY] = versions
+
+        memory["updated_at"] = record["ts"]
+        return memory
+
+    @staticmethod
+    def _restat(
+        stats: Dict[str, Dict[str, int]],
+        before: Dict[str, Any],
+        after: Dict[str, Any],
+        parts: List[str],
+    ):
+        """Update section statistics for a change at parts"""
+        section = parts[0]
+        if section in META_KEYS:
+            return
+        if section not in after:
+            stats.pop(section, None)
+            return
+
+        old_section, new_section = before.get(section), after[section]
+        if len(parts) == 1 or not isinstance(old_section, dict) or not isinstance(new_section, dict):
+            stats[section] = section_stats(new_section)
+            return
+
+        # Only the touched entry of the section changed
+        child = parts[1]
+        previous = stats.get(section, {"count": 0, "bytes": 0})
+        count, size = previous["count"], previous["bytes"]
+        if child in old_section:
+            count -= 1
+            size -= value_size(old_section[child])
+        if child in new_section:
+            count += 1
+            size += value_size(new_section[child])
+        stats[section] = {"count": count, "bytes": size}
+
+    def _commit(self, record: Dict[str, Any]):
+        """Apply a record to the cache and queue it for the journal"""
+        with self._lock:
+            memory = self._load()
+            record["ts"] = datetime.now().isoformat()
+            self._memory = self._apply(memory, record)
+            self._pending.append(record)
+
+            if self._txn_depth:
+                # Written in one batch when the transaction ends
+                return
+            if self._closed or len(self._pending) >= self.max_dirty_ops:
+                self.flush()
+            elif self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    # Primitives
+
+    # Snapshots are shared by every reader, so callers get copies of them
+
+    def document(self) -> Dict[str, Any]:
+        memory = self._snapshot()
+        return copy.deepcopy(
+            {key: value for key, value in memory.items() if key not in self.HIDDEN_KEYS}
+        )
+
+    def read(self, parts: List[str]) -> Any:
+        if not parts:
+            return self.document()
+        return copy.deepcopy(self._lookup(parts))
+
+    def _lookup(self, parts: List[str]) -> Any:
+        """Return the snapshot's own value at a path, for reads that keep it internal"""
+        if parts[0] in self.HIDDEN_KEYS:
+            raise KeyError(parts[0])
+        current = self._snapshot()
+        for part in parts:
+            if isinstance(current, dict) and part in current:
+                current = current[part]
+            else:
+                raise KeyError('/'.join(parts))
+        return current
+
+    def write(self, parts: List[str], value: Any):
+        if not parts:
+            raise ValueError("Cannot overwrite the memory root")
+        self._commit({"op": "set", "path": parts, "value": value})
+
+    def remove(self, parts: List[str]):
+        if not parts:
+            raise KeyError("")
+        with self._lock:
+            if len(parts) == 1 and parts[0] in self.HIDDEN_KEYS:
+                raise KeyError(parts[0])
+            parent = self._lookup(parts[:-1]) if len(parts) > 1 else self._snapshot()
+            if not isinstance(parent, dict) or parts[-1] not in parent:
+                raise KeyError('/'.join(parts))
+            self._commit({"op": "del", "path": parts})
+
+    def clear(self):
+        self._commit({"op": "clear", "value": new_memory_document()})
+
+    def stats(self) -> Dict[str, Any]:
+        memory = self._snapshot()
+        return format_stats(
+            memory[self.STATS_KEY], memory.get("created_at"), memory.get("updated_at")
+        )
+
+    def section_versions(self) -> Dict[str, Any]:
+        return dict(self._snapshot()[self.VERSIONS_KEY])
+
+    def insert(self, parts: List[str], index: Optional[int], item: Any) -> int:
+        with self._lock:
+            try:
+                current = self._lookup(parts)
+            except KeyError:
+                current = []
+            if not isinstance(current, list):
+                raise TypeError(f"{'/'.join(parts)} is not a list")
+            position = len(current) if index is None else min(index, len(current))
+            self._commit({"op": "insert", "path": parts, "index": index, "value": item})
+            return position
+
+    def rename(self, old_parts: List[str], new_parts: List[str]):
+        with self._lock:
+            self._lookup(old_parts)
+            self._commit({"op": "rename", "path": old_parts, "new_path": new_parts})
+
+    def append_conversation(self, entry: Dict[str, Any], capacity: int):
+        self._commit({
+            "op": "insert",
+            "path": ["conversation_history"],
+            "value": entry,
+            "capacity": capacity,
+        })
+
+    def append_conversations(self, entries: List[Dict[str, Any]], capacity: int):
+        if entries:
+            self._commit({
+                "op": "insert",
+                "path": ["conversation_history"],
+                "values": list(entries),
+                "capacity": capacity,
+            })
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        with self._lock:
+            if self._txn_depth:
+                self._txn_depth += 1
+                try:
+                    yield
+                finally:
+                    self._txn_depth -= 1
+                return
+
+            with self._file_lock():
+                # Start from the latest state written by any process
+                self._load()
+                self._refresh()
+                memory, pending = self._memory, len(self._pending)
+                self._txn_depth = 1
+                try:
+                    yield
+                except BaseException:
+                    self._memory = memory
+                    del self._pending[pending:]
+                    raise
+                finally:
+                    self._txn_depth = 0
+                self.flush()
+
+    # Persistence
+
+    def flush(self):
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if self._pending:
+                with self._file_lock():
+                    self._refresh()
+                    self._append_pending()
+            compact = self._journal_bytes >= self.compact_threshold
+
+        if compact:
+            self._schedule_compaction()
+
+    def _append_pending(self):
+        """Number the pending records and append them with a single write"""
+        records, self._pending = self._pending, []
+        for record in records:
+            self._seq += 1
+            record["seq"] = self._seq
+
+        payload = "".join(
+            json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+            for record in records
+        )
+        if self._torn_tail:
+            payload = "\n" + payload
+            self._torn_tail = False
+
+        with open(self.journal_file, 'ab') as f:
+            f.write(payload.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+            self._journal_bytes = f.tell()
+        self._journal_id = self._journal_stat()[0]
+        self._base = self._memory
+
+    def _schedule_compaction(self):
+        """Start a background compaction unless one is already running"""
+        with self._lock:
+            if self._closed or (self._compactor and self._compactor.is_alive()):
+                return
+            self._compactor = threading.Thread(
+                target=self._compact, name="chatkit-memory-compaction", daemon=True
+            )
+            self._compactor.start()
+
+    def _compact(self):
+        """Fold the journal into a new snapshot"""
+        with self._lock, self._file_lock():
+            self._load()
+            self._refresh()
+            self._write_snapshot(self._base, self._seq)
+            # Every record up to _seq is now in the snapshot
+            self._atomic_write(self.journal_file, "")
+            self._journal_id, self._journal_bytes = self._journal_stat()
+            self._torn_tail = False
+
+    def _write_snapshot(self, memory: Dict[str, Any], seq: int):
+        snapshot = dict(memory)
+        snapshot[self.SNAPSHOT_SEQ_KEY] = seq
+        self._atomic_write(
+            self.memory_file, json.dumps(snapshot, indent=2, ensure_ascii=False)
+        )
+
+    def _atomic_write(self, target: Path, payload: str):
+        """Write payload to a temp file and rename it over target"""
+        fd, tmp_path = tempfile.mkstemp(
+            dir=target.parent, prefix=f".{target.name}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, target)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            compactor = self._compactor
+        self.flush()
+        if compactor is not None:
+            compactor.join()
+        with self._lock:
+            if self._journal_bytes:
+                self._compact()
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+
+class SQLiteBackend(MemoryBackend):
+    """Memory stored in SQLite tables
+
+    Facts, notes and conversation history live in their own indexed tables.
+    Any other path is stored in the ``nodes`` table, one row per subtree: a
+    write below an existing row updates that row, so rows never overlap. Each
+    mutation is a single-row write in its own transaction, and the database
+    runs in WAL mode: reads outside a transaction go through a separate
+    connection that sees the last committed snapshot, so readers never wait
+    for writers.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS facts (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS notes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            body TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS notes_title ON notes (title);
+        CREATE TABLE IF NOT EXISTS conversation_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            body TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS conversation_history_timestamp
+            ON conversation_history (timestamp);
+        CREATE TABLE IF NOT EXISTS nodes (
+            path TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS stats (
+            section TEXT PRIMARY KEY,
+            count INTEGER NOT NULL,
+            bytes INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS versions (
+            section TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+    """
+
+    # PRAGMA user_version once the stats table has been populated
+    STATS_VERSION = 1
+
+    META_KEYS = ("created_at", "updated_at")
+    LIST_TABLES = ("notes", "conversation_history")
+
+    def __init__(self, db_file: Path):
+        super().__init__()
+        self.db_file = Path(db_file)
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        self._depth = 0
+        self._owner: Optional[int] = None
+
+        self._conn = sqlite3.connect(
+            self.db_file, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._conn.execute(
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('created_at', ?)",
+            (datetime.now().isoformat(),),
+        )
+
+        self._reader_lock = threading.RLock()
+        self._reader = sqlite3.connect(
+            self.db_file, check_same_thread=False, isolation_level=None
+        )
+
+        with self.atomic():
+            (version,) = self._conn.execute("PRAGMA user_version").fetchone()
+            if version < self.STATS_VERSION:
+                # Databases created before statistics were tracked
+                self._conn.execute("DELETE FROM stats")
+                for section, stats in document_stats(self.document()).items():
+                    self._set_section_stats(section, stats)
+                self._conn.execute(f"PRAGMA user_version = {self.STATS_VERSION}")
+
+    @contextmanager
+    def atomic(self) -> Iterator[None]:
+        with self._lock:
+            if self._depth == 0:
+                self._conn.execute("BEGIN IMMEDIATE")
+                self._owner = threading.get_ident()
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._owner = None
+                    self._conn.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self._conn.execute("COMMIT")
+
+    def _touch(self):
+        """Update the document timestamp inside the current transaction"""
+        self._set_meta("updated_at", datetime.now().isoformat())
+
+    def _set_meta(self, key: str, value: str):
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+    # Statistics
+
+    def _bump_version(self, section: str):
+        """Count a mutation of a section; every section change passes here"""
+        self._conn.execute(
+            "INSERT INTO versions (section, version) VALUES (?, 1) "
+            "ON CONFLICT (section) DO UPDATE SET version = version + 1",
+            (section,),
+        )
+
+    def _set_section_stats(self, section: str, stats: Optional[Dict[str, int]]):
+        self._bump_version(section)
+        if stats is None:
+            self._conn.execute("DELETE FROM stats WHERE section = ?", (section,))
+            return
+        self._conn.execute(
+            "INSERT INTO stats (section, count, bytes) VALUES (?, ?, ?) "
+            "ON CONFLICT (section) DO UPDATE SET "
+            "count = excluded.count, bytes = excluded.bytes",
+            (section, stats["count"], stats["bytes"]),
+        )
+
+    def _add_section_stats(self, section: str, count: int, size: int):
+        self._bump_version(section)
+        self._conn.execute(
+            "INSERT INTO stats (section, count, bytes) VALUES (?, ?, ?) "
+            "ON CONFLICT (section) DO UPDATE SET "
+            "count = count + excluded.count, bytes = bytes + excluded.bytes",
+            (section, count, size),
+        )
+
+    def _entry(self, parts: List[str]) -> Any:
+        """Return the section entry containing parts, or _MISSING"""
+        try:
+            return self.read(parts[:2])
+        except KeyError:
+            return _MISSING
+
+    def _restat_entry(self, section: str, old: Any, new: Any):
+        """Account for one section entry changing from old to new"""
+        count = (new is not _MISSING) - (old is not _MISSING)
+        size = (value_size(new) if new is not _MISSING else 0) - (
+            value_size(old) if old is not _MISSING else 0
+        )
+        self._add_section_stats(section, count, size)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._reading():
+            rows = self._rows("SELECT section, count, bytes FROM stats")
+            meta = dict(self._rows("SELECT key, value FROM meta"))
+        sections = {section: {"count": count, "bytes": size} for section, count, size in rows}
+        return format_stats(sections, meta.get("created_at"), meta.get("updated_at"))
+
+    def section_versions(self) -> Dict[str, Any]:
+        with self._reading():
+            return dict(self._rows("SELECT section, version FROM versions"))
+
+    # Row helpers
+
+    @contextmanager
+    def _reading(self) -> Iterator[None]:
+        """Read from one consistent snapshot without waiting for writers"""
+        if self._owner == threading.get_ident():
+            with self._lock:
+                yield
+            return
+
+        with self._reader_lock:
+            outer = not self._reader.in_transaction
+            if outer:
+                self._reader.execute("BEGIN")
+            try:
+                yield
+            finally:
+                if outer:
+                    self._reader.execute("COMMIT")
+
+    def _rows(self, sql: str, params: tuple = ()) -> List[tuple]:
+        if self._owner == threading.get_ident():
+            # Inside our own transaction: read its uncommitted writes
+            with self._lock:
+                return self._conn.execute(sql, params).fetchall()
+        with self._reader_lock:
+            return self._reader.execute(sql, params).fetchall()
+
+    def _facts(self) -> Dict[str, Any]:
+        rows = self._rows("SELECT key, value FROM facts ORDER BY rowid")
+        return {key: json.loads(value) for key, value in rows}
+
+    def _list_table(self, table: str) -> List[Any]:
+        rows = self._rows(f"SELECT body FROM {table} ORDER BY id")
+        return [json.loads(body) for (body,) in rows]
+
+    def _insert_list_row(self, table: str, item: Any):
+        body = json.dumps(item, ensure_ascii=False)
+        fields = item if isinstance(item, dict) else {}
+        if table == "notes":
+            self._conn.execute(
+                "INSERT INTO notes (title, content, created_at, body) VALUES (?, ?, ?, ?)",
+                (
+                    str(fields.get("title", "")),
+                    str(fields.get("content", "" if fields else item)),
+                    str(fields.get("created_at", datetime.now().isoformat())),
+                    body,
+                ),
+            )
+        else:
+            self._conn.execute(
+                "INSERT INTO conversation_history (timestamp, body) VALUES (?, ?)",
+                (str(fields.get("timestamp", datetime.now().isoformat())), body),
+            )
+
+    def _upsert_fact(self, key: str, value: Any):
+        self._conn.execute(
+            "INSERT INTO facts (key, value, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, "
+            "updated_at = excluded.updated_at",
+            (key, json.dumps(value, ensure_ascii=False), datetime.now().isoformat()),
+        )
+
+    def _node_row(self, parts: List[str]) -> Optional[tuple]:
+        """Return the row holding parts (itself or an ancestor), if any"""
+        prefixes = ['/'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+        placeholders = ", ".join("?" for _ in prefixes)
+        rows = self._rows(
+            f"SELECT path, value FROM nodes WHERE path IN ({placeholders})",
+            tuple(prefixes),
+        )
+        if not rows:
+            return None
+        path, value = rows[0]
+        return path, json.loads(value)
+
+    def _descendant_rows(self, path: str) -> List[tuple]:
+        # '0' sorts right after '/', so this range covers every "path/..." key
+        rows = self._rows(
+            "SELECT path, value FROM nodes WHERE path >= ? AND path < ? ORDER BY path",
+            (path + "/", path + "0"),
+        )
+        return [(row_path, json.loads(value)) for row_path, value in rows]
+
+    @staticmethod
+    def _descend(value: Any, parts: List[str], full_path: str) -> Any:
+        for part in parts:
+            if isinstance(value, dict) and part in value:
+                value = value[part]
+            else:
+                raise KeyError(full_path)
+        return value
+
+    @staticmethod
+    def _assign(value: Any, parts: List[str], item: Any) -> Any:
+        """Return value with item stored at parts, creating dicts as needed"""
+        if not parts:
+            return item
+        if not isinstance(value, dict):
+            raise TypeError(f"{parts[0]} is not a directory")
+        value[parts[0]] = SQLiteBackend._assign(value.get(parts[0], {}), parts[1:], item)
+        return value
+
+    @staticmethod
+    def _assemble(rows: List[tuple], strip: int = 0) -> Dict[str, Any]:
+        tree: Dict[str, Any] = {}
+        for path, value in rows:
+            SQLiteBackend._assign(tree, split_path(path)[strip:], value)
+        return tree
+
+    # Primitives
+
+    def document(self) -> Dict[str, Any]:
+        with self._reading():
+            rows = self._rows("SELECT path, value FROM nodes ORDER BY path")
+            document = self._assemble([(path, json.loads(value)) for path, value in rows])
+            document["user_facts"] = self._facts()
+            for table in self.LIST_TABLES:
+                document[table] = self._list_table(table)
+            for key, value in self._rows("SELECT key, value FROM meta"):
+                document[key] = value
+            return document
+
+    def read(self, parts: List[str]) -> Any:
+        full_path = '/'.join(parts)
+        if not parts:
+            return self.document()
+
+        head, rest = parts[0], parts[1:]
+        with self._reading():
+            if head == "user_facts":
+                if not rest:
+                    return self._facts()
+                rows = self._rows("SELECT value FROM facts WHERE key = ?", (rest[0],))
+                if not rows:
+                    raise KeyError(full_path)
+                return self._descend(json.loads(rows[0][0]), rest[1:], full_path)
+
+            if head in self.LIST_TABLES:
+                if rest:
+                    raise KeyError(full_path)
+                return self._list_table(head)
+
+            if head in self.META_KEYS:
+                rows = self._rows("SELECT value FROM meta WHERE key = ?", (head,))
+                if rest or not rows:
+                    raise KeyError(full_path)
+                return rows[0][0]
+
+            row = self._node_row(parts)
+            if row is not None:
+                row_path, value = row
+                return self._descend(value, parts[len(split_path(row_path)):], full_path)
+
+            descendants = self._descendant_rows(full_path)
+            if not descendants:
+                raise KeyError(full_path)
+            return self._assemble(descendants, strip=len(parts))
+
+    def write(self, parts: List[str], value: Any):
+        if not parts:
+            raise ValueError("Cannot overwrite the memory root")
+
+        head, rest = parts[0], parts[1:]
+        with self.atomic():
+            if head == "user_facts":
+                if not rest:
+                    if not isinstance(value, dict):
+                        raise TypeError("user_facts must be a mapping")
+                    self._conn.execute("DELETE FROM facts")
+                    for key, fact in value.items():
+                        self._upsert_fact(key, fact)
+                    self._set_section_stats(head, section_stats(value))
+                else:
+                    old = self._entry(parts)
+                    current = {} if old is _MISSING else copy.deepcopy(old)
+                    new = self._assign(current, rest[1:], value)
+                    self._upsert_fact(rest[0], new)
+                    self._restat_entry(head, old, new)
+
+            elif head in self.LIST_TABLES:
+                if rest or not isinstance(value, list):
+                    raise TypeError(f"{head} is not a directory")
+                self._conn.execute(f"DELETE FROM {head}")
+                for item in value:
+                    self._insert_list_row(head, item)
+                self._set_section_stats(head, section_stats(value))
+
+            elif head in self.META_KEYS:
+                if rest:
+                    raise TypeError(f"{head} is not a directory")
+                self._set_meta(head, str(value))
+
+            else:
+                old = self._entry(parts) if rest else _MISSING
+                row = self._node_row(parts)
+                if row is not None:
+                    row_path, current = row
+                    row_parts = split_path(row_path)
+                    value = self._assign(current, parts[len(row_parts):], value)
+                else:
+                    row_path = '/'.join(parts)
+                    self._conn.execute(
+                        "DELETE FROM nodes WHERE path >= ? AND path < ?",
+                        (row_path + "/", row_path + "0"),
+                    )
+                self._conn.execute(
+                    "INSERT INTO nodes (path, value) VALUES (?, ?) "
+                    "ON CONFLICT (path) DO UPDATE SET value = excluded.value",
+                    (row_path, json.dumps(value, ensure_ascii=False)),
+                )
+                if rest:
+                    self._restat_entry(head, old, self._entry(parts))
+                else:
+                    self._set_section_stats(head, section_stats(value))
+
+            if head != "updated_at":
+                self._touch()
+
+    def remove(self, parts: List[str]):
+        full_path = '/'.join(parts)
+        if not parts:
+            raise KeyError(full_path)
+
+        head, rest = parts[0], parts[1:]
+        with self.atomic():
+            old = self._entry(parts) if rest else _MISSING
+            if head == "user_facts" and len(rest) == 1:
+                deleted = self._conn.execute(
+                    "DELETE FROM facts WHERE key = ?", (rest[0],)
+                ).rowcount
+                if not deleted:
+                    raise KeyError(full_path)
+            elif head == "user_facts" and not rest:
+                self._conn.execute("DELETE FROM facts")
+            elif head in self.LIST_TABLES and not rest:
+                self._conn.execute(f"DELETE FROM {head}")
+            elif head in self.META_KEYS and not rest:
+                self._conn.execute("DELETE FROM meta WHERE key = ?", (head,))
+            elif head == "user_facts":
+                current = self.read(parts[:2])
+                parent = self._descend(current, rest[1:-1], full_path)
+                if not isinstance(parent, dict) or parts[-1] not in parent:
+                    raise KeyError(full_path)
+                del parent[parts[-1]]
+                self._upsert_fact(rest[0], current)
+            elif head in self.LIST_TABLES or head in self.META_KEYS:
+                raise KeyError(full_path)
+            else:
+                row = self._node_row(parts)
+                if row is not None and row[0] == full_path:
+                    self._conn.execute("DELETE FROM nodes WHERE path = ?", (full_path,))
+                elif row is not None:
+                    row_path, current = row
+                    row_parts = split_path(row_path)
+                    parent = self._descend(current, parts[len(row_parts):-1], full_path)
+                    if not isinstance(parent, dict) or parts[-1] not in parent:
+                        raise KeyError(full_path)
+                    del parent[parts[-1]]
+                    self._conn.execute(
+                        "UPDATE nodes SET value = ? WHERE path = ?",
+                        (json.dumps(current, ensure_ascii=False), row_path),
+                    )
+                else:
+                    deleted = self._conn.execute(
+                        "DELETE FROM nodes WHERE path >= ? AND path < ?",
+                        (full_path + "/", full_path + "0"),
+                    ).rowcount
+                    if not deleted:
+                        raise KeyError(full_path)
+
+            if head not in self.META_KEYS:
+                if rest:
+                    self._restat_entry(head, old, self._entry(parts))
+                elif head in self.LIST_TABLES or head == "user_facts":
+                    self._set_section_stats(head, {"count": 0, "bytes": 0})
+                else:
+                    self._set_section_stats(head, None)
+            self._touch()
+
+    def clear(self):
+        with self.atomic():
+            for table in ("facts", "notes", "conversation_history", "nodes", "meta", "stats"):
+                self._conn.execute(f"DELETE FROM {table}")
+            # Versions survive a clear, so no later state can repeat an earlier one
+            for section in {*SUMMARY_SECTIONS, *self.section_versions()}:
+                self._bump_version(section)
+            self._set_meta("created_at", datetime.now().isoformat())
+            self._touch()
+
+    # Single-row fast paths
+
+    def insert(self, parts: List[str], index: Optional[int], item: Any) -> int:
+        if len(parts) == 1 and parts[0] in self.LIST_TABLES:
+            with self.atomic():
+                (count,) = self._rows(f"SELECT COUNT(*) FROM {parts[0]}")[0]
+                if index is None or index >= count:
+                    self._insert_list_row(parts[0], item)
+                    self._add_section_stats(parts[0], 1, value_size(item))
+                    self._touch()
+                    return count
+        return super().insert(parts, index, item)
+
+    def set_fact(self, key: str, value: Any):
+        with self.atomic():
+            old = self._entry(["user_facts", key])
+            self._upsert_fact(key, value)
+            self._restat_entry("user_facts", old, value)
+            self._touch()
+
+    def append_note(self, note: Dict[str, Any]):
+        with self.atomic():
+            self._insert_list_row("notes", note)
+            self._add_section_stats("notes", 1, value_size(note))
+            self._touch()
+
+    def append_conversation(self, entry: Dict[str, Any], capacity: int):
+        self.append_conversations([entry], capacity)
+
+    def append_conversations(self, entries: List[Dict[str, Any]], capacity: int):
+        if not entries:
+            return
+        with self.atomic():
+            for entry in entries:
+                self._insert_list_row("conversation_history", entry)
+            trimmed = self._conn.execute(
+                "DELETE FROM conversation_history WHERE id <= "
+                "(SELECT MAX(id) FROM conversation_history) - ? RETURNING body",
+                (capacity,),
+            ).fetchall()
+            self._add_section_stats(
+                "conversation_history",
+                len(entries) - len(trimmed),
+                sum(value_size(entry) for entry in entries)
+                - sum(len(body.encode("utf-8")) for (body,) in trimmed),
+            )
+            self._touch()
+
+    def import_document(self, document: Dict[str, Any]):
+        """Replace the database contents with a JSON memory document"""
+        with self.atomic():
+            self.clear()
+            for key, value in document.items():
+                self.write([key], value)
+            if "updated_at" in document:
+                self._set_meta("updated_at", str(document["updated_at"]))
+
+    def close(self):
+        with self._lock, self._reader_lock:
+            self._reader.close()
+            self._conn.close()
+
+
+def create_backend(
+    kind: str,
+    storage_dir: Path,
+    flush_interval: float = 2.0,
+    max_dirty_ops: int = 20,
+    compact_threshold: int = 256 * 1024,
+) -> MemoryBackend:
+    """Create a memory backend by name (``json`` or ``sqlite``)"""
+    storage_dir = Path(storage_dir)
+    if kind == "json":
+        return JSONFileBackend(
+            storage_dir / "chat_memory.json",
+            flush_interval=flush_interval,
+            max_dirty_ops=max_dirty_ops,
+            compact_threshold=compact_threshold,
+        )
+    if kind == "sqlite":
+        return SQLiteBackend(storage_dir / "chat_memory.db")
+    raise ValueError(f"Unknown memory backend: {kind}")
+
+
+def migrate_json_to_sqlite(json_file: Path, db_file: Path) -> Dict[str, int]:
+    """Import a JSON memory file into a SQLite memory database"""
+    source = JSONFileBackend(json_file)
+    document = dict(source.document())
+    source.close()
+
+    backend = SQLiteBackend(db_file)
+    try:
+        backend.import_document(document)
+    finally:
+        backend.close()
+
+    return {
+        "user_facts": len(document.get("user_facts", {})),
+        "notes": len(document.get("notes", [])),
+        "conversation_history": len(document.get("conversation_history", [])),
+    }
+
+
+def main():
+    """Command line entry point for memory storage maintenance"""
+    parser = argparse.ArgumentParser(description="ChatKit memory storage tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate = subparsers.add_parser(
+        "migrate", help="Import a JSON memory file into a SQLite database"
+    )
+    migrate.add_argument(
+        "--source",
+        default="memory/chat_memory.json",
+        help="JSON memory file to import (default: memory/chat_memory.json)",
+    )
+    migrate.add_argument(
+        "--target",
+        default="memory/chat_memory.db",
+        help="SQLite database to write (default: memory/chat_memory.db)",
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        if not Path(args.source).exists():
+            print(f"❌ Memory file not found: {args.source}")
+            sys.exit(1)
+        counts = migrate_json_to_sqlite(Path(args.source), Path(args.target))
+        print(f"✅ Migrated {args.source} -> {args.target}")
+        for name, count in counts.items():
+            print(f"   {name}: {count}")
+
+
+if __name__ == "__main__":
+    main()
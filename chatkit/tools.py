@@ -3,14 +3,15 @@
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel, Field
 from pydantic_ai import Agent, FunctionToolset
-from pydantic_ai.exceptions import ModelRetry, AgentRunError, ModelHTTPError, UnexpectedModelBehavior
 import datetime
 from pathlib import Path
 import os
 from dotenv import load_dotenv
 
 # Memory Toolset imports
-from .memory import chatkit_memory
+from .memory import aget_memory
+from .providers import shared_model
+from .resilience import provider_of, resilience
 
 # Load environment variables
 load_dotenv()
@@ -25,6 +26,18 @@ class FileAttachment(BaseModel):
     url: Optional[str] = Field(default=None, description="File URL if stored externally")
 
 
+class FactItem(BaseModel):
+    """A user fact for the batched add_facts tool"""
+    fact_key: str = Field(description="Fact name, e.g. favorite_color")
+    fact_value: str = Field(description="Fact value")
+
+
+class NoteItem(BaseModel):
+    """A note for the batched add_notes tool"""
+    title: str = Field(description="Note title")
+    content: str = Field(description="Note content")
+
+
 class ToolCall(BaseModel):
     """Represents a tool call"""
     name: str = Field(description="Tool name")
@@ -227,7 +240,7 @@ class ToolEnabledAgent:
 
         # Create agent with tool support
         self.agent = Agent(
-            model=self.model,
+            model=shared_model(self.model),
             system_prompt="""You are a helpful assistant with access to various tools.
             Use tools when appropriate to provide better assistance.
             Always explain what you're doing when using tools.""",
@@ -251,39 +264,22 @@ class ToolEnabledAgent:
                 attachment_info += f"- {attachment.filename} ({attachment.content_type}, {attachment.size} bytes)\n"
             message += attachment_info
 
-        # Process message with agent with retry logic
-        max_retries = 3
-
-        for attempt in range(max_retries):
-            try:
-                result = await self.agent.run(message)
-
-                # Check if tool calls are needed
-                # Note: In a real implementation, this would integrate with pydantic-ai's tool system
-                # For now, we'll use a simple approach
-
-                response_data = {
-                    "message": result.output,
-                    "tool_calls": [],
-                    "attachments": attachments or []
-                }
-
-                return response_data
-
-            except ModelRetry as e:
-                if attempt < max_retries - 1:
-                    print(f"Model requested retry (attempt {attempt + 1}/{max_retries}): {e.message}")
-                    await asyncio.sleep(1)  # Brief delay before retry
-                    continue
-                else:
-                    raise AgentRunError(f"Max retries exceeded: {e.message}")
-            except (ModelHTTPError, UnexpectedModelBehavior) as e:
-                if attempt < max_retries - 1:
-                    print(f"Model error, retrying (attempt {attempt + 1}/{max_retries}): {e}")
-                    await asyncio.sleep(2)  # Longer delay for HTTP errors
-                    continue
-                else:
-                    raise
+        # Process message with agent, retrying through the shared policy
+        result = await resilience.run(
+            provider_of(self.agent.model), lambda: self.agent.run(message)
+        )
+
+        # Check if tool calls are needed
+        # Note: In a real implementation, this would integrate with pydantic-ai's tool system
+        # For now, we'll use a simple approach
+
+        response_data = {
+            "message": result.output,
+            "tool_calls": [],
+            "attachments": attachments or []
+        }
+
+        return response_data
 
     async def execute_tool_call(self, tool_call: ToolCall) -> Any:
         """Execute a specific tool call"""
@@ -317,7 +313,7 @@ memory_toolset = FunctionToolset()
 
 
 @memory_toolset.tool
-def store_personal_info(user_message: str) -> str:
+async def store_personal_info(user_message: str) -> str:
     """Automatically detect and store personal information from user messages"""
     import re
 
@@ -334,7 +330,7 @@ def store_personal_info(user_message: str) -> str:
         match = re.search(pattern, user_message, re.IGNORECASE)
         if match:
             name = match.group(1).strip()
-            chatkit_memory.add_user_fact("user_name", name)
+            await (await aget_memory()).aadd_user_fact("user_name", name)
             stored_info.append(f"Stored name: {name}")
             break
 
@@ -345,21 +341,21 @@ def store_personal_info(user_message: str) -> str:
 
 
 @memory_toolset.tool
-def view_memory(path: Optional[str] = None) -> str:
+async def view_memory(path: Optional[str] = None) -> str:
     """View memory content and summary"""
+    memory = await aget_memory()
     if path:
         from anthropic.types.beta import BetaMemoryTool20250818ViewCommand
         command = BetaMemoryTool20250818ViewCommand(command="view", path=path)
-        return chatkit_memory.view(command)
+        return await memory.aview(command)
     else:
         # Return detailed memory content, not just summary
-        memory = chatkit_memory._load_memory()
+        user_facts = await memory.aget_user_facts()
 
-        if not memory.get("user_facts"):
+        if not user_facts:
             return "Memory is currently empty"
 
         # Return specific user facts if available
-        user_facts = memory.get("user_facts", {})
         if user_facts:
             facts_list = []
             for key, value in user_facts.items():
@@ -371,21 +367,60 @@ def view_memory(path: Optional[str] = None) -> str:
 
 
 @memory_toolset.tool
-def add_fact(fact_key: str, fact_value: str) -> str:
+async def search_memory(query: str, k: int = 5) -> str:
+    """Search stored facts and notes, returning the k most relevant entries"""
+    results = await (await aget_memory()).asearch(query, k)
+    if not results:
+        return f"No memory entries match '{query}'"
+
+    lines = []
+    for result in results:
+        if result["type"] == "fact":
+            lines.append(f"- fact {result['key']}: {result['value']}")
+        else:
+            note = result["note"]
+            if isinstance(note, dict):
+                lines.append(f"- note '{note.get('title', '')}': {note.get('content', '')}")
+            else:
+                lines.append(f"- note: {note}")
+
+    return f"Top {len(results)} memory entries for '{query}':\n" + "\n".join(lines)
+
+
+@memory_toolset.tool
+async def add_fact(fact_key: str, fact_value: str) -> str:
     """Add a user fact to memory"""
-    return chatkit_memory.add_user_fact(fact_key, fact_value)
+    return await (await aget_memory()).aadd_user_fact(fact_key, fact_value)
 
 
 @memory_toolset.tool
-def add_note(title: str, content: str) -> str:
+async def add_note(title: str, content: str) -> str:
     """Add a note to memory"""
-    return chatkit_memory.add_note(title, content)
+    return await (await aget_memory()).aadd_note(title, content)
+
+
+@memory_toolset.tool
+async def add_facts(items: List[FactItem]) -> str:
+    """Add several user facts to memory in one call and one write"""
+    if not items:
+        return "No facts to add"
+    facts = {item.fact_key: item.fact_value for item in items}
+    return await (await aget_memory()).aadd_user_facts(facts)
+
+
+@memory_toolset.tool
+async def add_notes(items: List[NoteItem]) -> str:
+    """Add several notes to memory in one call and one write"""
+    if not items:
+        return "No notes to add"
+    notes = [item.model_dump() for item in items]
+    return await (await aget_memory()).aadd_notes(notes)
 
 
 @memory_toolset.tool
-def clear_memory() -> str:
+async def clear_memory() -> str:
     """Clear all memory"""
-    return chatkit_memory.clear_all_memory()
+    return await (await aget_memory()).aclear_all_memory()
 
 
 # Additional utility tools
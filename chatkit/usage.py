@@ -0,0 +1,240 @@
+"""Usage ledger for ChatKit model runs
+
+Every turn is recorded with its tokens, requests, estimated cost, tool calls
+and wall time. Totals are kept per session, model, tool and workflow node,
+so ``/api/usage`` can show what drives cost and latency.
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import os
+import threading
+
+from pydantic_ai.messages import (
+    BuiltinToolCallPart,
+    BuiltinToolReturnPart,
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    RetryPromptPart,
+    ToolCallPart,
+    ToolReturnPart,
+)
+from pydantic_ai.usage import RunUsage
+
+# Counters kept for every session, model and workflow node
+COUNTERS = (
+    "turns",
+    "cached_turns",
+    "coalesced_turns",
+    "requests",
+    "input_tokens",
+    "output_tokens",
+    "cache_read_tokens",
+    "cache_write_tokens",
+    "tool_calls",
+    "cost",
+    "wall_time",
+)
+
+# What each group is keyed by
+GROUPS = ("session", "model", "tool", "node")
+
+
+def _args(part: Any) -> Any:
+    try:
+        return part.args_as_dict()
+    except ValueError:
+        return part.args
+
+
+def extract_tool_calls(messages: List[ModelMessage]) -> List[Dict[str, Any]]:
+    """Return the tool calls of a run with their results and durations
+
+    A function tool's duration runs from the model response that asked for
+    it to its return. Builtin tools run at the provider and have none.
+    """
+    calls: List[Dict[str, Any]] = []
+    pending: Dict[str, Dict[str, Any]] = {}
+    for message in messages:
+        if isinstance(message, ModelResponse):
+            for part in message.parts:
+                if isinstance(part, (ToolCallPart, BuiltinToolCallPart)):
+                    call = {
+                        "tool_name": part.tool_name,
+                        "tool_call_id": part.tool_call_id,
+                        "args": _args(part),
+                        "result": None,
+                        "duration": None,
+                        "builtin": isinstance(part, BuiltinToolCallPart),
+                        "_called_at": message.timestamp,
+                    }
+                    calls.append(call)
+                    pending[part.tool_call_id] = call
+                elif isinstance(part, BuiltinToolReturnPart):
+                    call = pending.pop(part.tool_call_id, None)
+                    if call is not None:
+                        call["result"] = part.model_response_str()
+        elif isinstance(message, ModelRequest):
+            for part in message.parts:
+                if not isinstance(part, (ToolReturnPart, RetryPromptPart)):
+                    continue
+                call = pending.pop(part.tool_call_id, None)
+                if call is None:
+                    continue
+                if isinstance(part, ToolReturnPart):
+                    call["result"] = part.model_response_str()
+                else:
+                    call["error"] = part.model_response()
+                call["duration"] = max(
+                    (part.timestamp - call["_called_at"]).total_seconds(), 0.0
+                )
+    for call in calls:
+        del call["_called_at"]
+    return calls
+
+
+def run_cost(messages: List[ModelMessage]) -> float:
+    """Estimated price in USD of the model responses of a run
+
+    Responses of models without a known price count as free.
+    """
+    cost = 0.0
+    for message in messages:
+        if isinstance(message, ModelResponse):
+            try:
+                cost += float(message.cost().total_price)
+            except (AssertionError, LookupError):
+                pass
+    return cost
+
+
+def _bucket() -> Dict[str, Any]:
+    return dict.fromkeys(COUNTERS, 0)
+
+
+def _tool_bucket() -> Dict[str, Any]:
+    return {"calls": 0, "errors": 0, "total_duration": 0.0, "max_duration": 0.0}
+
+
+def _view(bucket: Dict[str, Any]) -> Dict[str, Any]:
+    view = dict(bucket)
+    if "calls" in view:
+        timed = view["calls"]
+        view["avg_duration"] = view["total_duration"] / timed if timed else 0.0
+    else:
+        view["total_tokens"] = view["input_tokens"] + view["output_tokens"]
+    return view
+
+
+class UsageLedger:
+    """In-memory usage totals per session, model, tool and workflow node
+
+    Only the most recently active ``max_sessions`` sessions are kept; the
+    overall and per-model totals include the dropped ones.
+    """
+
+    def __init__(self, max_sessions: int = 10000):
+        self.max_sessions = max_sessions
+        self._totals = _bucket()
+        self._groups: Dict[str, "OrderedDict[str, Dict[str, Any]]"] = {
+            group: OrderedDict() for group in GROUPS
+        }
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        model: str,
+        usage: RunUsage,
+        messages: List[ModelMessage],
+        wall_time: float,
+        session_id: Optional[str] = None,
+        node: Optional[str] = None,
+        cached: bool = False,
+        coalesced: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Record one turn and return its tool calls
+
+        Cached and coalesced turns pass an empty usage and no messages; they
+        count as turns of their session without tokens of their own.
+        """
+        calls = extract_tool_calls(messages)
+        amounts = {
+            "turns": 1,
+            "cached_turns": int(cached),
+            "coalesced_turns": int(coalesced),
+            "requests": usage.requests,
+            "input_tokens": usage.input_tokens,
+            "output_tokens": usage.output_tokens,
+            "cache_read_tokens": usage.cache_read_tokens,
+            "cache_write_tokens": usage.cache_write_tokens,
+            "tool_calls": len(calls),
+            "cost": run_cost(messages),
+            "wall_time": wall_time,
+        }
+
+        with self._lock:
+            targets = [self._totals, self._entry("model", model)]
+            if session_id is not None:
+                targets.append(self._entry("session", session_id))
+            if node is not None:
+                targets.append(self._entry("node", node))
+            for bucket in targets:
+                for name, amount in amounts.items():
+                    bucket[name] += amount
+
+            for call in calls:
+                tool = self._entry("tool", call["tool_name"], _tool_bucket)
+                tool["calls"] += 1
+                tool["errors"] += int("error" in call)
+                if call["duration"] is not None:
+                    tool["total_duration"] += call["duration"]
+                    tool["max_duration"] = max(tool["max_duration"], call["duration"])
+
+            sessions = self._groups["session"]
+            while len(sessions) > self.max_sessions:
+                sessions.popitem(last=False)
+        return calls
+
+    def _entry(self, group: str, key: str, factory=_bucket) -> Dict[str, Any]:
+        entries = self._groups[group]
+        entry = entries.get(key)
+        if entry is None:
+            entry = entries[key] = factory()
+        else:
+            entries.move_to_end(key)
+        return entry
+
+    def get(self, group: str, key: str) -> Optional[Dict[str, Any]]:
+        """Return the totals of one session, model, tool or node"""
+        with self._lock:
+            entry = self._groups[group].get(key)
+            return _view(entry) if entry is not None else None
+
+    def query(
+        self, group: str, order_by: str = "total_tokens", limit: int = 20
+    ) -> List[Dict[str, Any]]:
+        """Return the top entries of a group, largest ``order_by`` first"""
+        with self._lock:
+            rows = [
+                {group: key, **_view(entry)}
+                for key, entry in self._groups[group].items()
+            ]
+        rows.sort(key=lambda row: row.get(order_by, 0), reverse=True)
+        return rows[:limit]
+
+    def summary(self, limit: int = 5) -> Dict[str, Any]:
+        """Return the overall totals and the top entries of every group"""
+        with self._lock:
+            totals = _view(self._totals)
+        top = {
+            group: self.query(group, "calls" if group == "tool" else "total_tokens", limit)
+            for group in GROUPS
+        }
+        return {"totals": totals, "top": top}
+
+
+# Usage of every agent in the process
+usage_ledger = UsageLedger(
+    max_sessions=int(os.getenv("CHATKIT_USAGE_MAX_SESSIONS", "10000"))
+)
@@ -4,18 +4,35 @@ from typing import Dict, Optional
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import HTMLResponse
-from fastapi import Request
+from fastapi import Request, Response
 from pydantic import BaseModel
+import asyncio
+import hashlib
 import json
 import logging
 import sys
+import time
+from contextlib import asynccontextmanager
 from typing import AsyncIterator, Dict, List
 from starlette.responses import StreamingResponse
 
-from .core import ChatKitAgent
-from .memory import chatkit_memory
+from .core import ChatKitAgent, estimate_tokens, model_id
+from .providers import provider_registry
+from .admission import AdmissionRejected
+from .budgets import BudgetExceeded, charge_session
+from .resilience import CircuitOpenError, provider_of, resilience
+from .usage import GROUPS
+from .memory import (
+    conversation_recorder,
+    current_memory_namespace,
+    memory_namespace,
+    memory_shards,
+    resolve_memory_namespace,
+)
 from pydantic_ai.ag_ui import handle_ag_ui_request
-from ag_ui.core import CustomEvent, RunAgentInput
+from pydantic_ai.exceptions import UsageLimitExceeded
+from pydantic_ai.usage import RunUsage
+from ag_ui.core import CustomEvent, RunAgentInput, RunErrorEvent, RunStartedEvent
 from ag_ui.encoder import EventEncoder
 
 # Configure logging
@@ -35,6 +52,7 @@ class ChatRequest(BaseModel):
 
     message: str
     session_id: Optional[str] = None
+    user_id: Optional[str] = None
 
 
 class ChatResponseModel(BaseModel):
@@ -46,11 +64,29 @@ class ChatResponseModel(BaseModel):
     metadata: dict = {}
 
 
+def sse_event(event: str, data: dict) -> str:
+    """Encode one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_event_type(chunk) -> Optional[str]:
+    """Return the ``type`` of the JSON event a server-sent event carries, if any"""
+    text = chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk
+    for line in text.splitlines():
+        if line.startswith("data:"):
+            try:
+                event = json.loads(line[5:])
+            except json.JSONDecodeError:
+                return None
+            return event.get("type") if isinstance(event, dict) else None
+    return None
+
+
 class ChatKitServer:
     """ChatKit server with FastAPI"""
 
     def __init__(self):
-        self.app = FastAPI(title="ChatKit", version="0.1.0")
+        self.app = FastAPI(title="ChatKit", version="0.1.0", lifespan=self._lifespan)
         self.agent = ChatKitAgent()
         self.websocket_connections: Dict[str, WebSocket] = {}
 
@@ -65,6 +101,37 @@ class ChatKitServer:
 
         self._setup_routes()
 
+    @asynccontextmanager
+    async def _lifespan(self, app: FastAPI):
+        """Flush queued history and memory and close the session store on shutdown"""
+        yield
+        conversation_recorder.close()
+        memory_shards.close()
+        self.agent.sessions.close()
+        await provider_registry.aclose()
+
+    @staticmethod
+    def _memory_namespace(
+        request, user_id: Optional[str] = None, session_id: Optional[str] = None
+    ) -> Optional[str]:
+        """Resolve the memory namespace from the request context
+
+        Ids not passed in come from the ``X-User-Id``/``X-Session-Id``
+        headers or the ``user_id``/``session_id`` query parameters, so the
+        memory routes reach the same shard as the session's chat turns.
+        """
+        user_id = (
+            user_id
+            or request.headers.get("X-User-Id")
+            or request.query_params.get("user_id")
+        )
+        session_id = (
+            session_id
+            or request.headers.get("X-Session-Id")
+            or request.query_params.get("session_id")
+        )
+        return resolve_memory_namespace(user_id, session_id)
+
     def _setup_routes(self):
         """Setup API routes"""
 
@@ -82,6 +149,7 @@ class ChatKitServer:
                     "POST /api/chat": "Send chat message",
                     "GET /ws/{session_id}": "WebSocket for real-time chat",
                     "GET /api/memory": "Get memory summary",
+                    "GET /api/memory/search": "Search memory facts and notes",
                     "DELETE /api/memory": "Clear all memory",
                     "POST /api/memory/fact": "Add user fact",
                     "POST /api/memory/note": "Add note",
@@ -169,6 +237,9 @@ class ChatKitServer:
             try:
                 body = await request.json()
                 model_id = body.get("model_id")
+                # With a session_id only that session switches; without one the
+                # default model for sessions that never chose one changes
+                session_id = body.get("session_id")
 
                 logger.info(f"POST /api/model/switch - Switching to model: {model_id}")
 
@@ -176,11 +247,15 @@ class ChatKitServer:
                     logger.warning("POST /api/model/switch - Missing model_id")
                     raise HTTPException(status_code=400, detail="model_id is required")
 
-                result = self.agent.switch_model(model_id)
+                result = self.agent.switch_model(model_id, session_id)
                 logger.info(
                     f"POST /api/model/switch - Successfully switched to: {model_id}"
                 )
-                return {"message": result["message"], "current_model": model_id}
+                return {
+                    "message": result["message"],
+                    "current_model": model_id,
+                    "session_id": session_id,
+                }
             except Exception as e:
                 logger.error(f"POST /api/model/switch - Error: {str(e)}")
                 raise HTTPException(
@@ -360,17 +435,89 @@ class ChatKitServer:
         @self.app.get("/api/session/{session_id}")
         async def get_session(session_id: str):
             """Get session details"""
-            session = self.agent.get_session(session_id)
+            session = await self.agent.aget_session(session_id)
             if not session:
                 raise HTTPException(status_code=404, detail="Session not found")
             return {
                 "session_id": session.session_id,
+                "model": session.metadata.get("model", self.agent.model),
                 "messages": [msg.model_dump() for msg in session.messages],
                 "metadata": session.metadata,
             }
 
+        @self.app.get("/api/providers/stats")
+        async def provider_stats():
+            """Shared HTTP connection pools and their saturation per provider"""
+            return provider_registry.stats()
+
+        @self.app.get("/api/hedging/stats")
+        async def hedging_stats():
+            """Hedged requests fired and won, and the hedge delay per model"""
+            return self.agent.hedging.summary()
+
+        @self.app.get("/api/admission/stats")
+        async def admission_stats():
+            """Concurrency, queue depth and queue wait times per provider"""
+            return self.agent.admission.stats()
+
+        @self.app.get("/api/usage")
+        async def usage(
+            group: Optional[str] = None,
+            key: Optional[str] = None,
+            order_by: str = "total_tokens",
+            limit: int = 20,
+        ):
+            """Token, cost, tool and wall-time totals
+
+            Without a group, returns the overall totals and the top entries
+            of every group. With a group (session, model, tool or node),
+            returns one entry by key or the top entries by ``order_by``.
+            """
+            if group is None:
+                return self.agent.usage.summary()
+            if group not in GROUPS:
+                raise HTTPException(
+                    status_code=400, detail=f"group must be one of {', '.join(GROUPS)}"
+                )
+            if key is not None:
+                entry = self.agent.usage.get(group, key)
+                if entry is None:
+                    raise HTTPException(status_code=404, detail=f"No usage for {group} {key}")
+                return entry
+            return self.agent.usage.query(group, order_by, limit)
+
+        @self.app.get("/api/budget/stats")
+        async def budget_stats():
+            """Configured budgets and how often requests were trimmed or stopped"""
+            return self.agent.budget.summary()
+
+        @self.app.get("/api/resilience/stats")
+        async def resilience_stats():
+            """Retry counters and circuit breaker state per provider"""
+            return resilience.stats()
+
+        @self.app.get("/api/cache/stats")
+        async def response_cache_stats():
+            """Response cache hit, miss and eviction counters"""
+            cache = self.agent.response_cache
+            return cache.stats() if cache is not None else {"enabled": False}
+
+        @self.app.get("/api/coalescing/stats")
+        async def coalescing_stats():
+            """Model runs started and identical requests that joined one instead"""
+            return {
+                "enabled": self.agent.coalesce,
+                "in_flight": len(self.agent.flights),
+                **self.agent.flights.stats,
+            }
+
+        @self.app.get("/api/sessions/stats")
+        async def session_stats():
+            """Resident session set and cache hit statistics"""
+            return self.agent.sessions.stats()
+
         @self.app.post("/api/chat", response_model=ChatResponseModel)
-        async def send_chat_message(chat_request: ChatRequest):
+        async def send_chat_message(chat_request: ChatRequest, request: Request):
             """Send a chat message"""
             try:
                 # Create session if none provided
@@ -378,33 +525,91 @@ class ChatKitServer:
                     session = self.agent.create_session()
                     chat_request.session_id = session.session_id
 
-                # Get response from agent
-                response = self.agent.send_message(
-                    chat_request.session_id, chat_request.message
+                namespace = self._memory_namespace(
+                    request, chat_request.user_id, chat_request.session_id
                 )
-                async for chunk in response:
-                    if chunk.metadata.get("complete"):
-                        return ChatResponseModel(
-                            message=chunk.message,
-                            session_id=chunk.session_id,
-                            tool_calls=chunk.tool_calls,
-                            metadata=chunk.metadata,
-                        )
+
+                # Get response from agent
+                with memory_namespace(namespace):
+                    response = self.agent.send_message(
+                        chat_request.session_id, chat_request.message
+                    )
+                    async for chunk in response:
+                        if chunk.metadata.get("complete"):
+                            return ChatResponseModel(
+                                message=chunk.message,
+                                session_id=chunk.session_id,
+                                tool_calls=chunk.tool_calls,
+                                metadata=chunk.metadata,
+                            )
 
                 # If we get here, no complete chunk was found
                 raise HTTPException(
                     status_code=500, detail="No complete response received"
                 )
+            except (CircuitOpenError, AdmissionRejected) as e:
+                raise HTTPException(
+                    status_code=503,
+                    detail=str(e),
+                    headers={"Retry-After": str(max(int(e.retry_in), 1))},
+                )
+            except BudgetExceeded as e:
+                raise HTTPException(status_code=429, detail=e.event())
             except Exception as e:
                 raise HTTPException(
                     status_code=500, detail=f"Error processing message: {str(e)}"
                 )
 
+        @self.app.post("/api/chat/stream")
+        async def stream_chat_message(chat_request: ChatRequest, request: Request):
+            """Send a chat message and stream the reply as server-sent events
+
+            Emits ``delta`` events with new text, ``tool_call_start`` and
+            ``tool_call_end`` around each tool call, and a final ``done`` event
+            with the complete message and usage. If the client disconnects,
+            the response task is cancelled and with it the model run.
+            """
+            if not chat_request.session_id:
+                session = self.agent.create_session()
+                chat_request.session_id = session.session_id
+
+            namespace = self._memory_namespace(
+                request, chat_request.user_id, chat_request.session_id
+            )
+
+            async def event_stream() -> AsyncIterator[str]:
+                # The run happens while the response is sent, after this
+                # endpoint returned, so the namespace is set here
+                current_memory_namespace.set(namespace)
+                try:
+                    async for event in self.agent.stream_events(
+                        chat_request.session_id, chat_request.message
+                    ):
+                        yield sse_event(event["type"], event)
+                except asyncio.CancelledError:
+                    logger.info(
+                        f"Client disconnected, cancelled run for session "
+                        f"{chat_request.session_id}"
+                    )
+                    raise
+                except BudgetExceeded as e:
+                    yield sse_event("error", e.event())
+                except Exception as e:
+                    logger.error(f"Error streaming message: {e}")
+                    yield sse_event("error", {"type": "error", "detail": str(e)})
+
+            return StreamingResponse(
+                event_stream(),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+
         @self.app.websocket("/ws/{session_id}")
         async def websocket_endpoint(websocket: WebSocket, session_id: str):
             """WebSocket endpoint for real-time chat"""
             await websocket.accept()
             self.websocket_connections[session_id] = websocket
+            namespace = self._memory_namespace(websocket, session_id=session_id)
 
             try:
                 while True:
@@ -425,21 +630,28 @@ class ChatKitServer:
                             )
                         )
 
-                        # Get and stream agent response
-                        response = await self.agent.send_message(
-                            session_id, message, stream=True
-                        )
-                        async for chunk in response:
-                            await websocket.send_text(
-                                json.dumps(
-                                    {
-                                        "type": "assistant_message",
-                                        "message": chunk.message,
-                                        "session_id": chunk.session_id,
-                                        "metadata": chunk.metadata,
-                                    }
-                                )
+                        # Stream the reply as text deltas; the last message is
+                        # complete and carries the usage
+                        with memory_namespace(namespace):
+                            response = self.agent.send_message(
+                                session_id, message, stream=True
                             )
+                            try:
+                                async for chunk in response:
+                                    await websocket.send_text(
+                                        json.dumps(
+                                            {
+                                                "type": "assistant_message",
+                                                "message": chunk.message,
+                                                "session_id": chunk.session_id,
+                                                "metadata": chunk.metadata,
+                                            }
+                                        )
+                                    )
+                            except BudgetExceeded as e:
+                                await websocket.send_text(
+                                    json.dumps({**e.event(), "session_id": session_id})
+                                )
 
             except WebSocketDisconnect:
                 if session_id in self.websocket_connections:
@@ -447,30 +659,54 @@ class ChatKitServer:
 
         # Memory management endpoints
         @self.app.get("/api/memory")
-        async def get_memory_summary():
-            """Get memory summary"""
+        async def get_memory_summary(request: Request, response: Response):
+            """Get memory summary from the incrementally maintained counters"""
             try:
-                memory_data = chatkit_memory._load_memory()
-                return {
-                    "user_preferences": len(memory_data.get("user_preferences", {})),
-                    "user_facts": len(memory_data.get("user_facts", {})),
-                    "notes": len(memory_data.get("notes", [])),
-                    "conversation_history": len(
-                        memory_data.get("conversation_history", [])
-                    ),
-                    "created_at": memory_data.get("created_at"),
-                    "updated_at": memory_data.get("updated_at"),
-                }
+                memory = await memory_shards.aget(self._memory_namespace(request))
+                stats = await memory.asummary()
             except Exception as e:
                 raise HTTPException(
                     status_code=500, detail=f"Error accessing memory: {str(e)}"
                 )
 
+            sections = stats["sections"]
+            summary = {
+                **{name: section["count"] for name, section in sections.items()},
+                "bytes": {name: section["bytes"] for name, section in sections.items()},
+                "total_bytes": stats["bytes"],
+                "created_at": stats["created_at"],
+                "updated_at": stats["updated_at"],
+            }
+
+            # Pollers revalidate with If-None-Match and get a 304 while unchanged
+            digest = hashlib.sha1(
+                json.dumps(summary, sort_keys=True, default=str).encode("utf-8")
+            ).hexdigest()
+            etag = f'"{digest[:20]}"'
+            headers = {"ETag": etag, "Cache-Control": "no-cache"}
+            if etag in request.headers.get("if-none-match", ""):
+                return Response(status_code=304, headers=headers)
+
+            response.headers.update(headers)
+            return summary
+
+        @self.app.get("/api/memory/search")
+        async def search_memory(q: str, request: Request, k: int = 5):
+            """Search memory facts and notes by relevance"""
+            try:
+                memory = await memory_shards.aget(self._memory_namespace(request))
+                return {"query": q, "results": await memory.asearch(q, k)}
+            except Exception as e:
+                raise HTTPException(
+                    status_code=500, detail=f"Error searching memory: {str(e)}"
+                )
+
         @self.app.delete("/api/memory")
-        async def clear_memory():
+        async def clear_memory(request: Request):
             """Clear all memory"""
             try:
-                result = chatkit_memory.clear_all_memory()
+                memory = await memory_shards.aget(self._memory_namespace(request))
+                result = await memory.aclear_all_memory()
                 return {"message": result}
             except Exception as e:
                 raise HTTPException(
@@ -478,10 +714,11 @@ class ChatKitServer:
                 )
 
         @self.app.post("/api/memory/fact")
-        async def add_user_fact(fact_key: str, fact_value: str):
+        async def add_user_fact(fact_key: str, fact_value: str, request: Request):
             """Add a user fact to memory"""
             try:
-                result = chatkit_memory.add_user_fact(fact_key, fact_value)
+                memory = await memory_shards.aget(self._memory_namespace(request))
+                result = await memory.aadd_user_fact(fact_key, fact_value)
                 return {"message": result}
             except Exception as e:
                 raise HTTPException(
@@ -489,10 +726,11 @@ class ChatKitServer:
                 )
 
         @self.app.post("/api/memory/note")
-        async def add_note(title: str, content: str):
+        async def add_note(title: str, content: str, request: Request):
             """Add a note to memory"""
             try:
-                result = chatkit_memory.add_note(title, content)
+                memory = await memory_shards.aget(self._memory_namespace(request))
+                result = await memory.aadd_note(title, content)
                 return {"message": result}
             except Exception as e:
                 raise HTTPException(
@@ -506,8 +744,76 @@ class ChatKitServer:
         # Tracking for custom events
         self.active_tool_calls: Dict[str, List[Dict]] = {}  # thread_id -> tool calls
 
-        async def custom_event_wrapper(original_stream: AsyncIterator, thread_id: str) -> AsyncIterator:
+        async def admitted(
+            stream: AsyncIterator, agent, thread_id: str, run_id: str
+        ) -> AsyncIterator:
+            """Pass a stream through while holding its run's admission slot
+
+            The slot is only taken once the response starts streaming, so a
+            client that disconnects before then never holds one; a run that
+            is not admitted in time starts and ends with a RUN_ERROR.
+            """
+            try:
+                async with self.agent.admission.admit(
+                    provider_of(agent.model), model_id(agent), thread_id
+                ):
+                    async for chunk in stream:
+                        yield chunk
+            except AdmissionRejected as e:
+                encoder = EventEncoder()
+                yield encoder.encode(RunStartedEvent(thread_id=thread_id, run_id=run_id))
+                yield encoder.encode(RunErrorEvent(message=str(e), code="admission_rejected"))
+
+        def budget_error_events(error: BudgetExceeded) -> List[str]:
+            """AG-UI events reporting a budget error: its details, then RUN_ERROR"""
+            encoder = EventEncoder()
+            return [
+                encoder.encode(CustomEvent(name="budget_exceeded", value=error.event())),
+                encoder.encode(RunErrorEvent(message=str(error), code="budget_exceeded")),
+            ]
+
+        async def guard_budget(
+            stream: AsyncIterator, agent, thread_id: str, usage: RunUsage, used: int, started: float
+        ) -> AsyncIterator:
+            """Report a run stopped by its usage limits as budget error events
+
+            pydantic-ai ends such a run with a bare RUN_ERROR and re-raises the
+            error; the RUN_ERROR is held back and replaced by the structured
+            events, and the tokens the run spent are still recorded.
+            """
+            held = None
+            try:
+                async for chunk in stream:
+                    if held is not None:
+                        yield held
+                        held = None
+                    if sse_event_type(chunk) == "RUN_ERROR":
+                        held = chunk
+                    else:
+                        yield chunk
+            except UsageLimitExceeded as error:
+                self.agent.usage.record(
+                    model_id(agent), usage, [], time.monotonic() - started, session_id=thread_id
+                )
+                await charge_session(self.agent.sessions, thread_id, usage)
+                exceeded = self.agent.budget.exceeded(error, usage, used)
+                for event in budget_error_events(exceeded):
+                    yield event.encode() if isinstance(held, bytes) else event
+                return
+            except Exception:
+                if held is not None:
+                    yield held
+                raise
+            if held is not None:
+                yield held
+
+        async def custom_event_wrapper(
+            original_stream: AsyncIterator, thread_id: str, namespace: Optional[str] = None
+        ) -> AsyncIterator:
             """Wraps AG-UI stream to inject CUSTOM events for tasks, suggestions, usage"""
+            # The agent runs while this stream is consumed, after the endpoint
+            # returned, so memory tools pick up the namespace from here
+            current_memory_namespace.set(namespace)
             encoder = EventEncoder()
             tool_calls_for_tasks = []
             final_usage = None
@@ -605,11 +911,16 @@ class ChatKitServer:
         @self.app.post("/agui")
         async def agui_endpoint(request: Request):
             """AG-UI protocol endpoint with message history and custom events"""
+            started = time.monotonic()
             try:
                 # Parse incoming request
                 body = await request.json()
                 thread_id = body.get("threadId", "default")
                 incoming_messages = body.get("messages", [])
+                forwarded_props = body.get("forwardedProps") or {}
+                namespace = self._memory_namespace(
+                    request, forwarded_props.get("user_id"), thread_id
+                )
 
                 logger.info(f"AG-UI: Request for thread {thread_id} with {len(incoming_messages)} messages")
 
@@ -637,6 +948,35 @@ class ChatKitServer:
                 # Update body with context
                 body["messages"] = context_messages + [msg for msg in incoming_messages if msg.get("role") == "user" and msg not in context_messages]
 
+                # Pre-flight: drop the oldest context messages until the request
+                # fits its input budget, or reject it if the prompt alone doesn't
+                messages = body["messages"]
+                used = await self.agent.session_tokens(thread_id)
+                try:
+                    room = self.agent.budget.context_room(
+                        estimate_tokens(str(messages[-1].get("content", ""))) if messages else 0,
+                        used,
+                    )
+                except BudgetExceeded as e:
+                    logger.info(f"AG-UI: Rejected request for thread {thread_id}: {e}")
+                    started_event = EventEncoder().encode(
+                        RunStartedEvent(thread_id=thread_id, run_id=body.get("runId", ""))
+                    )
+                    return StreamingResponse(
+                        iter([started_event, *budget_error_events(e)]),
+                        media_type="text/event-stream",
+                    )
+                if room is not None:
+                    kept = messages[-1:]
+                    for msg in reversed(messages[:-1]):
+                        room -= estimate_tokens(str(msg.get("content", "")))
+                        if room < 0:
+                            break
+                        kept.insert(0, msg)
+                    if len(kept) < len(messages):
+                        self.agent.budget.stats["trimmed"] += 1
+                        body["messages"] = kept
+
                 # Create new request with modified body
                 modified_body_bytes = json.dumps(body).encode('utf-8')
 
@@ -654,14 +994,40 @@ class ChatKitServer:
 
                 modified_request = Request(scope, receive)
 
+                agent = self.agent.agent_for_session(await self.agent.aget_session(thread_id))
+                usage = RunUsage()
+
+                async def on_complete(result):
+                    self.agent.usage.record(
+                        model_id(agent),
+                        result.usage(),
+                        result.new_messages(),
+                        time.monotonic() - started,
+                        session_id=thread_id,
+                    )
+                    await charge_session(self.agent.sessions, thread_id, result.usage())
+
                 # Get standard AG-UI response with modified request
-                response = await handle_ag_ui_request(self.agent.agent, modified_request)
+                response = await handle_ag_ui_request(
+                    agent,
+                    modified_request,
+                    usage=usage,
+                    usage_limits=self.agent.budget.limits(used),
+                    on_complete=on_complete,
+                )
 
                 # Wrap the streaming response with custom events
                 if isinstance(response, StreamingResponse):
-                    wrapped_stream = custom_event_wrapper(response.body_iterator, thread_id)
+                    guarded_stream = guard_budget(
+                        response.body_iterator, agent, thread_id, usage, used, started
+                    )
+                    wrapped_stream = custom_event_wrapper(
+                        guarded_stream, thread_id, namespace
+                    )
+                    # AG-UI runs stream straight from the agent, so they are
+                    # admitted by the stream itself
                     return StreamingResponse(
-                        wrapped_stream,
+                        admitted(wrapped_stream, agent, thread_id, body.get("runId", "")),
                         media_type="text/event-stream",
                         headers=response.headers
                     )
@@ -3,9 +3,17 @@
 from typing import Dict, List, Any, Optional, Callable
 from pydantic import BaseModel, Field
 from pydantic_ai import Agent
-from pydantic_ai.exceptions import ModelRetry, AgentRunError, ModelHTTPError, UnexpectedModelBehavior
+from pydantic_ai.exceptions import UsageLimitExceeded
+from pydantic_ai.usage import RunUsage
+from .providers import shared_model
+from .resilience import provider_of, resilience
+from .budgets import budget, charge_session, tokens_used
+from .core import ChatSession, estimate_tokens, model_id
+from .sessions import SessionStore, create_session_store
+from .usage import usage_ledger
 from enum import Enum
 import asyncio
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -51,9 +59,19 @@ class Workflow(BaseModel):
 class WorkflowExecutor:
     """Executes multi-agent workflows"""
 
-    def __init__(self):
+    def __init__(self, session_store: Optional[SessionStore] = None):
         self.workflows: Dict[str, Workflow] = {}
         self.agents: Dict[str, Agent] = {}
+        # Where the tokens of each session are saved; share the chat agent's
+        # store so chat turns and workflow runs draw on one session budget
+        self._sessions = session_store
+
+    @property
+    def sessions(self) -> SessionStore:
+        """The session store, opened from the environment on first use"""
+        if self._sessions is None:
+            self._sessions = create_session_store(ChatSession)
+        return self._sessions
 
     def register_workflow(self, workflow: Workflow):
         """Register a workflow"""
@@ -62,7 +80,7 @@ class WorkflowExecutor:
     def create_agent_node(self, node_id: str, name: str, model: str, system_prompt: str) -> WorkflowNode:
         """Create an agent node"""
         agent = Agent(
-            model=model,
+            model=shared_model(model),
             system_prompt=system_prompt
         )
         self.agents[node_id] = agent
@@ -101,9 +119,16 @@ class WorkflowExecutor:
         self,
         workflow_id: str,
         input_data: Dict[str, Any],
-        start_node: Optional[str] = None
+        start_node: Optional[str] = None,
+        session_id: Optional[str] = None
     ) -> Dict[str, Any]:
-        """Execute a workflow with given input"""
+        """Execute a workflow with given input
+
+        Agent runs are recorded in the usage ledger per node, and per session
+        when ``session_id`` is given, whose saved token count they add to.
+        Each agent run is bounded by the per-request budget and by what is
+        left of the session's budget; exceeding either raises BudgetExceeded.
+        """
         workflow = self.workflows.get(workflow_id)
         if not workflow:
             raise ValueError(f"Workflow {workflow_id} not found")
@@ -120,7 +145,8 @@ class WorkflowExecutor:
             start_node = input_nodes[0].id
 
         # Execute workflow
-        results = await self._execute_node(workflow, start_node, input_data, {})
+        context = {"workflow_id": workflow_id, "session_id": session_id}
+        results = await self._execute_node(workflow, start_node, input_data, context)
         return results
 
     async def _execute_node(
@@ -164,33 +190,44 @@ class WorkflowExecutor:
         else:
             user_input = str(input_data)
 
-        # Execute agent with retry logic
-        max_retries = 3
-
-        for attempt in range(max_retries):
-            try:
-                result = await agent.run(user_input)
-
-                return {
-                    "output": result.output,
-                    "node_id": node.id,
-                    "type": "agent_response"
-                }
-
-            except ModelRetry as e:
-                if attempt < max_retries - 1:
-                    print(f"Model requested retry (attempt {attempt + 1}/{max_retries}): {e.message}")
-                    await asyncio.sleep(1)  # Brief delay before retry
-                    continue
-                else:
-                    raise AgentRunError(f"Max retries exceeded: {e.message}")
-            except (ModelHTTPError, UnexpectedModelBehavior) as e:
-                if attempt < max_retries - 1:
-                    print(f"Model error, retrying (attempt {attempt + 1}/{max_retries}): {e}")
-                    await asyncio.sleep(2)  # Longer delay for HTTP errors
-                    continue
-                else:
-                    raise
+        # Pre-flight: a node input larger than a request may send is rejected
+        session_id = context.get("session_id")
+        used = tokens_used(await self.sessions.aget(session_id)) if session_id else 0
+        budget.context_room(estimate_tokens(user_input), used)
+
+        # Execute agent, retrying through the shared policy
+        started = time.monotonic()
+        usage = RunUsage()
+
+        async def record(messages):
+            if session_id:
+                await charge_session(self.sessions, session_id, usage)
+            usage_ledger.record(
+                model_id(agent),
+                usage,
+                messages,
+                time.monotonic() - started,
+                session_id=session_id,
+                node=f"{context.get('workflow_id')}:{node.id}",
+            )
+
+        try:
+            result = await resilience.run(
+                provider_of(agent.model),
+                lambda: agent.run(
+                    user_input, usage=usage, usage_limits=budget.limits(used)
+                ),
+            )
+        except UsageLimitExceeded as error:
+            await record([])
+            raise budget.exceeded(error, usage, used) from error
+        await record(result.new_messages())
+
+        return {
+            "output": result.output,
+            "node_id": node.id,
+            "type": "agent_response"
+        }
 
     async def _execute_tool_node(
         self,
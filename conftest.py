@@ -0,0 +1,49 @@
+"""Shared fixtures: a ChatKitAgent on the test model with its own memory and sessions
+
+The agent runs with history capture, memory prefetch and stream debouncing
+off. A test module changes its environment by overriding ``agent_env``::
+
+    @pytest.fixture
+    def agent_env():
+        return {"CHATKIT_HEDGE": "1"}
+"""
+
+import pytest
+
+from chatkit.core import ChatKitAgent, ChatSession
+from chatkit.memory import ChatKitMemoryTool, MemoryShards
+from chatkit.sessions import SessionStore, SQLiteSessionBackend
+from chatkit.usage import UsageLedger
+
+AGENT_ENV = {
+    "OPENAI_API_KEY": "test",
+    "CHATKIT_CAPTURE_HISTORY": "0",
+    "CHATKIT_MEMORY_PREFETCH_TOKENS": "0",
+    "CHATKIT_STREAM_DEBOUNCE": "0",
+}
+
+
+@pytest.fixture
+def agent_env():
+    """Environment variables set for the agent on top of AGENT_ENV"""
+    return {}
+
+
+@pytest.fixture
+def memory_shards(tmp_path, monkeypatch):
+    """Memory stores in the test's directory, used by every memory tool"""
+    shards = MemoryShards(ChatKitMemoryTool(str(tmp_path), flush_interval=60), str(tmp_path))
+    monkeypatch.setattr("chatkit.memory.memory_shards", shards)
+    yield shards
+    shards.close()
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch, memory_shards, agent_env):
+    for name, value in {**AGENT_ENV, **agent_env}.items():
+        monkeypatch.setenv(name, value)
+    store = SessionStore(SQLiteSessionBackend(tmp_path / "sessions.db"), ChatSession)
+    agent = ChatKitAgent(model="test", session_store=store)
+    agent.usage = UsageLedger()
+    yield agent
+    store.close()
@@ -121,6 +121,8 @@ export default function Page() {
     isLoading,
     isStreaming,
     sendMessage,
+    sessionId,
+    setSessionId,
     toolCalls,
     tokenUsage,
     suggestions: dynamicSuggestions,
@@ -392,7 +394,13 @@ export default function Page() {
 
   const handleModelChange = async (newModelId: string) => {
     try {
-      await agUiClient.switchModel(newModelId);
+      // The switch applies to this chat's session, so make sure it has one
+      let currentSessionId = sessionId;
+      if (!currentSessionId) {
+        currentSessionId = (await agUiClient.createSession()).session_id;
+        setSessionId(currentSessionId);
+      }
+      await agUiClient.switchModel(newModelId, currentSessionId);
       setModel(newModelId);
       console.log(`Switched to model: ${newModelId}`);
     } catch (error) {
@@ -287,18 +287,32 @@ class AgUiClient {
     };
   }
 
+  /**
+   * Headers selecting a session's memory shard (used when the server
+   * scopes memory per session)
+   */
+  private sessionHeaders(sessionId?: string): Record<string, string> {
+    return sessionId ? { 'X-Session-Id': sessionId } : {};
+  }
+
   /**
    * Get memory summary
    */
-  async getMemorySummary(): Promise<{
+  async getMemorySummary(sessionId?: string): Promise<{
     user_preferences: number;
     user_facts: number;
     notes: number;
     conversation_history: number;
+    bytes?: Record<string, number>;
+    total_bytes?: number;
     created_at?: string;
     updated_at?: string;
   }> {
-    const response = await fetch(`${this.baseUrl}/api/memory`);
+    // The server sends an ETag with Cache-Control: no-cache, so the browser
+    // revalidates each poll and unchanged summaries come back as 304s
+    const response = await fetch(`${this.baseUrl}/api/memory`, {
+      headers: this.sessionHeaders(sessionId),
+    });
 
     if (!response.ok) {
       throw new Error(`Failed to get memory summary: ${response.statusText}`);
@@ -310,11 +324,16 @@ class AgUiClient {
   /**
    * Add a user fact to memory
    */
-  async addUserFact(factKey: string, factValue: string): Promise<{ message: string }> {
+  async addUserFact(
+    factKey: string,
+    factValue: string,
+    sessionId?: string
+  ): Promise<{ message: string }> {
     const response = await fetch(`${this.baseUrl}/api/memory/fact`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
+        ...this.sessionHeaders(sessionId),
       },
       body: JSON.stringify({
         fact_key: factKey,
@@ -332,9 +351,10 @@ class AgUiClient {
   /**
    * Clear all memory
    */
-  async clearMemory(): Promise<{ message: string }> {
+  async clearMemory(sessionId?: string): Promise<{ message: string }> {
     const response = await fetch(`${this.baseUrl}/api/memory`, {
       method: 'DELETE',
+      headers: this.sessionHeaders(sessionId),
     });
 
     if (!response.ok) {
@@ -367,15 +387,19 @@ class AgUiClient {
   }
 
   /**
-   * Switch to a different model
+   * Switch the model of one session, or the default model of sessions
+   * that have not chosen one when no sessionId is given
    */
-  async switchModel(modelId: string): Promise<{ message: string; current_model: string }> {
+  async switchModel(
+    modelId: string,
+    sessionId?: string
+  ): Promise<{ message: string; current_model: string; session_id: string | null }> {
     const response = await fetch(`${this.baseUrl}/api/model/switch`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
       },
-      body: JSON.stringify({ model_id: modelId }),
+      body: JSON.stringify({ model_id: modelId, session_id: sessionId }),
     });
 
     if (!response.ok) {
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""Test admission control: concurrency caps, fair queueing and deadlines"""
+
+import asyncio
+
+import pytest
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.models.function import FunctionModel
+
+from chatkit.admission import AdmissionController, AdmissionRejected
+
+
+async def hold(controller, order, name, session_id, release, model="gpt"):
+    async with controller.admit("openai", model, session_id):
+        order.append(name)
+        await release.wait()
+
+
+async def test_sessions_take_turns():
+    """A session with a backlog does not delay another session's request"""
+    controller = AdmissionController(max_concurrency=1)
+    order = []
+    release = asyncio.Event()
+
+    finished = asyncio.Event()
+    finished.set()
+    tasks = [asyncio.create_task(hold(controller, order, "a1", "a", release))]
+    await asyncio.sleep(0)
+    for name, session_id in [("a2", "a"), ("a3", "a"), ("a4", "a"), ("b1", "b")]:
+        tasks.append(asyncio.create_task(hold(controller, order, name, session_id, finished)))
+    await asyncio.sleep(0.01)
+
+    stats = controller.stats()["providers"]["openai"]
+    assert (stats["in_flight"], stats["queue_depth"], stats["sessions_waiting"]) == (1, 4, 2)
+
+    # Each finished run hands its slot to the next session in turn
+    release.set()
+    await asyncio.gather(*tasks)
+    assert order == ["a1", "a2", "b1", "a3", "a4"]
+    assert controller.stats()["providers"]["openai"]["in_flight"] == 0
+
+
+async def test_queue_deadline_and_model_limit():
+    controller = AdmissionController(max_concurrency=2, model_limit=1, queue_timeout=0.05)
+    release = asyncio.Event()
+    order = []
+    holder = asyncio.create_task(hold(controller, order, "first", "a", release))
+    await asyncio.sleep(0)
+
+    # The model is at its limit, but another model still has room
+    with pytest.raises(AdmissionRejected) as excinfo:
+        async with controller.admit("openai", "gpt", "b"):
+            pass
+    assert excinfo.value.reason == "queue timeout"
+    async with controller.admit("openai", "other", "b"):
+        assert controller.stats()["providers"]["openai"]["models"] == {"gpt": 1, "other": 1}
+
+    release.set()
+    await holder
+    stats = controller.stats()["providers"]["openai"]
+    assert (stats["admitted"], stats["timed_out"], stats["queue_depth"]) == (2, 1, 0)
+    assert stats["wait"]["max"] == 0
+
+
+async def test_agent_runs_wait_for_a_slot(agent):
+    agent.admission = AdmissionController(max_concurrency=1)
+
+    running = 0
+    peak = 0
+
+    async def respond(messages, info):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+        return ModelResponse(parts=[TextPart("Done.")])
+
+    agent.agent.model = FunctionModel(respond)
+
+    async def ask(message):
+        session_id = agent.create_session().session_id
+        return [r async for r in agent.send_message(session_id, message)][-1]
+
+    responses = await asyncio.gather(ask("one"), ask("two"), ask("three"))
+
+    assert [response.message for response in responses] == ["Done."] * 3
+    assert peak == 1
+    stats = agent.admission.stats()["providers"]["function"]
+    assert (stats["admitted"], stats["queued"]) == (3, 2)
+    assert stats["wait"]["max"] >= 0.05
+
+
+async def test_retry_waits_without_its_slot(agent, monkeypatch):
+    """A run backing off before a retry lets other sessions use its slot"""
+    from pydantic_ai.exceptions import ModelHTTPError
+
+    from chatkit.resilience import Resilience
+
+    resilience = Resilience()
+    resilience.backoff = lambda attempt: 0.2
+    monkeypatch.setattr("chatkit.core.resilience", resilience)
+    agent.admission = AdmissionController(max_concurrency=1)
+    order = []
+
+    def respond(messages, info):
+        prompt = messages[-1].parts[-1].content
+        order.append(prompt)
+        if order == ["flaky"]:
+            raise ModelHTTPError(503, "test")
+        return ModelResponse(parts=[TextPart(f"Done {prompt}.")])
+
+    agent.agent.model = FunctionModel(respond)
+
+    async def ask(message):
+        session_id = agent.create_session().session_id
+        return [r async for r in agent.send_message(session_id, message)][-1].message
+
+    flaky = asyncio.create_task(ask("flaky"))
+    while not order:
+        await asyncio.sleep(0.01)
+    assert agent.admission.stats()["providers"]["function"]["in_flight"] == 0
+
+    assert await ask("steady") == "Done steady."
+    assert await flaky == "Done flaky."
+    assert order == ["flaky", "steady", "flaky"]
+
+
+async def test_agui_stream_takes_its_slot_when_it_starts(agent):
+    import json
+
+    from starlette.requests import Request
+
+    from chatkit.web import ChatKitServer
+
+    agent.admission = AdmissionController(max_concurrency=1, max_queue=0)
+
+    async def stream(messages, info):
+        yield "Done."
+
+    agent.agent.model = FunctionModel(stream_function=stream)
+    server = ChatKitServer()
+    server.agent = agent
+    endpoint = next(route.endpoint for route in server.app.routes if route.path == "/agui")
+
+    async def post(thread_id):
+        body = json.dumps({
+            "threadId": thread_id,
+            "runId": "r1",
+            "state": {},
+            "messages": [{"id": "m1", "role": "user", "content": "Hi"}],
+            "tools": [],
+            "context": [],
+            "forwardedProps": {},
+        }).encode()
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        scope = {"type": "http", "method": "POST", "path": "/agui", "headers": [], "query_string": b""}
+        return await endpoint(Request(scope, receive))
+
+    def in_flight():
+        return agent.admission.gate("function").in_flight
+
+    # A response that is never streamed (the client went away) holds no slot
+    await post("t1")
+    assert in_flight() == 0
+
+    response = await post("t2")
+    chunks = [chunk async for chunk in response.body_iterator]
+    assert "Done." in "".join(chunks) and in_flight() == 0
+
+    # A run that cannot be admitted starts, then ends with a RUN_ERROR
+    assert agent.admission.gate("function").try_acquire("other")
+    response = await post("t3")
+    chunks = [chunk async for chunk in response.body_iterator]
+    events = [json.loads(chunk.removeprefix("data: ")) for chunk in chunks]
+    assert [event["type"] for event in events] == ["RUN_STARTED", "RUN_ERROR"]
+    assert (events[0]["threadId"], events[0]["runId"]) == ("t3", "r1")
+    assert events[1]["code"] == "admission_rejected"
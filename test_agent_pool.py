@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Test per-session models served from the shared agent pool"""
+
+from unittest import mock
+
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.models.function import FunctionModel
+
+
+def test_switching_reuses_pooled_agents(agent):
+    default = agent.agent
+    assert agent.agent_for_model("openai:gpt-5") is agent.agent_for_model(
+        "openai-responses:gpt-5"
+    )
+
+    with mock.patch("chatkit.core.Agent", side_effect=AssertionError):
+        agent.switch_model("openai:gpt-5")
+        agent.switch_model("test")
+
+    assert agent.agent is default
+    assert agent.agents.stats["built"] == 2
+
+
+async def test_session_model_does_not_leak_into_other_sessions(agent):
+    def reply(text):
+        return FunctionModel(lambda messages, info: ModelResponse(parts=[TextPart(text)]))
+
+    agent.agent.model = reply("default model")
+    agent.agent_for_model("openai:gpt-4o").model = reply("session model")
+
+    alice = agent.create_session("alice")
+    bob = agent.create_session("bob")
+    agent.switch_model("openai:gpt-4o", session_id=alice.session_id)
+
+    answers = {}
+    for session in (alice, bob):
+        async for chunk in agent.send_message(session.session_id, "Hi"):
+            answers[session.session_id] = chunk.message
+
+    assert answers == {"alice": "session model", "bob": "default model"}
+    assert agent.model == "test"
+    assert agent.get_session("alice").metadata["model"] == "openai:gpt-4o"
+
+
+def test_agui_runs_the_session_model(agent):
+    from fastapi.testclient import TestClient
+
+    from chatkit.web import ChatKitServer
+
+    def reply(text):
+        async def stream(messages, info):
+            yield text
+
+        return FunctionModel(stream_function=stream)
+
+    agent.agent.model = reply("default model")
+    agent.agent_for_model("openai:gpt-4o").model = reply("session model")
+    server = ChatKitServer()
+    server.agent = agent
+    client = TestClient(server.app)
+
+    response = client.post(
+        "/api/model/switch", json={"model_id": "openai:gpt-4o", "session_id": "alice"}
+    )
+    assert response.status_code == 200
+    assert agent.model == "test"
+
+    def run(thread_id):
+        body = {
+            "threadId": thread_id,
+            "runId": "r1",
+            "state": {},
+            "messages": [{"id": "m1", "role": "user", "content": "Hi"}],
+            "tools": [],
+            "context": [],
+            "forwardedProps": {},
+        }
+        return client.post("/agui", json=body).text
+
+    assert "session model" in run("alice")
+    assert "default model" in run("bob")
+
+    # Without a session the default changes, for sessions without a model
+    response = client.post("/api/model/switch", json={"model_id": "openai:gpt-4o"})
+    assert response.status_code == 200
+    assert response.json()["session_id"] is None
+    assert agent.model == "openai:gpt-4o"
+    assert "session model" in run("bob")
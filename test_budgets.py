@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""Test per-request and per-session token budgets and their error events"""
+
+import json
+
+import pytest
+from pydantic_ai.messages import ModelResponse, TextPart, ToolCallPart
+from pydantic_ai.models.function import DeltaToolCall, FunctionModel
+
+from chatkit.budgets import BudgetExceeded, TokenBudget, tokens_used
+from chatkit.core import ChatSession, estimate_tokens
+from chatkit.sessions import SessionStore, SQLiteSessionBackend
+from chatkit.usage import UsageLedger
+
+
+def loop(messages, info):
+    """A runaway tool loop: view memory again after every result"""
+    return ModelResponse(parts=[ToolCallPart("view_memory", {})])
+
+
+async def stream_loop(messages, info):
+    yield {0: DeltaToolCall("view_memory", "{}")}
+
+
+def reply(messages, info):
+    return ModelResponse(parts=[TextPart("Sure.")])
+
+
+def test_budget_limits_and_preflight():
+    budget = TokenBudget(request_tokens=500, request_limit=5, session_tokens=800, input_tokens=300)
+
+    limits = budget.limits(used=600)
+    assert (limits.request_limit, limits.tool_calls_limit, limits.total_tokens_limit) == (5, None, 200)
+    assert budget.limits().total_tokens_limit == 500
+    assert TokenBudget().limits().total_tokens_limit is None
+
+    assert budget.context_room(100, used=0) == 200
+    assert budget.context_room(20, used=750) == 30
+    with pytest.raises(BudgetExceeded) as excinfo:
+        budget.context_room(400)
+    assert (excinfo.value.scope, excinfo.value.limit) == ("input", 300)
+    with pytest.raises(BudgetExceeded) as excinfo:
+        budget.context_room(1, used=800)
+    assert excinfo.value.event()["code"] == "budget_exceeded"
+    assert excinfo.value.scope == "session"
+    assert budget.stats["rejected"] == 2
+
+
+async def test_runaway_tool_loop_is_stopped(agent):
+    agent.budget = TokenBudget(request_limit=3)
+    agent.agent.model = FunctionModel(loop)
+    session_id = agent.create_session().session_id
+
+    with pytest.raises(BudgetExceeded) as excinfo:
+        [r async for r in agent.send_message(session_id, "What do you know?")]
+
+    assert excinfo.value.scope == "request"
+    assert "request_limit of 3" in excinfo.value.detail
+    # The tokens the stopped run spent count towards the session
+    entry = agent.usage.get("session", session_id)
+    assert entry["requests"] == 3 and entry["total_tokens"] > 0
+
+
+async def test_session_budget_rejects_before_saving(agent, tmp_path):
+    agent.agent.model = FunctionModel(reply)
+    session_id = agent.create_session().session_id
+    [r async for r in agent.send_message(session_id, "Hi")]
+    spent = await agent.session_tokens(session_id)
+    assert spent > 0
+
+    # The count is saved with the session, not kept by the usage ledger
+    agent.usage = UsageLedger()
+    reopened = SessionStore(SQLiteSessionBackend(tmp_path / "sessions.db"), ChatSession)
+    assert tokens_used(reopened.get(session_id)) == spent
+    reopened.close()
+
+    agent.budget = TokenBudget(session_tokens=spent)
+    with pytest.raises(BudgetExceeded) as excinfo:
+        [r async for r in agent.send_message(session_id, "Again")]
+
+    assert (excinfo.value.scope, excinfo.value.used) == ("session", spent)
+    assert [m.content for m in agent.get_session(session_id).messages] == ["Hi", "Sure."]
+
+
+async def test_workflow_nodes_share_the_session_budget(agent, monkeypatch):
+    from chatkit.workflows import Workflow, WorkflowExecutor
+
+    monkeypatch.setattr("chatkit.workflows.usage_ledger", UsageLedger())
+    executor = WorkflowExecutor(session_store=agent.sessions)
+    node = executor.create_agent_node("triage", "Triage", "test", "Triage requests")
+    executor.agents["triage"].model = FunctionModel(reply)
+    executor.register_workflow(Workflow(id="wf", name="Workflow", nodes={"triage": node}))
+
+    session_id = agent.create_session().session_id
+    await executor.execute_workflow("wf", {"message": "Hi"}, "triage", session_id)
+    spent = await agent.session_tokens(session_id)
+    assert spent > 0
+
+    monkeypatch.setattr("chatkit.workflows.budget", TokenBudget(session_tokens=spent))
+    with pytest.raises(BudgetExceeded) as excinfo:
+        await executor.execute_workflow("wf", {"message": "Hi"}, "triage", session_id)
+    assert excinfo.value.scope == "session"
+
+
+async def test_preflight_trims_history(agent):
+    seen = []
+
+    def respond(messages, info):
+        seen.append(len(messages))
+        return ModelResponse(parts=[TextPart("x" * 200)])
+
+    agent.agent.model = FunctionModel(respond)
+    session_id = agent.create_session().session_id
+    for prompt in ["one", "two"]:
+        [r async for r in agent.send_message(session_id, prompt)]
+    assert seen == [1, 3]
+
+    # Only the newest turn fits next to the system prompt and the message
+    agent.budget = TokenBudget(input_tokens=80 + estimate_tokens(agent.system_prompt))
+    [r async for r in agent.send_message(session_id, "three")]
+    assert seen[-1] == 3
+    assert agent.budget.stats["trimmed"] == 1
+
+    # Memory prefetched into the prompt leaves no room for any turn
+    agent.memory_prefetch_tokens = 60
+    [r async for r in agent.send_message(session_id, "four")]
+    assert seen[-1] == 1
+    assert agent.budget.stats["trimmed"] == 2
+
+    with pytest.raises(BudgetExceeded) as excinfo:
+        [r async for r in agent.send_message(session_id, "y" * 4 * agent.budget.input_tokens + "y")]
+    assert excinfo.value.scope == "input"
+
+
+def test_websocket_sends_budget_error(agent):
+    from fastapi.testclient import TestClient
+
+    from chatkit.web import ChatKitServer
+
+    server = ChatKitServer()
+    server.agent = agent
+    agent.budget = TokenBudget(request_limit=2)
+    agent.agent.model = FunctionModel(loop, stream_function=stream_loop)
+    client = TestClient(server.app)
+
+    with client.websocket_connect("/ws/ws-budget") as websocket:
+        websocket.send_text(json.dumps({"type": "message", "message": "Hi"}))
+        assert websocket.receive_json()["type"] == "user_message"
+        error = websocket.receive_json()
+
+    assert (error["type"], error["code"], error["scope"]) == ("error", "budget_exceeded", "request")
+    assert error["session_id"] == "ws-budget"
+
+
+def test_agui_stream_reports_budget_errors(agent):
+    from fastapi.testclient import TestClient
+
+    from chatkit.web import ChatKitServer
+
+    server = ChatKitServer()
+    server.agent = agent
+    agent.budget = TokenBudget(request_limit=2, input_tokens=50)
+    agent.agent.model = FunctionModel(loop, stream_function=stream_loop)
+    client = TestClient(server.app)
+
+    def run(content, thread_id):
+        body = {
+            "threadId": thread_id,
+            "runId": "r1",
+            "state": {},
+            "messages": [{"id": "m1", "role": "user", "content": content}],
+            "tools": [],
+            "context": [],
+            "forwardedProps": {},
+        }
+        response = client.post("/agui", json=body)
+        assert response.status_code == 200
+        return [
+            json.loads(line.removeprefix("data: "))
+            for line in response.text.split("\n")
+            if line.startswith("data: ")
+        ]
+
+    # Stopped mid-run by the request limit
+    events = run("What do you know?", "t1")
+    custom = [e for e in events if e["type"] == "CUSTOM" and e["name"] == "budget_exceeded"]
+    assert custom[0]["value"]["scope"] == "request"
+    errors = [e for e in events if e["type"] == "RUN_ERROR"]
+    assert [e["code"] for e in errors] == ["budget_exceeded"]
+    assert agent.usage.get("session", "t1")["requests"] == 2
+
+    # Rejected before going upstream
+    events = run("z" * 400, "t2")
+    assert [e["type"] for e in events] == ["RUN_STARTED", "CUSTOM", "RUN_ERROR"]
+    assert events[1]["value"]["scope"] == "input"
+    assert agent.usage.get("session", "t2") is None
+
+
+def test_only_run_error_events_are_held_back():
+    from ag_ui.core import RunErrorEvent, TextMessageContentEvent
+    from ag_ui.encoder import EventEncoder
+
+    from chatkit.web import sse_event_type
+
+    encoder = EventEncoder()
+    error = encoder.encode(RunErrorEvent(message="stopped"))
+    # Text that merely mentions the event type is not an error
+    text = encoder.encode(TextMessageContentEvent(message_id="m1", delta='"RUN_ERROR"'))
+    assert sse_event_type(error) == sse_event_type(error.encode()) == "RUN_ERROR"
+    assert sse_event_type(text) == "TEXT_MESSAGE_CONTENT"
+    assert sse_event_type(": keep-alive\n\n") is None
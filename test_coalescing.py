@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""Test single-flight coalescing of identical in-flight requests"""
+
+import asyncio
+
+import pytest
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.models.function import FunctionModel
+
+from chatkit.budgets import BudgetExceeded, TokenBudget
+
+
+@pytest.fixture
+def agent_env():
+    return {"CHATKIT_COALESCE": "1"}
+
+
+async def ask(agent, message, stream=False):
+    session_id = agent.create_session().session_id
+    return [chunk async for chunk in agent.send_message(session_id, message, stream=stream)]
+
+
+async def test_identical_requests_share_one_run(agent):
+    calls = []
+    release = asyncio.Event()
+
+    async def respond(messages, info):
+        prompt = messages[-1].parts[-1].content
+        calls.append(prompt)
+        await release.wait()
+        return ModelResponse(parts=[TextPart(f"Answer to {prompt}")])
+
+    agent.agent.model = FunctionModel(respond)
+    tasks = [asyncio.create_task(ask(agent, "What's new?")) for _ in range(3)]
+    tasks.append(asyncio.create_task(ask(agent, "Something else")))
+    while len(agent.flights) < 2 or agent.flights.stats["coalesced"] < 2:
+        await asyncio.sleep(0.01)
+    release.set()
+    responses = [chunks[-1] for chunks in await asyncio.gather(*tasks)]
+
+    assert sorted(calls) == ["Something else", "What's new?"]
+    assert [response.message for response in responses[:3]] == ["Answer to What's new?"] * 3
+    assert [response.metadata["coalesced"] for response in responses[:3]].count(False) == 1
+    assert sum(response.metadata["usage"]["requests"] for response in responses) == 2
+    assert agent.flights.stats == {"runs": 2, "coalesced": 2}
+    assert len(agent.flights) == 0
+
+    # Every session gets the shared reply in its own history
+    for response in responses[:3]:
+        history = agent.get_session(response.session_id).history
+        assert history[-1].parts[0].content == "Answer to What's new?"
+
+
+async def test_late_streaming_follower_gets_every_delta(agent):
+    release = asyncio.Event()
+
+    async def stream(messages, info):
+        yield "Hello"
+        await release.wait()
+        yield ", world"
+
+    agent.agent.model = FunctionModel(stream_function=stream)
+    first_delta = asyncio.Event()
+
+    async def leader():
+        chunks = []
+        async for chunk in agent.send_message(agent.create_session().session_id, "hi", stream=True):
+            chunks.append(chunk)
+            first_delta.set()
+        return chunks
+
+    leading = asyncio.create_task(leader())
+    await first_delta.wait()
+    following = asyncio.create_task(ask(agent, "hi", stream=True))
+    while not agent.flights.stats["coalesced"]:
+        await asyncio.sleep(0.01)
+    release.set()
+
+    for chunks in await asyncio.gather(leading, following):
+        assert [chunk.message for chunk in chunks[:-1]] == ["Hello", ", world"]
+        assert chunks[-1].message == "Hello, world"
+    assert agent.flights.stats == {"runs": 1, "coalesced": 1}
+
+
+async def test_run_survives_until_last_subscriber_leaves(agent):
+    release = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def stream(messages, info):
+        yield "Partial"
+        try:
+            await release.wait()
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        yield " answer"
+
+    agent.agent.model = FunctionModel(stream_function=stream)
+
+    async def consume():
+        return [event async for event in agent.stream_events(agent.create_session().session_id, "q")]
+
+    first, second = asyncio.create_task(consume()), asyncio.create_task(consume())
+    while not agent.flights.stats["coalesced"]:
+        await asyncio.sleep(0.01)
+
+    first.cancel()
+    await asyncio.sleep(0.05)
+    assert not cancelled.is_set()
+    release.set()
+    events = await second
+    assert events[-1]["message"] == "Partial answer"
+
+    # Once nobody listens the run itself is cancelled
+    release.clear()
+    lone = asyncio.create_task(consume())
+    while len(agent.flights) == 0:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+    lone.cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+async def test_run_is_cancelled_when_its_leader_leaves_before_subscribing(agent):
+    cancelled = asyncio.Event()
+
+    async def produce(publish):
+        try:
+            await asyncio.sleep(60)
+        finally:
+            cancelled.set()
+
+    async def join_and_wait():
+        agent._join_flight("run", "key", produce)
+        await asyncio.sleep(60)
+
+    task = asyncio.create_task(join_and_wait())
+    while len(agent.flights) == 0:
+        await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+
+
+async def test_budget_error_stays_with_its_session(agent):
+    """A follower runs its own turn when the shared run hit the leader's budget"""
+    calls = []
+    release = asyncio.Event()
+
+    async def respond(messages, info):
+        calls.append(info)
+        await release.wait()
+        return ModelResponse(parts=[TextPart("Answer " * 10)])
+
+    agent.agent.model = FunctionModel(respond)
+    agent.budget = TokenBudget(session_tokens=1000)
+    spent = agent.create_session().session_id
+    agent.sessions.update(spent, lambda session: session.metadata.update(tokens_used=995))
+
+    async def turn(session_id):
+        return [chunk async for chunk in agent.send_message(session_id, "What's new?")]
+
+    leading = asyncio.create_task(turn(spent))
+    while len(agent.flights) == 0:
+        await asyncio.sleep(0.01)
+    following = asyncio.create_task(turn(agent.create_session().session_id))
+    while not agent.flights.stats["coalesced"]:
+        await asyncio.sleep(0.01)
+    release.set()
+
+    with pytest.raises(BudgetExceeded):
+        await leading
+    response = (await following)[-1]
+    assert response.message.startswith("Answer")
+    assert response.metadata["coalesced"] is False
+    assert len(calls) == 2
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""Test hedged requests racing a duplicate against a slow first token"""
+
+import asyncio
+
+import pytest
+from pydantic_ai.messages import ModelResponse, TextPart, ToolCallPart
+from pydantic_ai.models.function import FunctionModel
+
+from chatkit.core import HedgePolicy, model_id
+from chatkit.memory import get_memory
+
+
+@pytest.fixture
+def agent_env():
+    return {"CHATKIT_HEDGE": "1", "CHATKIT_HEDGE_DELAY": "0.05"}
+
+
+def test_delay_follows_latency_percentile():
+    policy = HedgePolicy(
+        percentile=90, default_delay=2.0, min_delay=0.1, window=10, min_samples=10
+    )
+    assert policy.delay("openai:gpt-5") == 2.0
+
+    for i in range(1, 11):
+        policy.record("openai:gpt-5", i / 10)
+    assert policy.delay("openai:gpt-5") == 0.9
+
+    # Old samples age out; the delay never drops below min_delay
+    for _ in range(10):
+        policy.record("openai:gpt-5", 0.01)
+    assert policy.delay("openai:gpt-5") == 0.1
+
+
+async def test_slow_stream_loses_to_hedge(agent):
+    calls = 0
+    primary_cancelled = asyncio.Event()
+
+    async def stream(messages, info):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                primary_cancelled.set()
+                raise
+            yield "Too late"
+        else:
+            yield "Fast "
+            yield "reply"
+
+    agent.agent.model = FunctionModel(stream_function=stream)
+    agent.hedging.min_samples = 1
+    agent.hedging.min_delay = 0
+    session = agent.create_session()
+    chunks = [c async for c in agent.send_message(session.session_id, "hi", stream=True)]
+
+    assert [chunk.message for chunk in chunks] == ["Fast ", "reply", "Fast reply"]
+    assert primary_cancelled.is_set()
+    stats = agent.hedging.summary()
+    assert (stats["requests"], stats["hedged"], stats["hedge_wins"]) == (1, 1, 1)
+    # The losing primary's wait counts too, so the delay does not shrink to
+    # the hedge's latency
+    assert stats["delays"][model_id(agent.agent)] >= 0.05
+
+
+async def test_fast_primary_is_not_hedged(agent):
+    agent.agent.model = FunctionModel(
+        lambda messages, info: ModelResponse(parts=[TextPart("Quick.")])
+    )
+    session = agent.create_session()
+    responses = [r async for r in agent.send_message(session.session_id, "hi")]
+
+    assert responses[-1].message == "Quick."
+    stats = agent.hedging.summary()
+    assert (stats["requests"], stats["hedged"]) == (1, 0)
+    assert list(stats["delays"]) == [model_id(agent.agent)]
+
+
+async def test_hedge_to_fallback_runs_tools_once(agent):
+    agent.hedging.fallback_model = "openai:gpt-4o-mini"
+    fallback = agent.agent_for_model("openai:gpt-4o-mini")
+
+    def model(delay, reply_delay):
+        async def respond(messages, info):
+            if any(part.part_kind == "tool-return" for part in messages[-1].parts):
+                await asyncio.sleep(reply_delay)
+                return ModelResponse(parts=[TextPart("Noted.")])
+            await asyncio.sleep(delay)
+            call = ToolCallPart("add_note", {"title": "Trip", "content": "Lisbon"})
+            return ModelResponse(parts=[call])
+
+        return FunctionModel(respond)
+
+    # The hedge calls the tool first; the primary would call it while the
+    # hedge is still writing its reply
+    agent.agent.model = model(0.2, 0)
+    fallback.model = model(0, 0.3)
+    session = agent.create_session()
+    responses = [r async for r in agent.send_message(session.session_id, "Note my trip")]
+    await asyncio.sleep(0.3)
+
+    assert responses[-1].message == "Noted."
+    notes = get_memory()._load_memory()["notes"]
+    assert [note["title"] for note in notes] == ["Trip"]
+    assert agent.hedging.stats["hedge_wins"] == 1
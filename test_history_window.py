@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""Test native model message history, the token-budgeted window and compaction"""
+
+import asyncio
+
+from pydantic_ai.messages import (
+    ModelRequest,
+    ModelResponse,
+    SystemPromptPart,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+from pydantic_ai.models.function import FunctionModel
+
+from chatkit.core import (
+    ChatKitAgent,
+    ChatSession,
+    estimate_message_tokens,
+    history_window,
+)
+from chatkit.sessions import SessionStore, SQLiteSessionBackend
+from chatkit.usage import UsageLedger
+
+
+def turn(prompt: str, answer: str, tool: bool = False, system: bool = False):
+    parts = [SystemPromptPart("You are helpful.")] if system else []
+    messages = [ModelRequest(parts=[*parts, UserPromptPart(prompt)])]
+    if tool:
+        messages += [
+            ModelResponse(parts=[ToolCallPart("search_memory", {"query": prompt}, "call-1")]),
+            ModelRequest(parts=[ToolReturnPart("search_memory", "nothing", "call-1")]),
+        ]
+    return messages + [ModelResponse(parts=[TextPart(answer)])]
+
+
+def test_window_keeps_whole_recent_turns_and_system_prompt():
+    history = turn("first " * 50, "one", system=True) + turn("second", "two", tool=True)
+    history += turn("third", "three")
+
+    last_two = sum(estimate_message_tokens(message) for message in history[2:])
+    window = history_window(history, last_two)
+
+    assert window[0].parts == [history[0].parts[0]]
+    assert window[1:] == history[2:]
+    assert isinstance(window[2], ModelResponse) and window[3].parts[0].tool_call_id == "call-1"
+
+    # A budget that cuts into a turn drops the whole turn, tool call and result
+    window = history_window(history, last_two - 1)
+    assert window[1:] == history[-2:]
+
+    assert history_window(history, 10**6) == history
+    assert history_window([], 100) == []
+
+
+async def test_session_stores_model_messages_and_sends_window(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("CHATKIT_CAPTURE_HISTORY", "0")
+    monkeypatch.setenv("CHATKIT_MEMORY_PREFETCH_TOKENS", "0")
+    monkeypatch.setenv("CHATKIT_HISTORY_TOKENS", "60")
+
+    seen = []
+
+    def respond(messages, info):
+        seen.append(messages)
+        return ModelResponse(parts=[TextPart("ok " * 20)])
+
+    store = SessionStore(SQLiteSessionBackend(tmp_path / "sessions.db"), ChatSession)
+    agent = ChatKitAgent(model="test", session_store=store)
+    session = agent.create_session()
+
+    with agent.agent.override(model=FunctionModel(respond)):
+        for i in range(4):
+            async for _ in agent.send_message(session.session_id, f"message {i}"):
+                pass
+
+    history = agent.get_session(session.session_id).history
+    assert len(history) == 8
+    assert isinstance(history[0].parts[0], SystemPromptPart)
+
+    prompts = [
+        part.content
+        for message in seen[-1]
+        for part in message.parts
+        if isinstance(part, UserPromptPart)
+    ]
+    assert prompts == ["message 1", "message 2", "message 3"]
+    assert isinstance(seen[-1][0].parts[0], SystemPromptPart)
+    store.close()
+
+
+async def test_long_sessions_are_compacted_in_the_background(tmp_path, monkeypatch):
+    """Older turns are summarized off the request path and resent as a summary"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("CHATKIT_CAPTURE_HISTORY", "0")
+    monkeypatch.setenv("CHATKIT_MEMORY_PREFETCH_TOKENS", "0")
+    monkeypatch.setenv("CHATKIT_HISTORY_TOKENS", "60")
+    monkeypatch.setenv("CHATKIT_COMPACTION_TOKENS", "100")
+
+    seen = []
+    transcripts = []
+    release = asyncio.Event()
+
+    def respond(messages, info):
+        seen.append(messages)
+        return ModelResponse(parts=[TextPart("ok " * 20)])
+
+    async def summarize(messages, info):
+        transcripts.append(messages[-1].parts[-1].content)
+        await release.wait()
+        return ModelResponse(parts=[TextPart("The user counted messages.")])
+
+    store = SessionStore(SQLiteSessionBackend(tmp_path / "sessions.db"), ChatSession)
+    agent = ChatKitAgent(model="test", session_store=store)
+    agent.usage = UsageLedger()
+    session = agent.create_session()
+
+    with agent.agent.override(model=FunctionModel(respond)), agent.summarizer.override(
+        model=FunctionModel(summarize)
+    ):
+        for i in range(4):
+            async for _ in agent.send_message(session.session_id, f"message {i}"):
+                pass
+
+        # The turn that crossed the threshold returned while summarizing waits
+        assert list(agent._compactions) == [session.session_id]
+        spent = await agent.session_tokens(session.session_id)
+        release.set()
+        await asyncio.gather(*agent._compactions.values())
+
+        # Summarizing is paid for by the session
+        compaction = agent.usage.get("node", "compaction")
+        assert compaction["turns"] == 1 and compaction["total_tokens"] > 0
+        assert await agent.session_tokens(session.session_id) == spent + compaction["total_tokens"]
+
+        compacted = agent.get_session(session.session_id)
+        assert compacted.summary == "The user counted messages."
+        assert compacted.summarized == 4
+        assert "User: message 0" in transcripts[0] and "message 2" not in transcripts[0]
+        assert agent.compaction_stats["runs"] == 1
+
+        async for _ in agent.send_message(session.session_id, "message 4"):
+            pass
+
+    system = [
+        part.content
+        for message in seen[-1]
+        for part in message.parts
+        if isinstance(part, SystemPromptPart)
+    ]
+    assert len(system) == 2 and system[1].endswith("The user counted messages.")
+    prompts = [
+        part.content
+        for message in seen[-1]
+        for part in message.parts
+        if isinstance(part, UserPromptPart)
+    ]
+    assert prompts == ["message 2", "message 3", "message 4"]
+    store.close()
+
+
+async def test_compaction_is_admitted_and_held_to_the_budget(agent):
+    """Summarizing takes an admission slot and stops at the session's limits"""
+    from chatkit.admission import AdmissionController
+    from chatkit.budgets import TokenBudget
+
+    agent.history_tokens = 60
+    agent.admission = AdmissionController()
+    # Nothing builds the summarizer before a session needs compacting
+    assert agent._summarizer is None
+
+    session = agent.create_session()
+    with agent.agent.override(
+        model=FunctionModel(lambda messages, info: ModelResponse(parts=[TextPart("ok " * 20)]))
+    ):
+        for i in range(4):
+            async for _ in agent.send_message(session.session_id, f"message {i}"):
+                pass
+    spent = await agent.session_tokens(session.session_id)
+
+    agent.budget = TokenBudget(request_tokens=10)
+    summary = FunctionModel(lambda messages, info: ModelResponse(parts=[TextPart("Counting.")]))
+    with agent.summarizer.override(model=summary):
+        assert not await agent.compact_session(session.session_id)
+
+    assert agent.compaction_stats["failures"] == 1
+    assert agent.admission.stats()["providers"]["openai"]["admitted"] == 1
+    # The stopped summary was still paid for
+    assert await agent.session_tokens(session.session_id) > spent
+    assert agent.get_session(session.session_id).summary is None
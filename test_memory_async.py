@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Test the async memory API"""
+
+import asyncio
+import threading
+
+from anthropic.types.beta import BetaMemoryTool20250818ViewCommand
+
+from chatkit.memory import ChatKitMemoryTool, MemoryShards
+
+
+async def test_async_api_runs_off_the_event_loop(tmp_path):
+    """Disk work happens on the memory executor, not the loop thread"""
+    memory = ChatKitMemoryTool(str(tmp_path), flush_interval=60)
+    loop_thread = threading.get_ident()
+    threads = []
+
+    original = memory.backend.set_fact
+
+    def set_fact(key, value):
+        threads.append(threading.get_ident())
+        return original(key, value)
+
+    memory.backend.set_fact = set_fact
+
+    assert await memory.aadd_user_fact("user_name", "Alice") == "Added user fact: user_name = Alice"
+    assert await memory.aget_user_facts() == {"user_name": "Alice"}
+    assert "user_name" in await memory.aview(
+        BetaMemoryTool20250818ViewCommand(command="view", path="/user_facts")
+    )
+    assert threads and loop_thread not in threads
+    memory.close()
+
+
+async def test_concurrent_async_writes_are_all_kept(tmp_path):
+    """Writers are serialized, so no concurrent update is lost"""
+    memory = ChatKitMemoryTool(str(tmp_path), max_dirty_ops=1)
+
+    await asyncio.gather(
+        *(memory.aadd_user_fact(f"fact_{i}", str(i)) for i in range(25)),
+        *(memory.aadd_note(f"Note {i}", f"topic{i}") for i in range(25)),
+    )
+    memory.close()
+
+    reopened = ChatKitMemoryTool(str(tmp_path))
+    document = await reopened.aload_memory()
+    assert len(document["user_facts"]) == 25
+    assert len(document["notes"]) == 25
+    assert (await reopened.asearch("topic7", k=1))[0]["note"]["title"] == "Note 7"
+    reopened.close()
+
+
+async def test_shards_open_off_the_event_loop(tmp_path):
+    """aget returns the same shard instance as get"""
+    shards = MemoryShards(ChatKitMemoryTool(str(tmp_path)), storage_dir=str(tmp_path))
+    alice = await shards.aget("user:alice")
+    assert alice is shards.get("user:alice")
+    assert await shards.aget(None) is shards.default
+    shards.close()
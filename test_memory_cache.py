@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Test the write-behind cache and journal of the JSON memory backend"""
+
+import json
+from unittest import mock
+
+from chatkit.memory import ChatKitMemoryTool
+from chatkit.storage import JSONFileBackend
+
+
+def read_file(memory: ChatKitMemoryTool) -> dict:
+    with open(memory.memory_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def journal_records(memory: ChatKitMemoryTool) -> list:
+    journal = memory.backend.journal_file
+    if not journal.exists():
+        return []
+    return [json.loads(line) for line in journal.read_text().splitlines()]
+
+
+def test_reads_are_served_from_cache(tmp_path):
+    """A turn with several memory calls parses the file at most once"""
+    memory = ChatKitMemoryTool(str(tmp_path), flush_interval=60)
+    memory._load_memory()
+
+    with mock.patch("chatkit.storage.json.load") as load:
+        memory.add_user_fact("favorite_color", "blue")
+        memory.add_note("Project Ideas", "Build a chatbot with memory")
+        memory.view()
+        assert load.call_count == 0
+
+    memory.close()
+
+
+def test_mutations_are_batched_until_flush(tmp_path):
+    """Writes stay in memory until flushed, then land as journal records"""
+    memory = ChatKitMemoryTool(str(tmp_path), flush_interval=60)
+
+    memory.add_user_fact("favorite_color", "blue")
+    memory.add_user_fact("preferred_language", "python")
+    assert journal_records(memory) == []
+
+    memory.flush()
+    records = journal_records(memory)
+    assert [record["path"] for record in records] == [
+        ["user_facts", "favorite_color"],
+        ["user_facts", "preferred_language"],
+    ]
+    assert read_file(memory)["user_facts"] == {}
+    memory.close()
+
+
+def test_max_dirty_ops_triggers_flush(tmp_path):
+    """Reaching the dirty-op threshold flushes without waiting for the timer"""
+    memory = ChatKitMemoryTool(str(tmp_path), flush_interval=60, max_dirty_ops=2)
+
+    memory.add_user_fact("a", "1")
+    assert journal_records(memory) == []
+    memory.add_user_fact("b", "2")
+    assert len(journal_records(memory)) == 2
+    memory.close()
+
+
+def test_close_compacts_journal_into_snapshot(tmp_path):
+    """Shutdown folds pending changes into chat_memory.json"""
+    memory = ChatKitMemoryTool(str(tmp_path), flush_interval=60)
+    memory.add_note("Shutdown", "Persisted on close")
+    memory.close()
+
+    notes = read_file(memory)["notes"]
+    assert [note["title"] for note in notes] == ["Shutdown"]
+    assert journal_records(memory) == []
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_journal_is_replayed_on_startup(tmp_path):
+    """A process that dies after flushing recovers from snapshot + journal"""
+    memory = ChatKitMemoryTool(str(tmp_path), flush_interval=60)
+    memory.add_user_fact("user_name", "Alex")
+    memory.add_note("Plan", "Ship it")
+    memory.flush()
+
+    # Simulate a crash mid-append of the next record
+    with open(memory.backend.journal_file, "a", encoding="utf-8") as f:
+        f.write('{"op":"set","path":["user_')
+
+    recovered = JSONFileBackend(memory.memory_file)
+    assert recovered.read(["user_facts"]) == {"user_name": "Alex"}
+    assert [note["title"] for note in recovered.read(["notes"])] == ["Plan"]
+
+
+def test_compaction_after_threshold(tmp_path):
+    """A journal past the size threshold is folded into the snapshot"""
+    backend = JSONFileBackend(
+        tmp_path / "chat_memory.json", flush_interval=60, max_dirty_ops=1,
+        compact_threshold=200,
+    )
+    for i in range(5):
+        backend.set_fact(f"fact_{i}", "x" * 50)
+    if backend._compactor:
+        backend._compactor.join()
+
+    snapshot = json.loads((tmp_path / "chat_memory.json").read_text())
+    assert snapshot["_journal_seq"] >= 4
+    assert len(snapshot["user_facts"]) >= 4
+
+    # Records already folded into the snapshot are not applied twice
+    backend.append_note({"title": "once"})
+    backend.flush()
+    if backend._compactor:
+        backend._compactor.join()
+    recovered = JSONFileBackend(tmp_path / "chat_memory.json")
+    assert [note["title"] for note in recovered.read(["notes"])] == ["once"]
+    assert len(recovered.read(["user_facts"])) == 5
+    backend.close()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Test bounded conversation history and its background capture"""
+
+from unittest import mock
+
+import pytest
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.models.function import FunctionModel
+
+from chatkit.core import ChatKitAgent
+from chatkit.memory import (
+    ChatKitMemoryTool,
+    ConversationRecorder,
+    MemoryShards,
+    memory_namespace,
+)
+from chatkit.storage import JSONFileBackend, SQLiteBackend
+
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    default = ChatKitMemoryTool(str(tmp_path), flush_interval=60)
+    shards = MemoryShards(
+        default,
+        str(tmp_path),
+        history_capacities={"default": 5, "session": 2, "user:alice": 3},
+        flush_interval=60,
+    )
+    monkeypatch.setattr("chatkit.memory.memory_shards", shards)
+    yield shards
+    shards.close()
+
+
+def history(memory: ChatKitMemoryTool) -> list:
+    return [entry["user"] for entry in memory._load_memory()["conversation_history"]]
+
+
+@pytest.mark.parametrize("kind", ["json", "sqlite"])
+def test_history_is_bounded(kind, tmp_path):
+    """Batched appends keep only the newest capacity entries"""
+    if kind == "json":
+        backend = JSONFileBackend(tmp_path / "chat_memory.json", flush_interval=60)
+    else:
+        backend = SQLiteBackend(tmp_path / "chat_memory.db")
+    memory = ChatKitMemoryTool(str(tmp_path), backend=backend, history_capacity=4)
+
+    memory.add_conversation_entry("m0", "r0")
+    memory.add_conversation_entries(
+        [{"timestamp": "t", "user": f"m{i}", "assistant": "r"} for i in range(1, 7)]
+    )
+
+    assert history(memory) == ["m3", "m4", "m5", "m6"]
+    assert memory.summary()["sections"]["conversation_history"]["count"] == 4
+    memory.close()
+
+
+def test_capacity_is_configured_per_namespace(shards):
+    assert shards.get(None).history_capacity == 5
+    assert shards.get("session:s1").history_capacity == 2
+    assert shards.get("user:alice").history_capacity == 3
+    assert shards.get("user:bob").history_capacity == 5
+
+    shards.set_history_capacity("session", 10)
+    assert shards.get("session:s1").history_capacity == 10
+
+
+def test_recorder_batches_writes_per_namespace(shards):
+    """Turns are queued in rings and written with one append per namespace"""
+    recorder = ConversationRecorder(interval=60, batch_size=1000)
+    for i in range(4):
+        recorder.record(f"hi {i}", "hello", namespace="session:s1")
+    recorder.record("hello", "hi", namespace="user:alice")
+
+    assert history(shards.get("user:alice")) == []
+    recorder.close()
+
+    # The session ring only holds its 2 newest turns
+    assert history(shards.get("session:s1")) == ["hi 2", "hi 3"]
+    assert history(shards.get("user:alice")) == ["hello"]
+    assert recorder.stats["batches"] == 2
+    assert recorder.stats["overwritten"] == 2
+
+
+def test_recorder_logs_failed_writes(shards, monkeypatch, caplog):
+    """A failed batch is counted and logged, and the writer keeps going"""
+    recorder = ConversationRecorder(interval=60, batch_size=1000)
+    recorder.record("hi", "hello", namespace="session:s1")
+    monkeypatch.setattr(
+        ChatKitMemoryTool, "add_conversation_entries", mock.Mock(side_effect=OSError("disk full"))
+    )
+
+    with caplog.at_level("ERROR", logger="chatkit.memory"):
+        recorder.close()
+
+    assert recorder.stats["errors"] == 1 and recorder.stats["written"] == 0
+    assert "session:s1: disk full" in caplog.text
+
+
+async def test_send_message_captures_history(shards, monkeypatch):
+    """The reply returns before the turn is written, which happens in the background"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("CHATKIT_MEMORY_PREFETCH_TOKENS", "0")
+    recorder = ConversationRecorder(interval=60, batch_size=1000)
+    monkeypatch.setattr("chatkit.core.conversation_recorder", recorder)
+
+    agent = ChatKitAgent(model="test")
+    session = agent.create_session()
+    model = FunctionModel(lambda messages, info: ModelResponse(parts=[TextPart("Hi Alice!")]))
+
+    with memory_namespace("user:alice"), agent.agent.override(model=model):
+        async for response in agent.send_message(session.session_id, "Hello"):
+            assert response.message == "Hi Alice!"
+
+    assert history(shards.get("user:alice")) == []
+    recorder.close()
+    assert history(shards.get("user:alice")) == ["Hello"]
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Test memory prefetched into the prompt before each run"""
+
+import pytest
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.models.function import FunctionModel
+
+from chatkit.core import ChatKitAgent, build_memory_context
+from chatkit.memory import ChatKitMemoryTool, MemoryShards, memory_namespace
+
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    default = ChatKitMemoryTool(str(tmp_path))
+    shards = MemoryShards(default, storage_dir=str(tmp_path), flush_interval=60)
+    monkeypatch.setattr("chatkit.memory.memory_shards", shards)
+    yield shards
+    shards.close()
+
+
+def test_build_memory_context_respects_budget(tmp_path):
+    """Facts come first, relevant notes follow, all within the token budget"""
+    memory = ChatKitMemoryTool(str(tmp_path))
+    memory.add_user_fact("user_name", "Alice")
+    memory.add_note("Trip", "Flying to Lisbon in May")
+    memory.add_note("Groceries", "Buy milk and eggs")
+
+    context, stats = build_memory_context(memory, "when is the lisbon trip?", 200)
+    assert "user_name: Alice" in context
+    assert "Trip: Flying to Lisbon in May" in context
+    assert "Groceries" not in context
+    assert stats["facts"] == 1 and stats["notes"] == 1
+    assert stats["tokens"] <= 200
+
+    assert build_memory_context(memory, "lisbon", 2) == (
+        "",
+        {"facts": 0, "notes": 0, "tokens": 0},
+    )
+    memory.close()
+
+
+async def test_prefetch_skips_memory_tool_round_trip(shards, monkeypatch):
+    """The model sees the user's memory up front and the saved turn is counted"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("CHATKIT_CAPTURE_HISTORY", "0")
+    shards.get("user:alice").add_user_fact("favorite_color", "blue")
+
+    seen = []
+
+    def respond(messages, info):
+        seen.append(messages[-1].instructions or "")
+        return ModelResponse(parts=[TextPart("Your favorite color is blue.")])
+
+    agent = ChatKitAgent(model="test")
+    session = agent.create_session()
+
+    with memory_namespace("user:alice"), agent.agent.override(model=FunctionModel(respond)):
+        responses = [
+            response
+            async for response in agent.send_message(
+                session.session_id, "What is my favorite color?"
+            )
+        ]
+
+    assert "favorite_color: blue" in seen[0]
+    assert responses[0].metadata["memory_prefetch"]["turns_saved"] == 1
+    assert agent.prefetch_stats == {"runs": 1, "prefetched": 1, "turns_saved": 1}
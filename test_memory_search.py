@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Test BM25 search over memory facts and notes"""
+
+import pytest
+from anthropic.types.beta import BetaMemoryTool20250818DeleteCommand
+
+from chatkit.memory import ChatKitMemoryTool
+from chatkit.search import BM25Index, tokenize
+from chatkit.storage import JSONFileBackend, SQLiteBackend
+
+
+def test_tokenize_drops_stopwords():
+    assert tokenize("What is the BEST pizza in Rome?") == ["best", "pizza", "rome"]
+
+
+def test_bm25_ranks_and_updates_incrementally():
+    """Scores favour rarer terms; removals take effect immediately"""
+    index = BM25Index()
+    index.add("a", "python programming language")
+    index.add("b", "hiking in the mountains on weekends")
+    index.add("c", "python snake species")
+
+    assert [doc_id for doc_id, _, _ in index.search("python programming")][0] == "a"
+    assert [doc_id for doc_id, _, _ in index.search("hiking")] == ["b"]
+
+    index.remove("b")
+    assert index.search("hiking") == []
+    index.add("a", "mountain hiking trips")
+    assert [doc_id for doc_id, _, _ in index.search("hiking")] == ["a"]
+    assert len(index) == 2
+
+
+def test_memory_search_returns_top_k(tmp_path):
+    """Memory search returns only the relevant facts and notes"""
+    memory = ChatKitMemoryTool(str(tmp_path), flush_interval=60)
+    memory.add_user_fact("favorite_language", "python")
+    memory.add_user_fact("home_city", "Rome")
+    memory.add_note("Trip planning", "Weekend hiking trip to the Dolomites")
+
+    # Index is built on first search, then maintained incrementally
+    assert memory.search("hiking trip")[0]["note"]["title"] == "Trip planning"
+    memory.add_note("Reading list", "Fluent Python and Designing Data-Intensive Applications")
+
+    results = memory.search("python", k=1)
+    assert len(results) == 1
+    assert results[0]["type"] in ("fact", "note")
+    assert {r.get("key") for r in memory.search("python")} >= {"favorite_language"}
+
+    memory.delete(BetaMemoryTool20250818DeleteCommand(command="delete", path="/user_facts/home_city"))
+    assert memory.search("rome") == []
+    memory.close()
+
+
+@pytest.mark.parametrize("kind", ["json", "sqlite"])
+def test_search_sees_writes_of_other_instances(tmp_path, kind):
+    """Two instances sharing one store, as two server workers would"""
+
+    def open_memory():
+        if kind == "sqlite":
+            backend = SQLiteBackend(tmp_path / "chat_memory.db")
+        else:
+            backend = JSONFileBackend(tmp_path / "chat_memory.json", refresh_interval=0)
+        return ChatKitMemoryTool(str(tmp_path), backend=backend)
+
+    a, b = open_memory(), open_memory()
+    a.add_note("Trip", "Lisbon in May")
+    a.flush()
+    assert [r["note"]["title"] for r in b.search("lisbon")] == ["Trip"]
+
+    a.add_note("Trip2", "Lisbon again in June")
+    a.add_user_fact("city", "Lisbon")
+    a.flush()
+    results = b.search("lisbon")
+    assert {r["note"]["title"] for r in results if r["type"] == "note"} == {"Trip", "Trip2"}
+    assert [r["key"] for r in results if r["type"] == "fact"] == ["city"]
+
+    # B's own writes keep its index current without a rebuild
+    index = b._index
+    b.add_note("Trip3", "Porto after Lisbon")
+    assert b._index is index
+    assert len(b.search("lisbon")) == 4
+    a.close()
+    b.close()
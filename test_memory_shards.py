@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Test per-namespace memory shards"""
+
+import gc
+import sqlite3
+
+import pytest
+
+from chatkit import tools
+from chatkit.memory import (
+    ChatKitMemoryTool,
+    MemoryShards,
+    memory_namespace,
+    resolve_memory_namespace,
+)
+
+
+@pytest.fixture
+def shards(tmp_path):
+    default = ChatKitMemoryTool(str(tmp_path))
+    shards = MemoryShards(default, storage_dir=str(tmp_path), max_open=2, flush_interval=60)
+    yield shards
+    shards.close()
+
+
+def test_namespaces_are_isolated(shards):
+    """Facts stored for one user are invisible to another"""
+    shards.get("user:alice").add_user_fact("user_name", "Alice")
+    shards.get("user:bob").add_user_fact("user_name", "Bob")
+
+    assert shards.get("user:alice").get_user_facts() == {"user_name": "Alice"}
+    assert shards.get("user:bob").get_user_facts() == {"user_name": "Bob"}
+    assert shards.get(None).get_user_facts() == {}
+
+
+def test_lru_evicts_and_rehydrates(shards):
+    """Evicted shards are flushed to disk and reopened on next access"""
+    alice = shards.get("user:alice")
+    alice.add_note("Plan", "Ship it")
+    shards.get("user:bob")
+    shards.get("user:carol")
+
+    assert shards.stats()["open_shards"] == 2
+    reopened = shards.get("user:alice")
+    assert reopened is not alice
+    assert [note["title"] for note in reopened._load_memory()["notes"]] == ["Plan"]
+
+
+def test_evicted_shard_stays_usable_while_held(tmp_path):
+    """An evicted SQLite shard is only closed once nothing holds it"""
+    shards = MemoryShards(
+        ChatKitMemoryTool(str(tmp_path)), storage_dir=str(tmp_path), max_open=1,
+        backend_kind="sqlite",
+    )
+    alice = shards.get("user:alice")
+    shards.get("user:bob")
+    assert shards.stats()["open_shards"] == 1
+
+    # Still in use, e.g. by a request that resolved it before the eviction
+    alice.add_user_fact("city", "Porto")
+    assert alice.get_user_facts() == {"city": "Porto"}
+
+    backend = alice.backend
+    del alice
+    gc.collect()
+    with pytest.raises(sqlite3.ProgrammingError):
+        backend._conn.execute("SELECT 1")
+    assert shards.get("user:alice").get_user_facts() == {"city": "Porto"}
+    shards.close()
+
+
+async def test_tools_resolve_shard_from_context(shards, monkeypatch):
+    """Memory tools write to the namespace of the current request"""
+    monkeypatch.setattr("chatkit.memory.memory_shards", shards)
+
+    with memory_namespace("user:alice"):
+        await tools.add_fact("favorite_color", "blue")
+
+    assert shards.get("user:alice").get_user_facts() == {"favorite_color": "blue"}
+    assert shards.get(None).get_user_facts() == {}
+
+
+def test_resolve_memory_namespace(monkeypatch):
+    """User ids win; sessions only get their own shard when configured"""
+    assert resolve_memory_namespace("alice", "s1") == "user:alice"
+    assert resolve_memory_namespace(None, "s1") is None
+
+    monkeypatch.setenv("CHATKIT_MEMORY_SCOPE", "session")
+    assert resolve_memory_namespace(None, "s1") == "session:s1"
+
+
+def test_memory_routes_reach_the_session_shard(memory_shards, monkeypatch):
+    """With per-session memory, the memory routes use the session's shard"""
+    from fastapi.testclient import TestClient
+
+    from chatkit.web import ChatKitServer
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("CHATKIT_MEMORY_SCOPE", "session")
+    monkeypatch.setattr("chatkit.web.memory_shards", memory_shards)
+    client = TestClient(ChatKitServer().app)
+
+    params = {"fact_key": "city", "fact_value": "Porto", "session_id": "s1"}
+    assert client.post("/api/memory/fact", params=params).status_code == 200
+
+    assert client.get("/api/memory", headers={"X-Session-Id": "s1"}).json()["user_facts"] == 1
+    assert client.get("/api/memory").json()["user_facts"] == 0
+    assert memory_shards.get("session:s1").get_user_facts() == {"city": "Porto"}
+
+    client.delete("/api/memory", params={"session_id": "s1"})
+    assert memory_shards.get("session:s1").get_user_facts() == {}
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Test incrementally maintained memory statistics"""
+
+from unittest import mock
+
+import pytest
+from anthropic.types.beta import (
+    BetaMemoryTool20250818CreateCommand,
+    BetaMemoryTool20250818DeleteCommand,
+    BetaMemoryTool20250818RenameCommand,
+    BetaMemoryTool20250818StrReplaceCommand,
+)
+
+from chatkit.memory import ChatKitMemoryTool, MemoryShards
+from chatkit.storage import (
+    JSONFileBackend,
+    SQLiteBackend,
+    document_stats,
+    format_stats,
+)
+
+
+def make_backend(kind, tmp_path):
+    if kind == "json":
+        return JSONFileBackend(tmp_path / "chat_memory.json", flush_interval=60)
+    return SQLiteBackend(tmp_path / "chat_memory.db")
+
+
+def full_stats(memory: ChatKitMemoryTool) -> dict:
+    document = memory._load_memory()
+    return format_stats(
+        document_stats(document), document.get("created_at"), document.get("updated_at")
+    )
+
+
+@pytest.mark.parametrize("kind", ["json", "sqlite"])
+def test_counters_match_a_full_scan(kind, tmp_path):
+    """Every kind of mutation keeps the counters exact"""
+    memory = ChatKitMemoryTool(str(tmp_path), backend=make_backend(kind, tmp_path))
+
+    memory.add_user_fact("user_name", "Alice")
+    memory.add_user_fact("user_name", "Alice Smith")
+    memory.add_user_fact("city", "Lisbon")
+    memory.add_note("Trip", "Flights booked")
+    for i in range(5):
+        memory.backend.append_conversation({"user": f"hi {i}", "assistant": "hello"}, 3)
+    memory.create(BetaMemoryTool20250818CreateCommand(
+        command="create", path="/user_preferences/theme", file_text="dark"
+    ))
+    memory.str_replace(BetaMemoryTool20250818StrReplaceCommand(
+        command="str_replace", path="/user_facts/city", old_str="Lisbon", new_str="Porto"
+    ))
+    memory.rename(BetaMemoryTool20250818RenameCommand(
+        command="rename", old_path="/user_facts/city", new_path="/user_preferences/city"
+    ))
+    memory.delete(BetaMemoryTool20250818DeleteCommand(
+        command="delete", path="/user_preferences/theme"
+    ))
+
+    stats = memory.summary()
+    assert stats == full_stats(memory)
+    assert stats["sections"]["user_facts"]["count"] == 1
+    assert stats["sections"]["user_preferences"]["count"] == 1
+    assert stats["sections"]["conversation_history"]["count"] == 3
+    assert stats["bytes"] > 0
+
+    memory.clear_all_memory()
+    assert memory.summary() == full_stats(memory)
+    assert memory.summary()["bytes"] == 0
+    memory.close()
+
+
+@pytest.mark.parametrize("kind", ["json", "sqlite"])
+def test_summary_does_not_load_the_document(kind, tmp_path):
+    """Counters are persisted and read back without a full load"""
+    memory = ChatKitMemoryTool(str(tmp_path), backend=make_backend(kind, tmp_path))
+    memory.add_user_fact("user_name", "Alice")
+    memory.add_note("Trip", "Flights booked")
+    memory.close()
+
+    reopened = ChatKitMemoryTool(str(tmp_path), backend=make_backend(kind, tmp_path))
+    if kind == "json":
+        reopened.backend._load()
+    with mock.patch.object(reopened.backend, "document", side_effect=AssertionError):
+        summary = reopened.summary()
+        assert "User facts: 1 items" in reopened.view()
+    assert summary["sections"]["notes"]["count"] == 1
+    reopened.close()
+
+
+def test_memory_endpoint_returns_etag(tmp_path, monkeypatch):
+    """Unchanged polls of /api/memory get a 304"""
+    from fastapi.testclient import TestClient
+
+    from chatkit.web import ChatKitServer
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    shards = MemoryShards(ChatKitMemoryTool(str(tmp_path), flush_interval=60), str(tmp_path))
+    monkeypatch.setattr("chatkit.web.memory_shards", shards)
+    client = TestClient(ChatKitServer().app)
+
+    first = client.get("/api/memory")
+    assert first.status_code == 200
+    assert first.json()["user_facts"] == 0
+    etag = first.headers["etag"]
+
+    assert client.get("/api/memory", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/api/memory/fact", params={"fact_key": "user_name", "fact_value": "Alice"})
+    changed = client.get("/api/memory", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.json()["user_facts"] == 1
+    assert changed.headers["etag"] != etag
+    shards.close()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Test the JSON and SQLite memory storage backends"""
+
+import json
+
+import pytest
+from anthropic.types.beta import (
+    BetaMemoryTool20250818CreateCommand,
+    BetaMemoryTool20250818DeleteCommand,
+    BetaMemoryTool20250818InsertCommand,
+    BetaMemoryTool20250818RenameCommand,
+    BetaMemoryTool20250818StrReplaceCommand,
+    BetaMemoryTool20250818ViewCommand,
+)
+
+from chatkit.memory import ChatKitMemoryTool
+from chatkit.storage import (
+    JSONFileBackend,
+    SQLiteBackend,
+    create_backend,
+    migrate_json_to_sqlite,
+)
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def memory(request, tmp_path):
+    tool = ChatKitMemoryTool(str(tmp_path), backend=create_backend(request.param, tmp_path))
+    yield tool
+    tool.close()
+
+
+def view(memory, path):
+    return memory.view(BetaMemoryTool20250818ViewCommand(command="view", path=path))
+
+
+def test_facts_and_notes(memory):
+    """Domain operations behave the same on every backend"""
+    memory.add_user_fact("user_name", "Alex")
+    memory.add_note("Project Ideas", "Build a chatbot with memory")
+
+    assert memory.get_user_facts() == {"user_name": "Alex"}
+    assert view(memory, "/user_facts/user_name") == "Alex"
+    assert "Project Ideas" in view(memory, "/notes")
+    assert "User facts: 1 items" in memory.view()
+
+    memory.delete(BetaMemoryTool20250818DeleteCommand(command="delete", path="/user_facts/user_name"))
+    assert memory.get_user_facts() == {}
+
+
+def test_path_commands(memory):
+    """view/create/insert/str_replace/rename/delete address nested paths"""
+    memory.create(BetaMemoryTool20250818CreateCommand(command="create", path="/projects/chatkit", file_text=""))
+    memory.insert(BetaMemoryTool20250818InsertCommand(
+        command="insert", path="/projects/chatkit/todo", insert_line=0, insert_text="write docs"
+    ))
+    memory.insert(BetaMemoryTool20250818InsertCommand(
+        command="insert", path="/projects/chatkit/todo", insert_line=0, insert_text="ship"
+    ))
+    assert view(memory, "/projects/chatkit/todo") == "write docs\nship"
+
+    memory.rename(BetaMemoryTool20250818RenameCommand(
+        command="rename", old_path="/projects/chatkit", new_path="/archive/chatkit"
+    ))
+    assert "not found" in view(memory, "/projects/chatkit")
+    assert json.loads(view(memory, "/archive")) == {"chatkit": {"todo": ["write docs", "ship"]}}
+
+    memory.insert(BetaMemoryTool20250818InsertCommand(
+        command="insert", path="/archive/chatkit/status", insert_line=0, insert_text="draft"
+    ))
+    assert "not a string" in memory.str_replace(BetaMemoryTool20250818StrReplaceCommand(
+        command="str_replace", path="/archive/chatkit/status", old_str="draft", new_str="done"
+    ))
+
+    memory.delete(BetaMemoryTool20250818DeleteCommand(command="delete", path="/archive/chatkit/todo"))
+    assert json.loads(view(memory, "/archive/chatkit")) == {"status": ["draft"]}
+    assert "Failed" in memory.delete(BetaMemoryTool20250818DeleteCommand(command="delete", path="/missing"))
+
+
+def test_conversation_history_is_bounded(memory):
+    """History keeps only the most recent entries"""
+    for i in range(105):
+        memory.add_conversation_entry(f"question {i}", f"answer {i}")
+
+    history = memory._load_memory()["conversation_history"]
+    assert len(history) == 100
+    assert history[-1]["user"] == "question 104"
+
+
+def test_sqlite_mutations_are_single_rows(tmp_path):
+    """Facts and notes are stored as individual rows"""
+    backend = SQLiteBackend(tmp_path / "chat_memory.db")
+    backend.set_fact("color", "blue")
+    backend.set_fact("color", "green")
+    backend.append_note({"title": "a", "content": "b", "created_at": "now"})
+
+    assert backend._rows("SELECT COUNT(*) FROM facts")[0][0] == 1
+    assert backend._rows("SELECT COUNT(*) FROM notes")[0][0] == 1
+    assert backend._rows("PRAGMA journal_mode")[0][0] == "wal"
+    backend.close()
+
+
+def test_migrate_json_to_sqlite(tmp_path):
+    """An existing chat_memory.json imports into SQLite unchanged"""
+    source = ChatKitMemoryTool(str(tmp_path))
+    source.add_user_fact("favorite_color", "blue")
+    source.add_note("Project Ideas", "Build a chatbot with memory")
+    source.add_conversation_entry("hi", "hello")
+    source.close()
+    expected = JSONFileBackend(source.memory_file).document()
+
+    counts = migrate_json_to_sqlite(source.memory_file, tmp_path / "chat_memory.db")
+    assert counts == {"user_facts": 1, "notes": 1, "conversation_history": 1}
+
+    backend = SQLiteBackend(tmp_path / "chat_memory.db")
+    assert backend.document() == expected
+    backend.close()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Test memory transactions, snapshot reads and multi-process writers"""
+
+import json
+import multiprocessing
+import os
+from unittest import mock
+
+import pytest
+
+from chatkit.memory import ChatKitMemoryTool
+from chatkit.storage import JSONFileBackend, SQLiteBackend
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def memory(request, tmp_path):
+    if request.param == "json":
+        backend = JSONFileBackend(tmp_path / "chat_memory.json", flush_interval=60)
+    else:
+        backend = SQLiteBackend(tmp_path / "chat_memory.db")
+    memory = ChatKitMemoryTool(str(tmp_path), backend=backend)
+    yield memory
+    memory.close()
+
+
+def test_transaction_commits_together(memory):
+    with memory.transaction() as m:
+        m.add_user_fact("user_name", "Alice")
+        m.add_note("Trip", "Lisbon in May")
+
+    assert memory.get_user_facts() == {"user_name": "Alice"}
+    assert memory.search("lisbon")[0]["note"]["title"] == "Trip"
+
+
+def test_transaction_rolls_back_on_error(memory):
+    memory.add_user_fact("user_name", "Alice")
+
+    with pytest.raises(RuntimeError):
+        with memory.transaction() as m:
+            m.add_user_fact("user_name", "Bob")
+            m.add_note("Draft", "never saved")
+            raise RuntimeError("boom")
+
+    assert memory.get_user_facts() == {"user_name": "Alice"}
+    assert memory._load_memory()["notes"] == []
+    assert memory.search("draft") == []
+
+
+def test_transaction_is_one_journal_write(tmp_path):
+    """All mutations of a transaction land in a single fsynced append"""
+    memory = ChatKitMemoryTool(str(tmp_path), flush_interval=60, max_dirty_ops=1)
+
+    with mock.patch("chatkit.storage.os.fsync", wraps=os.fsync) as fsync:
+        with memory.transaction() as m:
+            for i in range(5):
+                m.add_user_fact(f"fact_{i}", str(i))
+
+    assert fsync.call_count == 1
+    records = [json.loads(line) for line in memory.backend.journal_file.read_text().splitlines()]
+    assert [record["seq"] for record in records] == [1, 2, 3, 4, 5]
+    memory.close()
+
+
+def test_readers_get_immutable_snapshots(tmp_path):
+    """A document handed to a reader never changes under it"""
+    memory = ChatKitMemoryTool(str(tmp_path), flush_interval=60)
+    memory.add_note("First", "one")
+    before = memory._load_memory()
+    notes_before = before["notes"]
+
+    memory.add_note("Second", "two")
+    memory.add_user_fact("user_name", "Alice")
+
+    assert [note["title"] for note in notes_before] == ["First"]
+    assert before["user_facts"] == {}
+    assert [note["title"] for note in memory._load_memory()["notes"]] == ["First", "Second"]
+    memory.close()
+
+
+def test_readers_cannot_change_what_others_see(memory):
+    """Values handed to a reader are its own copies"""
+    memory.add_user_fact("user_name", "Alice")
+    memory.add_note("Trip", "Lisbon in May")
+
+    memory.get_user_facts()["user_name"] = "Mallory"
+    memory.backend.read(["notes"]).clear()
+    memory._load_memory()["user_facts"].clear()
+
+    assert memory.get_user_facts() == {"user_name": "Alice"}
+    assert [note["title"] for note in memory.backend.read(["notes"])] == ["Trip"]
+
+
+def _write_from_process(storage_dir: str, worker: int, count: int):
+    backend = JSONFileBackend(
+        os.path.join(storage_dir, "chat_memory.json"),
+        flush_interval=60,
+        max_dirty_ops=3,
+        compact_threshold=2048,
+    )
+    memory = ChatKitMemoryTool(storage_dir, backend=backend)
+    for i in range(count):
+        if i % 2:
+            memory.add_note(f"Worker {worker} note {i}", "content")
+        else:
+            with memory.transaction() as m:
+                m.add_user_fact(f"worker_{worker}_fact_{i}", str(i))
+    memory.close()
+
+
+def test_processes_do_not_lose_writes(tmp_path):
+    """Workers sharing one memory file keep every write"""
+    JSONFileBackend(tmp_path / "chat_memory.json").close()
+
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=_write_from_process, args=(str(tmp_path), worker, 40))
+        for worker in range(3)
+    ]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    document = JSONFileBackend(tmp_path / "chat_memory.json").document()
+    assert len(document["user_facts"]) == 3 * 20
+    assert len(document["notes"]) == 3 * 20
+
+
+async def test_batched_tools_write_once(tmp_path, monkeypatch):
+    """add_facts and add_notes persist all items with one journal write each"""
+    from chatkit import tools
+    from chatkit.memory import MemoryShards
+
+    default = ChatKitMemoryTool(str(tmp_path), flush_interval=60, max_dirty_ops=1)
+    monkeypatch.setattr("chatkit.memory.memory_shards", MemoryShards(default, str(tmp_path)))
+
+    with mock.patch("chatkit.storage.os.fsync", wraps=os.fsync) as fsync:
+        result = await tools.add_facts([
+            tools.FactItem(fact_key="favorite_music", fact_value="jazz"),
+            tools.FactItem(fact_key="city", fact_value="Porto"),
+            tools.FactItem(fact_key="diet", fact_value="vegetarian"),
+        ])
+        await tools.add_notes([
+            tools.NoteItem(title="Trip", content="Lisbon in May"),
+            tools.NoteItem(title="Gift", content="Book for Sam"),
+        ])
+
+    assert result == "Added 3 user facts: favorite_music, city, diet"
+    assert fsync.call_count == 2
+    assert default.get_user_facts()["city"] == "Porto"
+    assert [note["title"] for note in default._load_memory()["notes"]] == ["Trip", "Gift"]
+    default.close()
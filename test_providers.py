@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Test the shared provider registry and its pooled HTTP clients"""
+
+import asyncio
+from unittest import mock
+
+import httpx
+
+from chatkit.providers import MeteredTransport, ProviderRegistry, provider_registry
+
+
+def test_agents_share_one_client_per_provider(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    from chatkit.core import ChatKitAgent, ChatSession
+    from chatkit.sessions import SessionStore, SQLiteSessionBackend
+    from chatkit.tools import ToolEnabledAgent
+    from chatkit.workflows import WorkflowExecutor
+
+    store = SessionStore(SQLiteSessionBackend(tmp_path / "sessions.db"), ChatSession)
+    chat = ChatKitAgent(model="openai:gpt-4o", session_store=store)
+    executor = WorkflowExecutor()
+    executor.create_agent_node("support", "Support", "openai:gpt-4o-mini", "Help.")
+
+    clients = {
+        chat.agent.model.client._client,
+        chat.agent_for_model("openai-responses:gpt-5").model.client._client,
+        chat.summarizer.model.client._client,
+        ToolEnabledAgent().agent.model.client._client,
+        executor.agents["support"].model.client._client,
+    }
+    assert clients == {provider_registry.http_client("openai")}
+    # Retries are left to the resilience policy
+    assert chat.agent.model.client.max_retries == 0
+    assert provider_registry.provider("anthropic").client.max_retries == 0
+    assert ChatKitAgent(model="test", session_store=store).agent.model.system == "test"
+    store.close()
+
+
+async def test_transport_reports_pool_saturation():
+    registry = ProviderRegistry(max_connections=1, http2=False)
+    client = registry.http_client("openai")
+    release = asyncio.Event()
+
+    class Body(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            await release.wait()
+            yield b"{}"
+
+    async def send(self, request):
+        return httpx.Response(200, stream=Body())
+
+    with mock.patch.object(httpx.AsyncHTTPTransport, "handle_async_request", send):
+        first = asyncio.create_task(client.get("https://api.example.com/a"))
+        second = asyncio.create_task(client.get("https://api.example.com/b"))
+        await asyncio.sleep(0.01)
+
+        stats = registry.stats()["providers"]["openai"]
+        assert stats["in_flight"] == 2
+        assert stats["waited"] == 1
+        assert stats["saturation"] == 2.0
+
+        release.set()
+        await asyncio.gather(first, second)
+
+    stats = registry.stats()["providers"]["openai"]
+    assert (stats["requests"], stats["in_flight"], stats["peak_in_flight"]) == (2, 0, 2)
+    assert isinstance(registry._transports["openai"], MeteredTransport)
+    await registry.aclose()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Test retries with backoff, Retry-After and the per-provider circuit breaker"""
+
+import time
+
+import httpx
+import pytest
+from pydantic_ai.exceptions import ModelHTTPError
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.models.function import FunctionModel
+
+from chatkit.core import ChatKitAgent, ChatSession
+from chatkit.memory import ChatKitMemoryTool, MemoryShards
+from chatkit.resilience import CircuitOpenError, Resilience, provider_of, retry_after
+from chatkit.sessions import SessionStore, SQLiteSessionBackend
+
+
+class APIStatusError(Exception):
+    """Stands in for the SDK error pydantic-ai wraps into ModelHTTPError"""
+
+    def __init__(self, response: httpx.Response):
+        super().__init__(response.status_code)
+        self.response = response
+
+
+def http_error(status: int, **headers) -> ModelHTTPError:
+    error = ModelHTTPError(status, "gpt-test")
+    error.__cause__ = APIStatusError(httpx.Response(status, headers=headers))
+    return error
+
+
+def failing(*errors, result="ok"):
+    calls = []
+
+    async def call():
+        calls.append(time.monotonic())
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return call, calls
+
+
+def test_retry_after_parsing():
+    assert retry_after(http_error(429, **{"retry-after": "2"})) == 2
+    assert retry_after(http_error(429, **{"retry-after-ms": "1500"})) == 1.5
+    assert retry_after(http_error(503, **{"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) == 0
+    assert retry_after(http_error(500)) is None
+    assert retry_after(ValueError()) is None
+
+
+def test_provider_of():
+    assert provider_of("openai-responses:gpt-5") == "openai"
+    assert provider_of("anthropic:claude-3-haiku-20240307") == "anthropic"
+    assert provider_of(FunctionModel(lambda m, i: None)) == "function"
+
+
+async def test_retries_honor_retry_after():
+    resilience = Resilience(base_delay=0, max_attempts=3)
+    call, calls = failing(
+        http_error(429, **{"retry-after": "0.1"}), http_error(503, **{"retry-after": "0"})
+    )
+
+    assert await resilience.run("openai", call) == "ok"
+    assert len(calls) == 3
+    assert calls[1] - calls[0] >= 0.1
+    stats = resilience.stats()
+    assert (stats["retries"], stats["retry_after"]) == (2, 2)
+    assert stats["providers"]["openai"]["state"] == "closed"
+
+
+async def test_client_errors_and_long_retry_after_are_not_retried():
+    resilience = Resilience(base_delay=0)
+    call, calls = failing(http_error(400))
+    with pytest.raises(ModelHTTPError):
+        await resilience.run("openai", call)
+    assert len(calls) == 1
+
+    call, calls = failing(http_error(429, **{"retry-after": "3600"}))
+    with pytest.raises(ModelHTTPError):
+        await resilience.run("openai", call)
+    assert len(calls) == 1
+
+
+async def test_breaker_fails_fast_then_probes():
+    resilience = Resilience(base_delay=0, max_attempts=2, failure_threshold=3, reset_timeout=0.1)
+    outage = [http_error(502)] * 4
+
+    call, calls = failing(*outage)
+    with pytest.raises(ModelHTTPError):
+        await resilience.run("anthropic", call)
+    with pytest.raises(CircuitOpenError):
+        await resilience.run("anthropic", call)
+    assert len(calls) == 3
+    assert resilience.stats()["providers"]["anthropic"]["state"] == "open"
+
+    # Other providers are unaffected
+    ok, _ = failing()
+    assert await resilience.run("openai", ok) == "ok"
+
+    # After the reset timeout one probe goes through and closes the breaker
+    time.sleep(0.1)
+    assert await resilience.run("anthropic", ok) == "ok"
+    breaker = resilience.stats()["providers"]["anthropic"]
+    assert (breaker["state"], breaker["opened"], breaker["rejected"]) == ("closed", 1, 1)
+
+
+async def test_agent_runs_retry_through_shared_policy(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("CHATKIT_CAPTURE_HISTORY", "0")
+    monkeypatch.setenv("CHATKIT_MEMORY_PREFETCH_TOKENS", "0")
+    resilience = Resilience(base_delay=0)
+    monkeypatch.setattr("chatkit.core.resilience", resilience)
+    shards = MemoryShards(ChatKitMemoryTool(str(tmp_path), flush_interval=60), str(tmp_path))
+    monkeypatch.setattr("chatkit.memory.memory_shards", shards)
+    store = SessionStore(SQLiteSessionBackend(tmp_path / "sessions.db"), ChatSession)
+    agent = ChatKitAgent(model="test", session_store=store)
+
+    attempts = []
+
+    def respond(messages, info):
+        attempts.append(messages)
+        if len(attempts) == 1:
+            raise http_error(503)
+        return ModelResponse(parts=[TextPart("Back up.")])
+
+    agent.agent.model = FunctionModel(respond)
+    session = agent.create_session()
+    responses = [r async for r in agent.send_message(session.session_id, "Status?")]
+
+    assert responses[-1].message == "Back up."
+    assert len(attempts) == 2
+    assert resilience.stats()["providers"]["function"]["successes"] == 1
+    store.close()
+    shards.close()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Test the opt-in response cache"""
+
+import pytest
+from pydantic_ai.messages import ModelResponse, TextPart, ToolCallPart
+from pydantic_ai.models.function import FunctionModel
+
+from chatkit.core import ResponseCache
+from chatkit.memory import get_memory
+
+
+@pytest.fixture
+def agent_env():
+    return {"CHATKIT_RESPONSE_CACHE_BYTES": "65536"}
+
+
+async def ask(agent, session_id, message, stream=False):
+    chunks = [chunk async for chunk in agent.send_message(session_id, message, stream=stream)]
+    return chunks[-1]
+
+
+async def test_repeated_prompts_are_served_from_cache(agent):
+    calls = []
+
+    def respond(messages, info):
+        calls.append(messages)
+        return ModelResponse(parts=[TextPart("We open at 9am.")])
+
+    agent.agent.model = FunctionModel(respond)
+    first = await ask(agent, agent.create_session().session_id, "What are your hours?")
+    second = await ask(agent, agent.create_session().session_id, "  What are   your hours? ")
+    streamed = await ask(
+        agent, agent.create_session().session_id, "What are your hours?", stream=True
+    )
+
+    assert len(calls) == 1
+    assert first.metadata["cached"] is False
+    assert second.metadata["cached"] is True and second.message == "We open at 9am."
+    assert streamed.metadata["cached"] is True
+    assert second.metadata["usage"]["requests"] == 0
+    assert agent.get_session(second.session_id).history[-1].parts[0].content == "We open at 9am."
+
+    stats = agent.response_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["stores"]) == (2, 1, 1)
+
+    # The user's memory is part of the key
+    get_memory().add_user_fact("city", "Porto")
+    await ask(agent, agent.create_session().session_id, "What are your hours?")
+    assert len(calls) == 2
+
+    # A fact changed to a value of the same length changes the key too
+    get_memory().add_user_fact("city", "Paris")
+    reply = await ask(agent, agent.create_session().session_id, "What are your hours?")
+    assert len(calls) == 3 and reply.metadata["cached"] is False
+
+
+async def test_runs_with_side_effects_are_not_cached(agent):
+    calls = []
+
+    def respond(messages, info):
+        calls.append(messages)
+        if len(calls) % 2:
+            call = ToolCallPart("add_fact", {"fact_key": "a", "fact_value": "b"})
+            return ModelResponse(parts=[call])
+        return ModelResponse(parts=[TextPart("Saved.")])
+
+    agent.agent.model = FunctionModel(respond)
+    for _ in range(2):
+        response = await ask(agent, agent.create_session().session_id, "Remember a=b")
+        assert response.metadata["cached"] is False
+
+    assert len(calls) == 4
+    assert agent.response_cache.stats()["bypassed"] == 2
+
+
+def test_cache_is_bounded_by_bytes_and_ttl(monkeypatch):
+    cache = ResponseCache(max_bytes=600, ttl=60)
+    for i in range(4):
+        cache.put(f"k{i}", "x" * 200, [])
+    assert cache.stats()["bytes"] <= 600
+    assert cache.get("k0") is None and cache.get("k3") == ("x" * 200, [])
+
+    now = [1000.0]
+    monkeypatch.setattr("chatkit.core.time.monotonic", lambda: now[0])
+    cache.put("fresh", "y", [])
+    now[0] += 61
+    assert cache.get("fresh") is None
+    assert cache.stats()["expired"] == 1
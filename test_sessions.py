@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Test the persistent session store and its bounded LRU"""
+
+import pytest
+
+from chatkit.core import ChatKitAgent, ChatMessage, ChatSession
+from chatkit.sessions import SessionStore, create_session_backend
+
+
+@pytest.fixture(params=["sqlite", "files"])
+def backend_kind(request):
+    return request.param
+
+
+def make_store(kind, tmp_path, **limits) -> SessionStore:
+    return SessionStore(create_session_backend(kind, tmp_path), ChatSession, **limits)
+
+
+def test_evicted_sessions_are_rehydrated(backend_kind, tmp_path):
+    """Sessions over the count limit are dropped and reloaded on access"""
+    store = make_store(backend_kind, tmp_path, max_sessions=2)
+    for i in range(3):
+        session = ChatSession(session_id=f"s{i}")
+        session.messages.append(ChatMessage(role="user", content=f"hello {i}"))
+        store.save(session)
+
+    assert store.stats()["resident"] == 2
+    assert store.stats()["evictions"] == 1
+
+    rehydrated = store.get("s0")
+    assert rehydrated.messages[0].content == "hello 0"
+    assert store.get("s0") is rehydrated
+    assert store.get("missing") is None
+
+    stats = store.stats()
+    assert stats["resident"] == 2
+    assert stats["loads"] == 1
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+    assert stats["hit_rate"] == pytest.approx(1 / 3)
+    store.close()
+
+    reopened = make_store(backend_kind, tmp_path)
+    assert [s.messages[0].content for s in map(reopened.get, ["s0", "s1", "s2"])] == [
+        "hello 0",
+        "hello 1",
+        "hello 2",
+    ]
+    reopened.close()
+
+
+def test_resident_bytes_are_bounded(tmp_path):
+    """Large sessions push older ones out of memory"""
+    store = make_store("sqlite", tmp_path, max_bytes=4096)
+    for i in range(5):
+        session = ChatSession(session_id=f"s{i}")
+        session.messages.append(ChatMessage(role="user", content="x" * 1500))
+        store.save(session)
+
+    stats = store.stats()
+    assert stats["resident_bytes"] <= 4096
+    assert stats["resident"] == 2
+    assert store.get("s0").messages[0].content == "x" * 1500
+    store.close()
+
+
+async def test_agent_sessions_survive_restart(tmp_path, monkeypatch):
+    """Messages sent through the agent are persisted with the session"""
+    from pydantic_ai.messages import ModelResponse, TextPart
+    from pydantic_ai.models.function import FunctionModel
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("CHATKIT_CAPTURE_HISTORY", "0")
+    monkeypatch.setenv("CHATKIT_MEMORY_PREFETCH_TOKENS", "0")
+
+    agent = ChatKitAgent(model="test", session_store=make_store("sqlite", tmp_path))
+    session = agent.create_session()
+    with agent.agent.override(
+        model=FunctionModel(lambda messages, info: ModelResponse(parts=[TextPart("Hi!")]))
+    ):
+        async for _ in agent.send_message(session.session_id, "Hello"):
+            pass
+    agent.sessions.close()
+
+    restarted = ChatKitAgent(model="test", session_store=make_store("sqlite", tmp_path))
+    messages = (await restarted.aget_session(session.session_id)).messages
+    assert [(m.role, m.content) for m in messages] == [("user", "Hello"), ("assistant", "Hi!")]
+    restarted.sessions.close()
+
+
+async def test_concurrent_turns_survive_eviction(tmp_path, monkeypatch):
+    """Turns of one session interleaved with its eviction are all kept"""
+    import asyncio
+
+    from pydantic_ai.messages import ModelResponse, TextPart
+    from pydantic_ai.models.function import FunctionModel
+
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("CHATKIT_CAPTURE_HISTORY", "0")
+    monkeypatch.setenv("CHATKIT_MEMORY_PREFETCH_TOKENS", "0")
+
+    store = make_store("sqlite", tmp_path, max_sessions=1)
+    agent = ChatKitAgent(model="test", session_store=store)
+    session_id = agent.create_session().session_id
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def respond(messages, info):
+        prompt = messages[-1].parts[-1].content
+        if prompt == "slow":
+            started.set()
+            await release.wait()
+        return ModelResponse(parts=[TextPart(f"re: {prompt}")])
+
+    async def turn(message):
+        return [r async for r in agent.send_message(session_id, message)]
+
+    with agent.agent.override(model=FunctionModel(respond)):
+        slow = asyncio.create_task(turn("slow"))
+        await started.wait()
+        # Evicted and reloaded while the slow turn is still running
+        agent.create_session("other")
+        await turn("fast")
+        agent.create_session("another")
+        release.set()
+        await slow
+
+    store.close()
+    reopened = make_store("sqlite", tmp_path)
+    contents = [m.content for m in reopened.get(session_id).messages]
+    assert contents == ["fast", "re: fast", "slow", "re: slow"]
+    reopened.close()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Test delta streaming of agent responses and the SSE chat endpoint"""
+
+import asyncio
+import json
+
+import pytest
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.models.function import DeltaToolCall, FunctionModel
+
+
+WORDS = ["Hello", " there", ",", " Alice", "!"]
+
+
+def respond(messages, info):
+    return ModelResponse(parts=[TextPart("".join(WORDS))])
+
+
+async def stream_words(messages, info):
+    for word in WORDS:
+        yield word
+
+
+async def test_stream_yields_only_new_text(agent):
+    session = agent.create_session()
+    with agent.agent.override(model=FunctionModel(respond, stream_function=stream_words)):
+        chunks = [
+            chunk
+            async for chunk in agent.send_message(session.session_id, "Hi", stream=True)
+        ]
+
+    deltas = [chunk.message for chunk in chunks if not chunk.metadata["complete"]]
+    assert deltas == WORDS
+    assert all(chunk.metadata["delta"] for chunk in chunks[:-1])
+
+    final = chunks[-1]
+    assert final.metadata["complete"] and final.message == "Hello there, Alice!"
+    assert final.metadata["usage"]["requests"] == 1
+    assert final.metadata["usage"]["output_tokens"] > 0
+
+    stored = agent.get_session(session.session_id)
+    assert [(m.role, m.content) for m in stored.messages] == [
+        ("user", "Hi"),
+        ("assistant", "Hello there, Alice!"),
+    ]
+    assert len(stored.history) == 2
+
+
+def test_websocket_streams_deltas(agent):
+    """The WebSocket endpoint iterates the response instead of awaiting it"""
+    from fastapi.testclient import TestClient
+
+    from chatkit.web import ChatKitServer
+
+    server = ChatKitServer()
+    server.agent = agent
+    # The app runs in the test client's own thread, outside any override
+    agent.agent.model = FunctionModel(respond, stream_function=stream_words)
+    client = TestClient(server.app)
+
+    with client.websocket_connect("/ws/ws-session") as websocket:
+        websocket.send_text(json.dumps({"type": "message", "message": "Hi"}))
+        assert websocket.receive_json()["type"] == "user_message"
+        events = [websocket.receive_json() for _ in range(len(WORDS) + 1)]
+
+    assert [event["message"] for event in events[:-1]] == WORDS
+    assert events[-1]["metadata"]["complete"]
+    assert events[-1]["message"] == "Hello there, Alice!"
+
+
+async def stream_with_tool(messages, info):
+    """Call search_memory first, then answer in two chunks"""
+    if not any(
+        part.part_kind == "tool-return" for message in messages for part in message.parts
+    ):
+        yield {0: DeltaToolCall("search_memory", '{"query": "trip"}', tool_call_id="c1")}
+        return
+    yield "Your trip"
+    yield " is in May."
+
+
+def test_sse_endpoint_streams_tool_calls_and_usage(agent, memory_shards):
+    from fastapi.testclient import TestClient
+
+    from chatkit.web import ChatKitServer
+
+    memory_shards.default.add_note("Trip", "Lisbon in May")
+
+    server = ChatKitServer()
+    server.agent = agent
+    agent.agent.model = FunctionModel(respond, stream_function=stream_with_tool)
+    client = TestClient(server.app)
+
+    with client.stream(
+        "POST", "/api/chat/stream", json={"message": "When is my trip?"}
+    ) as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [
+            (block.split("\n")[0].removeprefix("event: "), json.loads(block.split("data: ")[1]))
+            for block in response.read().decode().strip().split("\n\n")
+        ]
+
+    kinds = [kind for kind, _ in events]
+    assert kinds == ["tool_call_start", "tool_call_end", "delta", "delta", "done"]
+    assert events[0][1]["args"] == {"query": "trip"}
+    assert "Lisbon in May" in events[1][1]["result"]
+    done = events[-1][1]
+    assert done["message"] == "Your trip is in May."
+    assert done["usage"]["requests"] == 2 and done["usage"]["tool_calls"] == 1
+
+    session = agent.get_session(done["session_id"])
+    assert session.messages[-1].content == "Your trip is in May."
+
+
+async def test_closing_the_event_stream_cancels_the_run(agent):
+    """An abandoned stream stops the model and leaves the turn unfinished"""
+    cancelled = asyncio.Event()
+
+    async def stream_forever(messages, info):
+        yield "Thinking"
+        try:
+            await asyncio.sleep(60)
+        finally:
+            cancelled.set()
+        yield "never sent"
+
+    session = agent.create_session()
+    seen = []
+
+    async def consume():
+        async for event in agent.stream_events(session.session_id, "Hi"):
+            seen.append(event)
+
+    with agent.agent.override(model=FunctionModel(respond, stream_function=stream_forever)):
+        # The web server cancels the response task like this on disconnect
+        task = asyncio.create_task(consume())
+        while not seen:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    assert seen == [{"type": "delta", "text": "Thinking"}]
+    assert cancelled.is_set()
+    stored = agent.get_session(session.session_id)
+    assert [m.role for m in stored.messages] == ["user"]
+    assert stored.history == []
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Test the usage ledger: tool calls, per-group totals and agent recording"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pydantic_ai.messages import (
+    ModelRequest,
+    ModelResponse,
+    RetryPromptPart,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+from pydantic_ai.models.function import DeltaToolCall, FunctionModel
+from pydantic_ai.usage import RequestUsage, RunUsage
+
+from chatkit.usage import UsageLedger, extract_tool_calls, run_cost
+
+T0 = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def tool_run():
+    return [
+        ModelRequest(parts=[UserPromptPart("Note it", timestamp=T0)]),
+        ModelResponse(
+            parts=[
+                ToolCallPart("add_note", {"title": "Trip"}, tool_call_id="a"),
+                ToolCallPart("search", '{"q": "x"}', tool_call_id="b"),
+            ],
+            timestamp=T0,
+        ),
+        ModelRequest(
+            parts=[
+                ToolReturnPart("add_note", "saved", tool_call_id="a", timestamp=T0 + timedelta(seconds=1.5)),
+                RetryPromptPart("bad query", tool_name="search", tool_call_id="b", timestamp=T0 + timedelta(seconds=0.5)),
+            ]
+        ),
+        ModelResponse(parts=[TextPart("Noted.")], timestamp=T0 + timedelta(seconds=2)),
+    ]
+
+
+def test_extract_tool_calls():
+    calls = extract_tool_calls(tool_run())
+
+    assert [(c["tool_name"], c["args"], c["duration"]) for c in calls] == [
+        ("add_note", {"title": "Trip"}, 1.5),
+        ("search", {"q": "x"}, 0.5),
+    ]
+    assert calls[0]["result"] == "saved" and "error" not in calls[0]
+    assert "bad query" in calls[1]["error"]
+    assert not any(c["builtin"] for c in calls)
+
+
+def test_ledger_groups():
+    ledger = UsageLedger(max_sessions=2)
+    usage = RunUsage(requests=2, input_tokens=100, output_tokens=20, cache_read_tokens=40)
+    ledger.record("openai:gpt-5", usage, tool_run(), 2.0, session_id="s1", node="wf:triage")
+    ledger.record("openai:gpt-5", RunUsage(), [], 0.1, session_id="s2", cached=True)
+    ledger.record("anthropic:claude", RunUsage(requests=1, input_tokens=10), [], 1.0, session_id="s3")
+
+    s1 = ledger.get("session", "s1")
+    assert s1 is None  # The least recently active session was dropped
+    model = ledger.get("model", "openai:gpt-5")
+    assert (model["turns"], model["cached_turns"], model["total_tokens"]) == (2, 1, 120)
+    assert (model["cache_read_tokens"], model["tool_calls"]) == (40, 2)
+    assert ledger.get("node", "wf:triage")["wall_time"] == 2.0
+
+    tool = ledger.get("tool", "add_note")
+    assert (tool["calls"], tool["errors"], tool["avg_duration"]) == (1, 0, 1.5)
+    assert ledger.get("tool", "search")["errors"] == 1
+
+    ranked = ledger.query("model", order_by="input_tokens")
+    assert [row["model"] for row in ranked] == ["openai:gpt-5", "anthropic:claude"]
+    summary = ledger.summary()
+    assert summary["totals"]["turns"] == 3
+    assert summary["totals"]["input_tokens"] == 110
+
+
+def test_unpriced_models_cost_nothing():
+    messages = [ModelResponse(parts=[TextPart("hi")], usage=RequestUsage(input_tokens=10))]
+    assert run_cost(messages) == 0.0
+    messages[0].model_name = "gpt-4o"
+    assert run_cost(messages) > 0
+
+
+@pytest.fixture
+def agent(agent):
+    """The shared agent on a model that adds a note, then confirms it"""
+
+    def noted(messages):
+        return any(part.part_kind == "tool-return" for part in messages[-1].parts)
+
+    def respond(messages, info):
+        if noted(messages):
+            return ModelResponse(parts=[TextPart("Noted.")])
+        call = ToolCallPart("add_note", {"title": "Trip", "content": "Lisbon"})
+        return ModelResponse(parts=[call])
+
+    async def stream(messages, info):
+        if noted(messages):
+            yield "Noted."
+        else:
+            args = '{"title": "Trip", "content": "Lisbon"}'
+            yield {0: DeltaToolCall(name="add_note", json_args=args, tool_call_id="a")}
+
+    agent.agent.model = FunctionModel(respond, stream_function=stream)
+    return agent
+
+
+@pytest.mark.parametrize("stream", [False, True])
+async def test_agent_turns_are_recorded(agent, stream):
+    session_id = agent.create_session().session_id
+    responses = [r async for r in agent.send_message(session_id, "Note my trip", stream=stream)]
+
+    assert responses[-1].message == "Noted."
+    assert [call["tool_name"] for call in responses[-1].tool_calls] == ["add_note"]
+    assert responses[-1].tool_calls[0]["duration"] >= 0
+
+    entry = agent.usage.get("session", session_id)
+    assert (entry["turns"], entry["requests"], entry["tool_calls"]) == (1, 2, 1)
+    assert entry["input_tokens"] > 0 and entry["wall_time"] > 0
+    assert agent.usage.get("tool", "add_note")["calls"] == 1